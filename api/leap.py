@@ -9,8 +9,6 @@ from pathlib import Path
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from main import categorize_leap_content
-
 def categorize_leap(markdown_path, pdf_name, output_folder='output'):
     """
     Categorize markdown content into LEAP framework phases
@@ -23,6 +21,9 @@ def categorize_leap(markdown_path, pdf_name, output_folder='output'):
     Returns:
         dict with LEAP file paths
     """
+    # Imported here so loading this module does not pull in the pipeline
+    from main import categorize_leap_content
+
     # Get absolute paths
     project_root = Path(__file__).parent.parent
     full_markdown_path = project_root / markdown_path
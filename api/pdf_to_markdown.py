@@ -51,6 +51,12 @@ SCOPES = ['https://www.googleapis.com/auth/drive']
 DEFAULT_INPUT_FOLDER = "12jkoNxUr8fJr_hDKquaj73s0AX0AYTQS"
 DEFAULT_OUTPUT_FOLDER = "1l9zQhCkO-NLUDQRlZbliysvc4uHXBJ-X"
 
+IMAGE_MIME_TYPES = {
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+    '.jpg': 'image/jpeg'
+}
+
 class ProcessRequest(BaseModel):
     inputFolderId: Optional[str] = DEFAULT_INPUT_FOLDER
     outputFolderId: Optional[str] = DEFAULT_OUTPUT_FOLDER
@@ -113,8 +119,8 @@ def upload_file_to_drive(service, file_path, folder_id, file_name=None):
         mime_type = 'text/markdown'
     elif file_path.endswith('.txt'):
         mime_type = 'text/plain'
-    elif file_path.endswith('.png'):
-        mime_type = 'image/png'
+    elif Path(file_path).suffix.lower() in IMAGE_MIME_TYPES:
+        mime_type = IMAGE_MIME_TYPES[Path(file_path).suffix.lower()]
     else:
         mime_type = 'application/octet-stream'
 
@@ -148,21 +154,23 @@ def upload_folder_to_drive(service, local_folder, parent_folder_id, folder_name)
 
     return folder, uploaded_files
 
-def process_pdf(pdf_path, pdf_name):
+def process_pdf(pdf_path, pdf_name, profile=None):
     """Process a PDF file - uses core function from main.py"""
 
     # Create temporary output folder
     temp_output = tempfile.mkdtemp()
 
-    # Use the core processing function from main.py
-    from main import process_pdf_to_markdown
+    # Use the core processing function from main.py, run in a supervised
+    # child process that is recycled before it bloats the server
+    from conversion_supervisor import process_pdf_to_markdown
 
-    result = process_pdf_to_markdown(pdf_path, temp_output, pdf_name)
+    result = process_pdf_to_markdown(pdf_path, temp_output, pdf_name, profile=profile)
 
     return {
         'markdown_file': result['markdown_file'],
         'images_folder': result['images_folder'],
         'image_count': result['image_count'],
+        'memory': result['memory'],
         'language': 'en'  # Default for now
     }
 
@@ -173,7 +181,9 @@ def read_root():
         "version": "2.0",
         "endpoints": {
             "/convert": "POST - Convert uploaded PDF to Markdown (for n8n)",
-            "/process": "POST - Process PDFs from Google Drive (automated)"
+            "/process": "POST - Process PDFs from Google Drive (automated)",
+            "/jobs": "POST - Queue an uploaded PDF for background ingestion",
+            "/jobs/{job_id}": "GET - Poll a queued job"
         }
     }
 
@@ -273,13 +283,16 @@ async def process_from_google_drive(request: ProcessRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/convert")
-async def convert_pdf(file: UploadFile = File(...)):
+async def convert_pdf(file: UploadFile = File(...), profile: Optional[str] = None):
     """
     Convert PDF to Markdown with LEAP categorization
 
-    Accepts: PDF file upload
+    Accepts: PDF file upload, optional ?profile=fast|balanced|accurate
     Returns: markdown (base64) + images (base64)
     """
+    if profile and profile not in ('fast', 'balanced', 'accurate'):
+        raise HTTPException(status_code=400, detail=f"Unknown profile: {profile}")
+
     try:
         # Create temporary directory for processing
         with tempfile.TemporaryDirectory() as temp_dir:
@@ -294,7 +307,7 @@ async def convert_pdf(file: UploadFile = File(...)):
             print(f"📄 Processing: {file.filename}")
 
             # Process PDF using the existing function
-            result = process_pdf(pdf_path, pdf_name)
+            result = process_pdf(pdf_path, pdf_name, profile=profile)
 
             print(f"💾 Generated markdown: {result['markdown_file']}")
 
@@ -303,16 +316,18 @@ async def convert_pdf(file: UploadFile = File(...)):
                 markdown_content = f.read()
             markdown_base64 = base64.b64encode(markdown_content.encode('utf-8')).decode('utf-8')
 
-            # Read all images and encode to base64
+            # Read all images (full-size renditions, not thumbnails) and encode to base64
             images_data = []
             if os.path.exists(result['images_folder']):
                 for img_file in sorted(os.listdir(result['images_folder'])):
-                    if img_file.endswith('.png'):
+                    mime_type = IMAGE_MIME_TYPES.get(Path(img_file).suffix.lower())
+                    if mime_type:
                         img_path = os.path.join(result['images_folder'], img_file)
                         with open(img_path, 'rb') as f:
                             img_base64 = base64.b64encode(f.read()).decode('utf-8')
                         images_data.append({
                             "fileName": img_file,
+                            "mimeType": mime_type,
                             "data": img_base64
                         })
 
@@ -325,16 +340,63 @@ async def convert_pdf(file: UploadFile = File(...)):
                 "markdownData": markdown_base64,
                 "images": images_data,
                 "language": result['language'],
-                "imageCount": result['image_count']
+                "imageCount": result['image_count'],
+                "peakRssMb": result['memory']['peak_rss_mb']
             })
 
     except Exception as e:
         print(f"❌ Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/jobs")
+async def queue_pdf(file: UploadFile = File(...)):
+    """
+    Queue an uploaded PDF for background ingestion (see ingest_worker.py)
+
+    Returns: job id to poll with GET /jobs/{job_id}
+    """
+    import hashlib
+    import job_queue
+
+    # Stored by content, so an upload that shares a filename with a queued one
+    # neither overwrites its file nor is mistaken for the same job
+    data = await file.read()
+    doc_hash = hashlib.sha256(data).hexdigest()
+    upload_dir = Path(__file__).parent.parent / 'temp' / 'jobs'
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    pdf_path = upload_dir / f"{doc_hash}.pdf"
+
+    if not pdf_path.exists():
+        tmp_path = upload_dir / f".{doc_hash}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, pdf_path)
+
+    job_id = job_queue.enqueue_ingest(str(pdf_path), Path(file.filename).name, job_key=doc_hash)
+    return JSONResponse({"success": True, "jobId": job_id}, status_code=202)
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: int):
+    """Poll a queued job's status and progress"""
+    import job_queue
+
+    job = job_queue.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
+    from converter_pool import get_pool_stats
+    from conversion_cache import get_cache_stats
+    from conversion_supervisor import get_supervisor_stats
+
+    return {
+        "status": "healthy",
+        "converter_pool": get_pool_stats(),
+        "conversion_cache": get_cache_stats(),
+        "conversion_supervisor": get_supervisor_stats()
+    }
 
 if __name__ == "__main__":
     import uvicorn
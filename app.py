@@ -8,11 +8,15 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 import base64
+import json
 from io import BytesIO
 from PIL import Image
 
 # Import custom modules
-from document_processor import process_and_prepare
+from blob_store import get_store
+from conversion_cache import file_sha256
+from document_identity import check_pdf
+from job_queue import enqueue_ingest, latest_jobs_by_key
 from supabase_utils import SupabaseManager
 from qa_agent import QAAgent
 
@@ -127,6 +131,55 @@ if 'processed_files' not in st.session_state:
 if 'current_page' not in st.session_state:
     st.session_state.current_page = "Chat"
 
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_blob(key: str) -> bytes:
+    """Image bytes from the blob store; keys are content hashes, so never stale"""
+    return get_store().get(key)
+
+
+# Duplicate check of each upload, made once at upload time, by file SHA-256
+UPLOAD_CHECK_DIR = Path("temp/upload_checks")
+
+
+def check_upload(pdf_path: Path) -> dict:
+    """Check an uploaded PDF against the library and keep the result"""
+    result = check_pdf(str(pdf_path), SupabaseManager())
+    upload_check = {'doc_hash': result['doc_hash'], 'matches': result['matches']}
+    UPLOAD_CHECK_DIR.mkdir(parents=True, exist_ok=True)
+    (UPLOAD_CHECK_DIR / f"{upload_check['doc_hash']}.json").write_text(json.dumps(upload_check))
+    return upload_check
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def upload_hash(path: str, mtime: float, size: int) -> str:
+    """SHA-256 of an uploaded file (cached per file version)"""
+    return file_sha256(path)
+
+
+def load_upload_check(pdf_path: Path):
+    """The check saved when the file was uploaded, or None"""
+    stat = pdf_path.stat()
+    check_file = UPLOAD_CHECK_DIR / f"{upload_hash(str(pdf_path), stat.st_mtime, stat.st_size)}.json"
+    try:
+        return json.loads(check_file.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def describe_match(match: dict) -> str:
+    return f"{match['filename']} ({match['kind']}, {match['similarity']:.0%})"
+
+
+def show_image(img_data: dict) -> None:
+    """Render a retrieved image, fetching its bytes only now"""
+    if img_data.get('blob_key'):
+        img_bytes = load_blob(img_data['blob_key'])
+    else:
+        img_bytes = base64.b64decode(img_data['image_data'])  # stored before the blob store
+    st.image(Image.open(BytesIO(img_bytes)), use_container_width=not img_data.get('is_thumbnail'))
+
+
 # Sidebar navigation
 with st.sidebar:
     st.title("🤖 IR AI")
@@ -217,13 +270,11 @@ if st.session_state.current_page == "Chat":
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
-            # Display images inline if present
+            # Display images inline if present (thumbnails by default, fetched on render)
             if "images" in message and message["images"]:
                 for img_data in message["images"]:
                     try:
-                        img_bytes = base64.b64decode(img_data['image_data'])
-                        img = Image.open(BytesIO(img_bytes))
-                        st.image(img, use_container_width=True)
+                        show_image(img_data)
                     except:
                         pass  # Skip if image data is invalid
 
@@ -250,10 +301,7 @@ if st.session_state.current_page == "Chat":
                     # Display relevant images inline (like ChatGPT)
                     if result.get('images'):
                         for idx, img_data in enumerate(result['images'][:3]):
-                            # Decode base64 image
-                            img_bytes = base64.b64decode(img_data['image_data'])
-                            img = Image.open(BytesIO(img_bytes))
-                            st.image(img, use_container_width=True)
+                            show_image(img_data)
 
                     # Display confidence and sources at the bottom
                     st.caption(f"Confidence: {result['confidence'].upper()} | Chunks used: {result['chunks_used']}")
@@ -319,9 +367,21 @@ elif st.session_state.current_page == "Library":
                         with open(pdf_path, 'wb') as f:
                             f.write(uploaded_file.getbuffer())
 
-                        st.success(f"✅ Uploaded {uploaded_file.name}")
-                        st.session_state.show_upload_modal = False
-                        st.rerun()
+                        # Catch re-uploads and near duplicates before any conversion work
+                        try:
+                            matches = check_upload(pdf_path)['matches']
+                        except Exception as e:
+                            st.warning(f"⚠️ Could not check for duplicates: {str(e)}")
+                            matches = []
+
+                        identical = [m for m in matches if m['kind'] == 'identical']
+                        if identical:
+                            pdf_path.unlink()
+                            st.warning(f"⚠️ This file is already in the library as {identical[0]['filename']}; not uploaded")
+                        else:
+                            st.success(f"✅ Uploaded {uploaded_file.name}")
+                            st.session_state.show_upload_modal = False
+                            st.rerun()
 
             with col2:
                 if st.button("❌ Cancel"):
@@ -349,6 +409,17 @@ elif st.session_state.current_page == "Library":
         # Combine both lists
         all_files = set(uploaded_files + processed_filenames)
 
+        # Ingestion runs in ingest_worker.py; show the latest job per file
+        jobs = latest_jobs_by_key('ingest')
+        active_jobs = [job for job in jobs.values() if job['status'] in ('queued', 'running')]
+        if active_jobs:
+            info_col, refresh_col = st.columns([4, 1])
+            with info_col:
+                st.caption(f"⚙️ {len(active_jobs)} file(s) queued or processing in the background")
+            with refresh_col:
+                if st.button("🔄 Refresh"):
+                    st.rerun()
+
         if all_files:
             # Table header
             col1, col2, col3, col4, col5 = st.columns([3, 2, 2, 1.5, 1.5])
@@ -375,51 +446,94 @@ elif st.session_state.current_page == "Library":
                 if is_processed:
                     doc_data = next((d for d in processed_docs if d['filename'] == filename), None)
 
+                # An upload whose content differs from the stored document is pending
+                # (documents stored before content hashing, md5 of the name, match by filename)
+                upload_path = temp_upload_dir / filename
+                upload_check = load_upload_check(upload_path) if upload_path.exists() else None
+                if upload_check and doc_data and len(doc_data['doc_hash']) == 64:
+                    is_processed = upload_check['doc_hash'] == doc_data['doc_hash']
+
+                # Matches were found at upload time; drop documents deleted since
+                stored_ids = {d['id'] for d in processed_docs or []}
+                similar = [
+                    m for m in (upload_check or {}).get('matches', [])
+                    if m['kind'] != 'identical' and m['id'] in stored_ids
+                ]
+                # Documents this upload could be stored as a new version of
+                candidates = [m for m in similar if m['kind'] in ('same text', 'revision')]
+                replaces = None
+
+                job = jobs.get(filename)
+                job_active = job is not None and job['status'] in ('queued', 'running')
+
+                # A write that was interrupted (not one still running) can be re-processed
+                incomplete = (
+                    doc_data is not None and doc_data.get('ingest_status') == 'ingesting' and not job_active
+                )
+                if incomplete:
+                    is_processed = False
+
                 with col1:
                     st.text(filename)
 
                 with col2:
-                    if is_processed:
+                    if job_active and job['status'] == 'running':
+                        st.info(f"⚙️ {job['progress']:.0%} {job['message'] or 'Processing'}")
+                    elif job_active:
+                        st.info("🕒 Queued")
+                    elif is_processed:
                         st.success("✅ Processed")
+                    elif job is not None and job['status'] == 'failed':
+                        st.error("❌ Failed", help=job['error'])
+                    elif incomplete:
+                        st.warning("⚠️ Incomplete", help="Ingestion was interrupted; process again to finish it")
                     else:
                         st.warning("⏳ Pending")
 
                 with col3:
                     if is_processed and doc_data:
                         st.text(f"{doc_data['chunk_count']} chunks, {doc_data['image_count']} imgs")
+                    elif similar:
+                        st.warning(f"Similar to {describe_match(similar[0])}",
+                                   help="\n".join(describe_match(m) for m in similar))
+                        if candidates and not job_active:
+                            # Opt-in: a new record unless the user picks a document
+                            # (begin_document still updates a revision under the same filename)
+                            same_name = any(m['filename'] == filename for m in candidates)
+                            default_label = "Update the same-named document" if same_name else "Store as a new document"
+                            by_id = {m['id']: m for m in candidates}
+                            replaces = st.selectbox(
+                                "Store as",
+                                [None] + list(by_id),
+                                format_func=lambda doc_id: default_label if doc_id is None
+                                else f"New version of {describe_match(by_id[doc_id])}",
+                                key=f"replaces_{filename}",
+                                label_visibility="collapsed"
+                            )
                     else:
                         st.text("Not processed")
 
                 with col4:
-                    # Process button
+                    # Process button (queues the file for a background worker)
                     if st.button(
                         "🔄 Process",
                         key=f"process_{filename}",
-                        disabled=is_processed,
-                        help="Convert to markdown and store" if not is_processed else "Already processed"
+                        disabled=is_processed or job_active,
+                        help="Already processed" if is_processed else (
+                            "Processing in the background" if job_active else (
+                                f"Store as a new version of {describe_match(by_id[replaces])}" if replaces
+                                else "Convert to markdown and store"
+                            )
+                        )
                     ):
-                        with st.spinner(f"Processing {filename}..."):
-                            try:
-                                pdf_path = temp_upload_dir / filename
-
-                                # Process PDF
-                                st.info("⚙️ Extracting text and images...")
-                                processed_data = process_and_prepare(str(pdf_path), filename)
-
-                                # Store in Supabase
-                                st.info("💾 Storing in Supabase...")
-                                result = supabase_manager.store_document(
-                                    filename=processed_data['filename'],
-                                    full_text=processed_data['full_text'],
-                                    chunks=processed_data['chunks'],
-                                    images=processed_data['images']
-                                )
-
-                                st.success(f"✅ Successfully processed {filename}")
-                                st.rerun()
+                        try:
+                            pdf_path = temp_upload_dir / filename
+                            job_id = enqueue_ingest(str(pdf_path), filename, replaces=replaces)
+                            st.success(f"✅ Queued {filename} (job {job_id})")
+                            st.rerun()
 
-                            except Exception as e:
-                                st.error(f"❌ Error: {str(e)}")
+                        except Exception as e:
+                            st.error(f"❌ Error: {str(e)}")
 
                 with col5:
                     # Delete button
@@ -429,6 +543,8 @@ elif st.session_state.current_page == "Library":
                                 # Delete from temp if exists
                                 temp_file = temp_upload_dir / filename
                                 if temp_file.exists():
+                                    if upload_check:
+                                        (UPLOAD_CHECK_DIR / f"{upload_check['doc_hash']}.json").unlink(missing_ok=True)
                                     temp_file.unlink()
 
                                 # Delete from database if processed
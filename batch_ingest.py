@@ -0,0 +1,217 @@
+"""
+Batch ingestion - convert a whole folder of PDFs in parallel
+Each worker process holds its own warm Docling converter
+
+Usage:
+    python batch_ingest.py temp/uploads --workers 8
+    python batch_ingest.py input --mode chunks --output output/batch
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+
+def _init_worker(threads_per_worker: int, profile: str = None):
+    """Warm the profile's converters once per worker, before any PDF is assigned"""
+    # Split the cores between workers instead of every torch runtime claiming all of them
+    os.environ.setdefault('OMP_NUM_THREADS', str(threads_per_worker))
+
+    from pdf_conversion import warm_converters
+
+    warm_converters(profile)
+
+
+def _process_one(pdf_path: str, output_folder: str, mode: str, enable_leap: bool, profile: str = None) -> Dict:
+    """Convert a single PDF inside a worker process"""
+    pdf_name = Path(pdf_path).stem
+    start = time.perf_counter()
+
+    try:
+        if mode == 'chunks':
+            from document_processor import DocumentProcessor
+
+            # Files are already spread across workers, so don't shard inside one
+            result = DocumentProcessor(shard_workers=1, profile=profile).process_pdf(pdf_path)
+            result_file = os.path.join(output_folder, f"{pdf_name}_chunks.json")
+
+            with open(result_file, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'filename': Path(pdf_path).name,
+                    'full_text': result['full_text'],
+                    'chunks': result['chunks'],
+                    'images': result['images']
+                }, f, ensure_ascii=False)
+
+            outputs = {
+                'result_file': result_file,
+                'chunk_count': len(result['chunks']),
+                'image_count': len(result['images']),
+                'timings': result['timings']
+            }
+        else:
+            from main import process_pdf_to_markdown
+
+            result = process_pdf_to_markdown(
+                pdf_path,
+                output_folder,
+                pdf_name,
+                enable_leap=enable_leap,
+                shard_workers=1,
+                profile=profile
+            )
+            outputs = {
+                'markdown_file': result['markdown_file'],
+                'images_folder': result['images_folder'],
+                'image_count': result['image_count'],
+                'leap_files': result['leap_files'],
+                'timings': result['timings']
+            }
+
+        return {
+            'pdf': pdf_path,
+            'status': 'ok',
+            'seconds': round(time.perf_counter() - start, 2),
+            'worker_pid': os.getpid(),
+            **outputs
+        }
+
+    except Exception as e:
+        return {
+            'pdf': pdf_path,
+            'status': 'error',
+            'seconds': round(time.perf_counter() - start, 2),
+            'worker_pid': os.getpid(),
+            'error': str(e)
+        }
+
+
+def find_pdfs(input_folder: str) -> List[str]:
+    """List PDFs in a folder, largest first so long jobs start early"""
+    pdfs = [p for p in Path(input_folder).iterdir() if p.suffix.lower() == '.pdf' and p.is_file()]
+    pdfs.sort(key=lambda p: p.stat().st_size, reverse=True)
+    return [str(p) for p in pdfs]
+
+
+def run_batch(
+    input_folder: str,
+    output_folder: str = 'output',
+    workers: int = None,
+    mode: str = 'markdown',
+    enable_leap: bool = False,
+    profile: str = None
+) -> Dict:
+    """
+    Convert every PDF in a folder across a pool of worker processes
+
+    Args:
+        input_folder: Folder containing PDFs
+        output_folder: Where per-file results and manifest.json are written
+        workers: Number of worker processes (default: CPU count)
+        mode: 'markdown' (process_pdf_to_markdown) or 'chunks' (DocumentProcessor)
+        enable_leap: Generate LEAP files in markdown mode
+        profile: Speed profile 'fast', 'balanced' or 'accurate' (default: PDF_PROFILE)
+
+    Returns:
+        The manifest dict (also saved as manifest.json)
+    """
+    pdfs = find_pdfs(input_folder)
+    os.makedirs(output_folder, exist_ok=True)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(pdfs) or 1))
+
+    print(f"📂 Found {len(pdfs)} PDF(s) in {input_folder}")
+    print(f"⚙️  Processing with {workers} worker(s) in '{mode}' mode")
+
+    started_at = datetime.now(timezone.utc).isoformat()
+    start = time.perf_counter()
+    results = []
+
+    # Spawned workers avoid inheriting forked torch/thread state
+    ctx = multiprocessing.get_context('spawn')
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(threads_per_worker, profile)
+    ) as pool:
+        futures = {
+            pool.submit(_process_one, pdf, output_folder, mode, enable_leap, profile): pdf
+            for pdf in pdfs
+        }
+
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # A crashed worker (BrokenProcessPool) fails its documents, not the batch
+                result = {
+                    'pdf': futures[future],
+                    'status': 'error',
+                    'seconds': 0.0,
+                    'worker_pid': None,
+                    'error': f"{type(e).__name__}: {e}"
+                }
+            results.append(result)
+            icon = '✅' if result['status'] == 'ok' else '❌'
+            print(f"{icon} [{len(results)}/{len(pdfs)}] {Path(result['pdf']).name} ({result['seconds']}s)")
+
+    results.sort(key=lambda r: r['pdf'])
+    succeeded = sum(1 for r in results if r['status'] == 'ok')
+
+    manifest = {
+        'input_folder': str(input_folder),
+        'output_folder': str(output_folder),
+        'mode': mode,
+        'profile': profile or os.getenv('PDF_PROFILE', 'balanced'),
+        'workers': workers,
+        'started_at': started_at,
+        'wall_seconds': round(time.perf_counter() - start, 2),
+        'total': len(results),
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'files': results
+    }
+
+    manifest_file = os.path.join(output_folder, 'manifest.json')
+    with open(manifest_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+    print(f"\n📋 Manifest: {manifest_file}")
+    print(f"✅ {succeeded}/{len(results)} succeeded in {manifest['wall_seconds']}s")
+
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a folder of PDFs in parallel")
+    parser.add_argument('input_folder', help="Folder containing PDFs (e.g. temp/uploads)")
+    parser.add_argument('--output', default='output', help="Output folder (default: output)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--mode', choices=['markdown', 'chunks'], default='markdown',
+                        help="markdown: _full_text.md + images, chunks: JSON ready for Supabase")
+    parser.add_argument('--leap', action='store_true', help="Also generate LEAP files (markdown mode)")
+    parser.add_argument('--profile', choices=['fast', 'balanced', 'accurate'], default=None,
+                        help="Speed profile (default: PDF_PROFILE or balanced)")
+    args = parser.parse_args()
+
+    manifest = run_batch(
+        args.input_folder,
+        output_folder=args.output,
+        workers=args.workers,
+        mode=args.mode,
+        enable_leap=args.leap,
+        profile=args.profile
+    )
+
+    raise SystemExit(0 if manifest['failed'] == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Content-addressed blob store for image bytes
+Images are stored once under the SHA-256 of their bytes, on the local
+filesystem or in an S3-compatible bucket (AWS, MinIO, LocalStack), and the
+database keeps only the key. Identical renditions share one blob
+
+Usage:
+    python blob_store.py --stats
+    python blob_store.py --migrate     # move base64 images out of Postgres
+    python blob_store.py --gc          # delete blobs no image row points at
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional
+
+# 'local' or 's3'
+BLOB_STORE = os.getenv('BLOB_STORE', 'local').lower()
+BLOB_STORE_DIR = Path(os.getenv('BLOB_STORE_DIR', 'blobs'))
+
+# S3-compatible backend; credentials come from the usual AWS_* variables
+BLOB_S3_BUCKET = os.getenv('BLOB_S3_BUCKET', '')
+BLOB_S3_PREFIX = os.getenv('BLOB_S3_PREFIX', 'images/')
+BLOB_S3_ENDPOINT_URL = os.getenv('BLOB_S3_ENDPOINT_URL') or None  # e.g. http://localhost:9000 for MinIO
+BLOB_S3_REGION = os.getenv('BLOB_S3_REGION') or None
+
+# Blobs stored (or re-stored) more recently than this are never deleted: an
+# ingestion may have put() a key whose image row it has not inserted yet
+BLOB_GC_GRACE_SECONDS = int(os.getenv('BLOB_GC_GRACE_SECONDS', '3600'))
+
+
+def blob_key(data: bytes) -> str:
+    """Key of a blob: the SHA-256 of its bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _check_key(key: str) -> str:
+    # Keys become paths; refuse anything that is not a hex digest
+    if len(key) != 64 or any(c not in '0123456789abcdef' for c in key):
+        raise ValueError(f"Invalid blob key: {key!r}")
+    return key
+
+
+class LocalBlobStore:
+    """Blobs as files under a directory, fanned out by key prefix"""
+
+    def __init__(self, root: Path = None):
+        self.root = Path(root or BLOB_STORE_DIR)
+
+    def _path(self, key: str) -> Path:
+        key = _check_key(key)
+        return self.root / key[:2] / key[2:4] / key
+
+    def put(self, data: bytes, mime_type: str = None) -> str:
+        """Store bytes and return their key; existing content is only marked as fresh"""
+        key = blob_key(data)
+        path = self._path(key)
+        if path.exists():
+            try:
+                os.utime(path)
+                return key
+            except FileNotFoundError:
+                pass  # deleted meanwhile; write it again
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Written to a temp file and renamed, so readers never see half a blob
+        fd, tmp = tempfile.mkstemp(prefix=f".{key[:8]}-", dir=path.parent)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        return key
+
+    def get(self, key: str) -> bytes:
+        """Bytes of a blob; raises KeyError when it does not exist"""
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def age(self, key: str) -> Optional[float]:
+        """Seconds since the blob was last put, or None when it does not exist"""
+        try:
+            return time.time() - self._path(key).stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def iter_keys(self) -> Iterator[str]:
+        if self.root.exists():
+            for path in self.root.glob('*/*/*'):
+                if path.is_file() and not path.name.startswith('.'):
+                    yield path.name
+
+    def stats(self) -> Dict:
+        count = 0
+        size = 0
+        if self.root.exists():
+            for path in self.root.glob('*/*/*'):
+                if path.is_file() and not path.name.startswith('.'):
+                    count += 1
+                    size += path.stat().st_size
+        return {'backend': 'local', 'root': str(self.root), 'blobs': count,
+                'size_mb': round(size / (1024 * 1024), 1)}
+
+
+class S3BlobStore:
+    """Blobs as objects in an S3-compatible bucket"""
+
+    def __init__(
+        self,
+        bucket: str = None,
+        prefix: str = None,
+        endpoint_url: str = None,
+        region: str = None
+    ):
+        try:
+            import boto3
+        except ImportError:
+            raise ImportError("BLOB_STORE=s3 requires boto3 (pip install boto3)")
+
+        self.bucket = bucket or BLOB_S3_BUCKET
+        if not self.bucket:
+            raise ValueError("BLOB_S3_BUCKET must be set for BLOB_STORE=s3")
+        self.prefix = BLOB_S3_PREFIX if prefix is None else prefix
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url or BLOB_S3_ENDPOINT_URL,
+            region_name=region or BLOB_S3_REGION
+        )
+
+    def _object_key(self, key: str) -> str:
+        key = _check_key(key)
+        return f"{self.prefix}{key[:2]}/{key}"
+
+    def _is_missing(self, error: Exception) -> bool:
+        code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+        return code in ('404', 'NoSuchKey', 'NotFound')
+
+    def put(self, data: bytes, mime_type: str = None) -> str:
+        """Store bytes and return their key; existing content is only marked as fresh"""
+        key = blob_key(data)
+        object_key = self._object_key(key)
+        extra = {'ContentType': mime_type} if mime_type else {}
+        if self.exists(key):
+            try:
+                # Copying the object onto itself renews LastModified without re-uploading
+                self.client.copy_object(Bucket=self.bucket, Key=object_key, MetadataDirective='REPLACE',
+                                        CopySource={'Bucket': self.bucket, 'Key': object_key}, **extra)
+                return key
+            except Exception as e:
+                if not self._is_missing(e):
+                    raise
+        self.client.put_object(Bucket=self.bucket, Key=object_key, Body=data, **extra)
+        return key
+
+    def get(self, key: str) -> bytes:
+        """Bytes of a blob; raises KeyError when it does not exist"""
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if self._is_missing(e):
+                raise KeyError(key)
+            raise
+        return response['Body'].read()
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except Exception as e:
+            if self._is_missing(e):
+                return False
+            raise
+
+    def age(self, key: str) -> Optional[float]:
+        """Seconds since the blob was last put, or None when it does not exist"""
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if self._is_missing(e):
+                return None
+            raise
+        return time.time() - response['LastModified'].timestamp()
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def iter_keys(self) -> Iterator[str]:
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key'].rsplit('/', 1)[-1]
+
+    def stats(self) -> Dict:
+        count = 0
+        size = 0
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                count += 1
+                size += obj['Size']
+        return {'backend': 's3', 'bucket': self.bucket, 'prefix': self.prefix,
+                'endpoint_url': BLOB_S3_ENDPOINT_URL, 'blobs': count,
+                'size_mb': round(size / (1024 * 1024), 1)}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Process-wide blob store selected by BLOB_STORE"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if BLOB_STORE == 's3':
+                _store = S3BlobStore()
+            elif BLOB_STORE == 'local':
+                _store = LocalBlobStore()
+            else:
+                raise ValueError(f"Unknown BLOB_STORE {BLOB_STORE!r} (use 'local' or 's3')")
+        return _store
+
+
+def delete_many(keys: Iterable[Optional[str]], grace_seconds: int = None) -> int:
+    """
+    Delete blobs, ignoring empty keys; returns how many were deleted
+
+    Blobs put within the grace period (default BLOB_GC_GRACE_SECONDS) are
+    kept, as an ingestion may be about to reference them; python
+    blob_store.py --gc collects them later if they stay unreferenced.
+    """
+    grace_seconds = BLOB_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    store = get_store()
+    deleted = 0
+    kept = 0
+    for key in dict.fromkeys(key for key in keys if key):
+        try:
+            age = store.age(key)
+            if age is None:
+                continue
+            if age < grace_seconds:
+                kept += 1
+                continue
+            store.delete(key)
+            deleted += 1
+        except Exception as e:
+            print(f"⚠️  Could not delete blob {key}: {e}")
+    if kept:
+        print(f"⏳ Kept {kept} recently stored blobs (grace period {grace_seconds}s)")
+    return deleted
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Inspect the image blob store")
+    parser.add_argument('--stats', action='store_true', help="Show blob count and size")
+    parser.add_argument('--migrate', action='store_true',
+                        help="Move base64 images stored in document_images into the blob store")
+    parser.add_argument('--gc', action='store_true',
+                        help="Delete blobs no image row points at (older than BLOB_GC_GRACE_SECONDS)")
+    args = parser.parse_args()
+
+    if args.migrate:
+        from supabase_utils import SupabaseManager
+        moved = SupabaseManager().migrate_images_to_blob_store()
+        print(f"📦 Moved {moved} images into the blob store")
+    elif args.gc:
+        from supabase_utils import SupabaseManager
+        deleted = SupabaseManager().collect_blob_garbage()
+        print(f"🗑️  Deleted {deleted} unreferenced blobs")
+    else:
+        print(json.dumps(get_store().stats(), indent=2))
@@ -0,0 +1,460 @@
+"""
+Token-budgeted, language-aware markdown chunking
+Chunks are sized in approximate embedding tokens rather than characters, so
+Japanese and English reports produce comparable chunk counts. Undersized
+sibling sections are merged and consecutive chunks can overlap
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+CHUNK_MAX_TOKENS = int(os.getenv('CHUNK_MAX_TOKENS', '512'))
+CHUNK_MIN_TOKENS = int(os.getenv('CHUNK_MIN_TOKENS', '128'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '48'))
+
+# Rough tokenizer ratios: CJK characters are about one token each, other
+# scripts average about four characters per token
+CJK_TOKENS_PER_CHAR = 1.0
+OTHER_CHARS_PER_TOKEN = 4.0
+
+# Hiragana/Katakana, CJK ideographs, Hangul, CJK punctuation, fullwidth forms
+_CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af\u3000-\u303f\uff01-\uff9f'
+_CJK = re.compile(f'[{_CJK_CHARS}]')
+_HEADING = re.compile(r'^(#{1,6})\s+(.+)$', re.MULTILINE)
+
+# Docling writes this where a picture sits in the markdown; number_images()
+# turns it into '<!-- image N -->' so each chunk knows which pictures it holds
+IMAGE_PLACEHOLDER = '<!-- image -->'
+_PLACEHOLDER = re.compile(re.escape(IMAGE_PLACEHOLDER))
+_IMAGE_MARKER = re.compile(r'<!-- image (\d+) -->')
+# Numbered or not, with the blank lines around it
+_ANY_IMAGE_MARKER = re.compile(r'\s*<!-- image \d* ?-->\s*')
+
+# Hard-cut tokens: one CJK character, or a run of other text, with trailing spaces
+_BREAKABLE = re.compile(rf'[{_CJK_CHARS}]\s*|[^\s{_CJK_CHARS}]+\s*|\s+')
+# Markdown table header rule, e.g. |---|:--:|
+_TABLE_RULE = re.compile(r'^\s*\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?\s*$')
+
+_SENTENCE_END = {
+    'cjk': re.compile(r'(?<=[。！？!?])'),
+    'latin': re.compile(r'(?<=[.!?])\s+')
+}
+
+
+def _weight(text: str) -> float:
+    """Unrounded token estimate; sums of weights never undercount a joined text"""
+    cjk_chars = len(_CJK.findall(text))
+    other_chars = len(''.join(text.split())) - cjk_chars
+    return cjk_chars * CJK_TOKENS_PER_CHAR + other_chars / OTHER_CHARS_PER_TOKEN
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate embedding tokens for a piece of text"""
+    return int(round(_weight(text)))
+
+
+def detect_script(text: str) -> str:
+    """'cjk' when CJK characters dominate the text, otherwise 'latin'"""
+    sample = ''.join(text[:20000].split())
+    if not sample:
+        return 'latin'
+    return 'cjk' if len(_CJK.findall(sample)) / len(sample) > 0.3 else 'latin'
+
+
+def number_images(text: str, start: int = 0) -> str:
+    """
+    Number the picture placeholders in markdown
+
+    Args:
+        text: Markdown from export_to_markdown()
+        start: Pictures before this text (e.g. in earlier page ranges)
+
+    Returns:
+        Text with the Nth placeholder replaced by '<!-- image {start+N} -->',
+        matching the 1-based image filenames and captions
+    """
+    counter = iter(range(start + 1, start + 1 + text.count(IMAGE_PLACEHOLDER)))
+    return _PLACEHOLDER.sub(lambda _: f"<!-- image {next(counter)} -->", text)
+
+
+def image_refs(text: str) -> List[int]:
+    """0-based picture indices whose numbered placeholder appears in text"""
+    return sorted({int(number) - 1 for number in _IMAGE_MARKER.findall(text)})
+
+
+def strip_image_markers(text: str) -> str:
+    """Text without picture placeholders, for storing, hashing and embedding"""
+    return _ANY_IMAGE_MARKER.sub(lambda m: '\n\n' if '\n' in m.group() else ' ', text).strip()
+
+
+def _split_sentences(text: str, script: str) -> List[str]:
+    return [s for s in _SENTENCE_END[script].split(text) if s.strip()]
+
+
+def _hard_split(text: str, max_tokens: int) -> List[str]:
+    """
+    Cut text that has no usable boundary into pieces of at most max_tokens
+
+    Latin words are kept whole; only CJK runs (no spaces between words) are
+    cut between characters. A single word longer than the budget is cut.
+    """
+    pieces = []
+    current = ''
+    current_weight = 0.0
+    for token in _BREAKABLE.findall(text):
+        weight = _weight(token)
+        if weight > max_tokens:
+            # One unbreakable word over budget: cut it by characters
+            step = max(1, int(max_tokens * OTHER_CHARS_PER_TOKEN))
+            pieces.append(current)
+            pieces.extend(token[i:i + step] for i in range(0, len(token), step))
+            current, current_weight = '', 0.0
+            continue
+        if current_weight + weight > max_tokens:
+            pieces.append(current)
+            current, current_weight = '', 0.0
+        current += token
+        current_weight += weight
+    pieces.append(current)
+    return [piece.strip() for piece in pieces if piece.strip()]
+
+
+def _is_table(para: str) -> bool:
+    lines = para.splitlines()
+    return len(lines) >= 2 and all(line.lstrip().startswith('|') for line in lines)
+
+
+def _split_table(para: str, max_tokens: int) -> List[str]:
+    """
+    Cut a markdown table at row boundaries, repeating its header in every piece
+
+    Pieces stay within max_tokens; a single row too long for that is cut
+    with _hard_split() as its own piece.
+    """
+    lines = para.splitlines()
+    header_size = 2 if len(lines) > 1 and _TABLE_RULE.match(lines[1]) else 1
+    header = '\n'.join(lines[:header_size])
+    header_weight = _weight(header)
+
+    pieces = []
+    rows = []
+    rows_weight = 0.0
+    for row in lines[header_size:]:
+        weight = _weight(row)
+        if header_weight + weight > max_tokens:
+            if rows:
+                pieces.append('\n'.join([header] + rows))
+                rows, rows_weight = [], 0.0
+            pieces.extend(_hard_split(row, max_tokens))
+            continue
+        if rows and header_weight + rows_weight + weight > max_tokens:
+            pieces.append('\n'.join([header] + rows))
+            rows, rows_weight = [], 0.0
+        rows.append(row)
+        rows_weight += weight
+    if rows or not pieces:
+        pieces.append('\n'.join([header] + rows))
+    return pieces
+
+
+def _units(text: str, max_tokens: int, script: Optional[str] = None) -> List[Tuple[str, float, str, str]]:
+    """
+    Paragraphs, falling back to table rows, sentences and then hard cuts for long ones
+
+    Args:
+        script: 'cjk' or 'latin' for every paragraph (default: detected per paragraph)
+
+    Returns:
+        (text, weight, separator, kind) tuples; the separator joins a unit to
+        the one before it, so split paragraphs read as they did originally.
+        kind is the paragraph's script, or 'table' for table pieces
+    """
+    units = []
+    for para in text.split('\n\n'):
+        para = para.strip()
+        if not para:
+            continue
+        para_script = script or detect_script(para)
+        kind = 'table' if _is_table(para) else para_script
+        weight = _weight(para)
+        if weight <= max_tokens:
+            units.append((para, weight, '\n\n', kind))
+            continue
+
+        if kind == 'table':
+            for piece in _split_table(para, max_tokens):
+                units.append((piece, _weight(piece), '\n\n', kind))
+            continue
+
+        separator = '\n\n'
+        sentence_joiner = '' if para_script == 'cjk' else ' '
+        for sentence in _split_sentences(para, para_script):
+            pieces = [sentence] if _weight(sentence) <= max_tokens else _hard_split(sentence, max_tokens)
+            for piece in pieces:
+                piece = piece.strip()
+                units.append((piece, _weight(piece), separator, kind))
+                separator = sentence_joiner
+    return units
+
+
+def _join(units: List[Tuple[str, float, str, str]]) -> str:
+    return ''.join(
+        (separator if idx else '') + unit
+        for idx, (unit, _, separator, _) in enumerate(units)
+    )
+
+
+def _overlap_tail(units: List[Tuple[str, float, str, str]], overlap_tokens: int) -> Tuple[str, float]:
+    """Trailing sentences of a chunk, up to overlap_tokens, to repeat in the next one"""
+    if overlap_tokens <= 0 or not units or units[-1][3] == 'table':
+        # Table rows carry their header instead
+        return '', 0.0
+    script = units[-1][3]
+    tail = []
+    weight = 0.0
+    for sentence in reversed(_split_sentences(units[-1][0], script)):
+        sentence_weight = _weight(sentence)
+        if weight + sentence_weight > overlap_tokens:
+            break
+        tail.insert(0, sentence.strip())
+        weight += sentence_weight
+    joiner = '' if script == 'cjk' else ' '
+    return joiner.join(tail), weight
+
+
+def _pack(text: str, max_tokens: int, overlap_tokens: int, script: Optional[str] = None) -> List[Tuple[str, int]]:
+    """Greedily pack a section's units into chunks of at most max_tokens"""
+    chunks = []
+    current: List[Tuple[str, float, str, str]] = []
+    current_weight = 0.0
+
+    # Weights are summed unrounded, so a chunk's estimate never exceeds max_tokens
+    for unit, weight, separator, kind in _units(text, max_tokens, script):
+        if current and current_weight + weight > max_tokens:
+            chunks.append(_join(current))
+            tail, tail_weight = _overlap_tail(current, overlap_tokens)
+            current, current_weight = [], 0.0
+            if tail and tail_weight + weight <= max_tokens:
+                current, current_weight = [(tail, tail_weight, '\n\n', kind)], tail_weight
+        current.append((unit, weight, separator, kind))
+        current_weight += weight
+
+    if current:
+        chunks.append(_join(current))
+    return [(chunk, estimate_tokens(chunk)) for chunk in chunks]
+
+
+def _open_headings(text: str, stack: Optional[List[Tuple[int, str]]] = None) -> List[Tuple[int, str]]:
+    """Heading lines still open at the end of text, outermost first"""
+    stack = list(stack or [])
+    for match in _HEADING.finditer(text):
+        level = len(match.group(1))
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        stack.append((level, match.group(0).strip()))
+    return stack
+
+
+def _sections(text: str) -> List[Dict]:
+    """Split markdown into sections with their heading, level and parent heading"""
+    sections = []
+    stack: List[Tuple[int, str]] = []
+    heading, level, parent = '', 0, None
+    pos = 0
+
+    for match in _HEADING.finditer(text):
+        sections.append({'heading': heading, 'level': level, 'parent': parent, 'text': text[pos:match.start()]})
+        level = len(match.group(1))
+        heading = match.group(2).replace('#', '').strip()
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        parent = stack[-1][1] if stack else None
+        stack.append((level, heading))
+        pos = match.end()
+
+    sections.append({'heading': heading, 'level': level, 'parent': parent, 'text': text[pos:]})
+    return [s for s in sections if s['text'].strip()]
+
+
+def chunk_markdown(
+    text: str,
+    max_tokens: Optional[int] = None,
+    min_tokens: Optional[int] = None,
+    overlap_tokens: Optional[int] = None,
+    stats: Optional[Dict] = None,
+    script: Optional[str] = None
+) -> List[Dict]:
+    """
+    Split markdown into heading-aware chunks sized in approximate tokens
+
+    Sections under a heading are packed paragraph by paragraph (sentences for
+    long paragraphs, rows under a repeated header for long tables) up to
+    max_tokens. A section smaller than min_tokens is
+    merged with the following or preceding sibling under the same parent
+    heading, with its heading kept inline. Consecutive chunks of one section
+    repeat up to overlap_tokens of trailing sentences.
+
+    Args:
+        text: Full markdown text
+        max_tokens: Token budget per chunk (default: CHUNK_MAX_TOKENS)
+        min_tokens: Sections below this are merged with siblings (default: CHUNK_MIN_TOKENS)
+        overlap_tokens: Tokens repeated between chunks (default: CHUNK_OVERLAP_TOKENS)
+        stats: Optional dict filled with chunk counts and token totals
+        script: 'cjk' or 'latin' for every paragraph (default: detected per
+                paragraph, so English passages in a Japanese report split at words)
+
+    Returns:
+        List of chunks with text, heading, tokens and images (0-based indices
+        of the pictures whose numbered placeholder fell inside the chunk; the
+        placeholders themselves are removed from the text)
+    """
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    min_tokens = CHUNK_MIN_TOKENS if min_tokens is None else min_tokens
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+
+    chunks = []
+    pending = None  # small chunk that may still absorb siblings
+
+    for section in _sections(text):
+        body = section['text'].strip()
+        packed = _pack(body, max_tokens, overlap_tokens, script)
+
+        for idx, (chunk_text, tokens) in enumerate(packed):
+            chunk = {
+                'text': chunk_text,
+                'heading': section['heading'],
+                'tokens': tokens,
+                '_parent': section['parent'],
+                '_level': section['level']
+            }
+
+            if idx == 0 and pending is not None:
+                same_parent = pending['_parent'] == section['parent'] and pending['_level'] == section['level']
+                small = pending['tokens'] < min_tokens or (len(packed) == 1 and tokens < min_tokens)
+                heading_line = f"{'#' * section['level']} {section['heading']}\n\n" if section['heading'] else ''
+                merged_text = f"{pending['text']}\n\n{heading_line}{chunk_text}"
+                merged_tokens = estimate_tokens(merged_text)
+                if same_parent and small and merged_tokens <= max_tokens:
+                    pending['text'] = merged_text
+                    pending['tokens'] = merged_tokens
+                    continue
+
+            chunks.append(chunk)
+            pending = chunk if len(packed) == 1 or idx == len(packed) - 1 else None
+
+    # Pictures are linked through 'images' only; the markers would otherwise
+    # end up in the stored text, its hashes and the embedding
+    linked = []
+    orphans = []  # pictures of a chunk that was nothing but placeholders
+    for chunk in chunks:
+        del chunk['_parent'], chunk['_level']
+        images = orphans + image_refs(chunk['text'])
+        chunk['text'] = strip_image_markers(chunk['text'])
+        if not chunk['text']:
+            if linked:
+                linked[-1]['images'] = sorted(set(linked[-1]['images'] + images))
+                orphans = []
+            else:
+                orphans = images
+            continue
+        chunk['tokens'] = estimate_tokens(chunk['text'])
+        chunk['images'] = images
+        orphans = []
+        linked.append(chunk)
+    chunks = linked
+
+    if stats is not None:
+        stats.update(
+            script=script or detect_script(text),
+            chunks=len(chunks),
+            tokens=estimate_tokens(text),
+            embedding_tokens=sum(c['tokens'] for c in chunks),
+            max_tokens=max_tokens,
+            overlap_tokens=overlap_tokens
+        )
+
+    return chunks
+
+
+class StreamingChunker:
+    """
+    Chunks markdown that arrives in pieces (e.g. one converted page range at a time)
+
+    Text is held back from the last heading onward, since that section may
+    continue in the next piece; everything before it is chunked with
+    chunk_markdown() and returned. A section that grows past
+    max_pending_tokens is cut at a paragraph boundary and continues under the
+    same heading. Sibling merging and overlap do not cross these cuts, so
+    results can differ slightly from chunking the whole text at once.
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        min_tokens: Optional[int] = None,
+        overlap_tokens: Optional[int] = None,
+        max_pending_tokens: Optional[int] = None
+    ):
+        """
+        Args:
+            max_tokens, min_tokens, overlap_tokens: As for chunk_markdown()
+            max_pending_tokens: Text held back before a section is cut
+                                (default: 4x max_tokens)
+        """
+        self.max_tokens = max_tokens or CHUNK_MAX_TOKENS
+        self.min_tokens = min_tokens
+        self.overlap_tokens = overlap_tokens
+        self.max_pending_tokens = max_pending_tokens or self.max_tokens * 4
+        self.stats = {'chunks': 0, 'tokens': 0, 'embedding_tokens': 0}
+        self._buffer = ''
+        self._headings: List[Tuple[int, str]] = []  # open headings at the start of the buffer
+
+    def feed(self, text: str) -> List[Dict]:
+        """Add the next piece of markdown; returns the chunks that are now complete"""
+        if not text.strip():
+            return []
+        self._buffer = f"{self._buffer}\n\n{text}" if self._buffer else text
+
+        chunks = []
+        starts = [match.start() for match in _HEADING.finditer(self._buffer)]
+        if starts and starts[-1] > 0:
+            chunks += self._flush(starts[-1])
+
+        if estimate_tokens(self._buffer) > self.max_pending_tokens:
+            cut = self._buffer.rfind('\n\n')
+            if cut > 0:
+                chunks += self._flush(cut)
+        return chunks
+
+    def finish(self) -> List[Dict]:
+        """Chunk whatever is still held back"""
+        return self._flush(len(self._buffer))
+
+    def _flush(self, cut: int) -> List[Dict]:
+        text, self._buffer = self._buffer[:cut], self._buffer[cut:].lstrip('\n')
+        if not text.strip():
+            return []
+
+        # Re-state the open headings so sections keep their heading and parent;
+        # headings without body text produce no chunks
+        context = ''.join(f"{line}\n\n" for _, line in self._headings)
+        self._headings = _open_headings(text, self._headings)
+
+        part_stats = {}
+        chunks = chunk_markdown(
+            context + text,
+            max_tokens=self.max_tokens,
+            min_tokens=self.min_tokens,
+            overlap_tokens=self.overlap_tokens,
+            stats=part_stats
+        )
+        self.stats['chunks'] += len(chunks)
+        self.stats['tokens'] += estimate_tokens(text)
+        self.stats['embedding_tokens'] += part_stats['embedding_tokens']
+        self.stats.update(
+            script=part_stats['script'],
+            max_tokens=part_stats['max_tokens'],
+            overlap_tokens=part_stats['overlap_tokens']
+        )
+        return chunks
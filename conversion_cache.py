@@ -0,0 +1,276 @@
+"""
+Content-addressed cache of Docling conversions
+Entries are keyed by the PDF's SHA-256 plus the pipeline options and hold the
+serialized Docling document(s) with pictures embedded
+
+Usage:
+    python conversion_cache.py --stats
+    python conversion_cache.py --clear
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+CACHE_ENABLED = os.getenv('CONVERSION_CACHE', '1') not in ('0', 'false', 'False')
+CACHE_DIR = Path(os.getenv('CONVERSION_CACHE_DIR', '.cache/conversions'))
+CACHE_MAX_BYTES = int(float(os.getenv('CONVERSION_CACHE_MAX_MB', '2048')) * 1024 * 1024)
+
+# Private folders of readers in progress; older ones were left by a crash
+_READ_PREFIX = '.read-'
+_STALE_READ_SECONDS = 24 * 3600
+
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+_lock = threading.Lock()
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file, read in 1 MB blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(pdf_sha256: str, options: Dict) -> str:
+    """Cache key for a PDF hash and a resolved set of pipeline options"""
+    options_json = json.dumps(options, sort_keys=True)
+    options_hash = hashlib.sha256(options_json.encode()).hexdigest()[:16]
+    return f"{pdf_sha256}-{options_hash}"
+
+
+def _entry_size(entry: Path) -> int:
+    return sum(f.stat().st_size for f in entry.iterdir() if f.is_file())
+
+
+def _touch(meta_file: Path) -> bool:
+    """Mark an entry as recently used; False (counted as a miss) if another process evicted it"""
+    try:
+        os.utime(meta_file)
+        return True
+    except OSError:
+        with _lock:
+            _stats['misses'] += 1
+        return False
+
+
+def load_stats(key: str) -> Dict:
+    """Conversion stats saved with an entry (empty if none were recorded)"""
+    try:
+        with open(CACHE_DIR / key / 'meta.json', 'r', encoding='utf-8') as f:
+            return json.load(f).get('stats') or {}
+    except (OSError, ValueError):
+        return {}
+
+
+def iter_load(key: str) -> Optional[Iterator]:
+    """
+    Load cached document parts lazily, one at a time
+
+    The part files are hardlinked into a private folder before this returns,
+    so an entry evicted by another process mid-iteration stays readable.
+
+    Args:
+        key: Key from cache_key()
+
+    Returns:
+        Iterator of DoclingDocument parts in page order, or None on a miss
+    """
+    entry = CACHE_DIR / key
+    meta_file = entry / 'meta.json'
+
+    try:
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        part_files = [entry / f"part_{idx:03d}.json" for idx in range(meta['parts'])]
+        if not all(part_file.exists() for part_file in part_files):
+            raise ValueError("missing part files")
+    except FileNotFoundError:
+        with _lock:
+            _stats['misses'] += 1
+        return None
+    except Exception as e:
+        print(f"⚠️  Discarding unreadable cache entry {key}: {e}")
+        shutil.rmtree(entry, ignore_errors=True)
+        with _lock:
+            _stats['misses'] += 1
+        return None
+
+    folder = Path(tempfile.mkdtemp(prefix=_READ_PREFIX, dir=CACHE_DIR))
+    if not _pin(part_files, folder) or not _touch(meta_file):
+        shutil.rmtree(folder, ignore_errors=True)
+        return None
+    with _lock:
+        _stats['hits'] += 1
+
+    return _iter_parts(folder, [folder / part_file.name for part_file in part_files])
+
+
+def _pin(part_files: List[Path], folder: Path) -> bool:
+    """Hardlink (or copy) part files into folder; False (counted as a miss) if they are gone"""
+    try:
+        for part_file in part_files:
+            try:
+                os.link(part_file, folder / part_file.name)
+            except OSError:
+                # No hardlinks on this filesystem; a file evicted meanwhile fails here too
+                shutil.copyfile(part_file, folder / part_file.name)
+    except OSError:
+        with _lock:
+            _stats['misses'] += 1
+        return False
+    return True
+
+
+def _iter_parts(folder: Path, part_files: List[Path]) -> Iterator:
+    from docling_core.types.doc import DoclingDocument
+
+    try:
+        for part_file in part_files:
+            yield DoclingDocument.load_from_json(part_file)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+class CacheWriter:
+    """Writes a cache entry part by part, so streamed conversions can be cached"""
+
+    def __init__(self, key: str, source_name: str = ''):
+        """
+        Args:
+            key: Key from cache_key()
+            source_name: Original PDF filename, kept for inspection
+        """
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        self.key = key
+        self.source_name = source_name
+        self.parts = 0
+        # Written into a temp dir and renamed, so readers never see half an entry
+        self._staging = Path(tempfile.mkdtemp(prefix=f".{key}-", dir=CACHE_DIR))
+
+    def add(self, part) -> None:
+        """Save the next part in page order"""
+        from docling_core.types.doc import ImageRefMode
+
+        part.save_as_json(self._staging / f"part_{self.parts:03d}.json", image_mode=ImageRefMode.EMBEDDED)
+        self.parts += 1
+
+    def commit(self, stats: Dict = None) -> None:
+        """Publish the entry, then evict down to the size limit"""
+        entry = CACHE_DIR / self.key
+        try:
+            with open(self._staging / 'meta.json', 'w', encoding='utf-8') as f:
+                json.dump({
+                    'key': self.key,
+                    'source': self.source_name,
+                    'parts': self.parts,
+                    'stats': stats or {},
+                    'created_at': time.time()
+                }, f)
+
+            if entry.exists():
+                shutil.rmtree(entry, ignore_errors=True)
+            os.replace(self._staging, entry)
+        except Exception:
+            self.abort()
+            raise
+
+        with _lock:
+            _stats['stores'] += 1
+
+        evict()
+
+    def abort(self) -> None:
+        """Discard the partial entry"""
+        shutil.rmtree(self._staging, ignore_errors=True)
+
+
+def evict(max_bytes: int = None) -> int:
+    """
+    Remove least recently used entries until the cache fits in max_bytes
+
+    Returns:
+        Number of entries removed
+    """
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not CACHE_DIR.exists():
+        return 0
+
+    entries = []
+    for entry in CACHE_DIR.iterdir():
+        meta_file = entry / 'meta.json'
+        if entry.name.startswith(_READ_PREFIX):
+            try:
+                if time.time() - entry.stat().st_mtime > _STALE_READ_SECONDS:
+                    shutil.rmtree(entry, ignore_errors=True)
+            except OSError:
+                pass
+        elif entry.is_dir() and meta_file.exists():
+            entries.append((meta_file.stat().st_mtime, _entry_size(entry), entry))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+
+    for _, size, entry in sorted(entries, key=lambda e: e[0]):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        removed += 1
+
+    if removed:
+        with _lock:
+            _stats['evictions'] += removed
+
+    return removed
+
+
+def get_cache_stats() -> Dict:
+    """Hit/miss counters for this process plus current size on disk"""
+    entries = 0
+    size = 0
+    if CACHE_DIR.exists():
+        for entry in CACHE_DIR.iterdir():
+            if entry.is_dir() and (entry / 'meta.json').exists():
+                entries += 1
+                size += _entry_size(entry)
+
+    with _lock:
+        stats = dict(_stats)
+
+    lookups = stats['hits'] + stats['misses']
+    return {
+        'enabled': CACHE_ENABLED,
+        **stats,
+        'hit_rate': round(stats['hits'] / lookups, 3) if lookups else 0.0,
+        'entries': entries,
+        'size_mb': round(size / (1024 * 1024), 1),
+        'max_mb': round(CACHE_MAX_BYTES / (1024 * 1024), 1)
+    }
+
+
+def clear() -> None:
+    """Delete every cache entry"""
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or clear the conversion cache")
+    parser.add_argument('--stats', action='store_true', help="Show cache size and entry count")
+    parser.add_argument('--clear', action='store_true', help="Delete all cached conversions")
+    args = parser.parse_args()
+
+    if args.clear:
+        clear()
+        print(f"🗑️  Cleared {CACHE_DIR}")
+    else:
+        print(json.dumps(get_cache_stats(), indent=2))
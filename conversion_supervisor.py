@@ -0,0 +1,276 @@
+"""
+Supervised child process for PDF conversions in long-running servers
+Docling's memory is not returned to the OS after a large PDF, so the web
+servers convert in a child process that is retired after a number of
+documents or once its resident memory crosses a ceiling
+"""
+
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+
+# Set CONVERSION_ISOLATION=0 to convert in the server process instead
+ISOLATION_ENABLED = os.getenv('CONVERSION_ISOLATION', '1') != '0'
+CHILD_MAX_DOCS = int(os.getenv('CONVERSION_CHILD_MAX_DOCS', '20'))
+CHILD_MAX_RSS_MB = float(os.getenv('CONVERSION_CHILD_MAX_RSS_MB', '3072'))
+
+# Sampling interval for the per-document peak when ru_maxrss cannot tell
+_SAMPLE_SECONDS = 0.25
+_HISTORY_SIZE = 50
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return max_rss_mb()
+
+
+def children_rss_mb() -> float:
+    """Resident set size of this process's descendants in MB (0 where /proc is unavailable)"""
+    children = {}
+    try:
+        pids = [entry for entry in os.listdir('/proc') if entry.isdigit()]
+    except OSError:
+        return 0.0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat', 'r') as f:
+                # The command name may contain spaces; fields resume after ')'
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+            children.setdefault(parent, []).append(int(pid))
+        except (OSError, ValueError, IndexError):
+            continue
+
+    total_pages = 0
+    pending = list(children.get(os.getpid(), []))
+    while pending:
+        pid = pending.pop()
+        pending.extend(children.get(pid, []))
+        try:
+            with open(f'/proc/{pid}/statm', 'r') as f:
+                total_pages += int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+    return total_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def max_rss_mb() -> float:
+    """Lifetime peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class PeakMemory:
+    """Records the peak RSS reached while the block runs"""
+
+    def __init__(self, interval: float = _SAMPLE_SECONDS):
+        self.interval = interval
+        self.start_mb = 0.0
+        self.end_mb = 0.0
+        self.peak_mb = 0.0
+        self._lifetime_peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = current_rss_mb()
+        self._lifetime_peak = max_rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.end_mb = current_rss_mb()
+
+        # A new lifetime high can only have been reached inside the block,
+        # so it is the exact peak; otherwise keep the sampled maximum
+        lifetime_peak = max_rss_mb()
+        if lifetime_peak > self._lifetime_peak:
+            self.peak_mb = lifetime_peak
+        self.peak_mb = max(self.peak_mb, self.end_mb)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+
+def _convert_measured(kwargs: Dict) -> Dict:
+    """Run main.process_pdf_to_markdown and attach its memory use"""
+    from main import process_pdf_to_markdown
+
+    with PeakMemory() as memory:
+        result = process_pdf_to_markdown(**kwargs)
+
+    result['memory'] = {
+        'pid': os.getpid(),
+        'rss_before_mb': round(memory.start_mb, 1),
+        'rss_after_mb': round(memory.end_mb, 1),
+        'peak_rss_mb': round(memory.peak_mb, 1),
+        # Warm shard workers (PDF_SHARD_WORKERS > 1) hold models of their own
+        'children_rss_mb': round(children_rss_mb(), 1)
+    }
+    return result
+
+
+def _stop_shard_workers() -> None:
+    """Runs in the child before it is retired, so its shard workers go with it"""
+    from pdf_conversion import shutdown_shard_pool
+
+    shutdown_shard_pool()
+
+
+class ConversionSupervisor:
+    """Runs conversions in one child process and replaces it when it grows too large"""
+
+    def __init__(self, max_docs: int = None, max_rss_mb: float = None):
+        """
+        Args:
+            max_docs: Documents a child converts before it is retired
+                      (default: CONVERSION_CHILD_MAX_DOCS)
+            max_rss_mb: Retire the child once its RSS after a document, plus
+                        that of its shard workers, exceeds this
+                        (default: CONVERSION_CHILD_MAX_RSS_MB)
+        """
+        self.max_docs = max_docs or CHILD_MAX_DOCS
+        self.max_rss_mb = max_rss_mb or CHILD_MAX_RSS_MB
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._docs_in_child = 0
+        # _lock is held for a whole conversion; the counters have their own
+        # lock so status endpoints never wait behind a document
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'children_started': 0, 'children_retired': 0, 'retire_reasons': {}, 'documents': 0}
+        self._history = deque(maxlen=_HISTORY_SIZE)
+
+    def _ensure_child(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: a fresh interpreter, not a fork of the server's heap
+            self._pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+            with self._stats_lock:
+                self._docs_in_child = 0
+                self._stats['children_started'] += 1
+        return self._pool
+
+    def _retire(self, reason: str) -> None:
+        if self._pool is None:
+            return
+        print(f"♻️  Retiring conversion child after {self._docs_in_child} document(s): {reason}")
+        try:
+            self._pool.submit(_stop_shard_workers).result()
+        except Exception as e:
+            print(f"⚠️  Could not stop the child's shard workers: {e}")
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._pool = None
+        self._count_retired(reason)
+
+    def _count_retired(self, reason: str) -> None:
+        with self._stats_lock:
+            self._stats['children_retired'] += 1
+            self._stats['retire_reasons'][reason] = self._stats['retire_reasons'].get(reason, 0) + 1
+
+    def process_pdf_to_markdown(self, pdf_path, output_folder, pdf_name, **kwargs) -> Dict:
+        """
+        Run main.process_pdf_to_markdown in the supervised child
+
+        Takes the same arguments and returns the same dict, plus a 'memory'
+        entry with the child's RSS before, after and at peak for this document.
+        """
+        kwargs.update(pdf_path=str(pdf_path), output_folder=str(output_folder), pdf_name=pdf_name)
+
+        # One conversion at a time per child; requests queue here, so a server
+        # converts one document at a time however many handlers it runs
+        with self._lock:
+            pool = self._ensure_child()
+            try:
+                result = pool.submit(_convert_measured, kwargs).result()
+            except BrokenProcessPool:
+                # The child died (usually the OOM killer); start fresh next time
+                self._pool = None
+                self._count_retired('crashed')
+                raise RuntimeError(f"Conversion process died while processing {pdf_name}")
+
+            memory = result['memory']
+            with self._stats_lock:
+                self._docs_in_child += 1
+                self._stats['documents'] += 1
+                memory['docs_in_child'] = self._docs_in_child
+                self._history.append({'pdf_name': pdf_name, 'finished_at': time.time(), **memory})
+            # The ceiling covers the child and its shard workers together
+            tree_rss_mb = memory['rss_after_mb'] + memory['children_rss_mb']
+            print(f"🧠 Peak RSS {memory['peak_rss_mb']:.0f} MB (child now {memory['rss_after_mb']:.0f} MB, "
+                  f"shard workers {memory['children_rss_mb']:.0f} MB)")
+
+            if tree_rss_mb > self.max_rss_mb:
+                self._retire('rss_limit')
+            elif self._docs_in_child >= self.max_docs:
+                self._retire('max_docs')
+
+        return result
+
+    def get_stats(self) -> Dict:
+        """Child lifecycle counters and recent per-document memory"""
+        with self._stats_lock:
+            return {
+                **self._stats,
+                'retire_reasons': dict(self._stats['retire_reasons']),
+                'max_docs': self.max_docs,
+                'max_rss_mb': self.max_rss_mb,
+                'docs_in_current_child': self._docs_in_child if self._pool else 0,
+                'recent_documents': list(self._history)
+            }
+
+    def shutdown(self) -> None:
+        """Stop the child process"""
+        with self._lock:
+            if self._pool is not None:
+                try:
+                    self._pool.submit(_stop_shard_workers).result()
+                except Exception:
+                    pass
+                self._pool.shutdown(wait=True)
+                self._pool = None
+
+
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def get_supervisor() -> ConversionSupervisor:
+    """Process-wide supervisor shared by the server's request handlers"""
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None:
+            _supervisor = ConversionSupervisor()
+        return _supervisor
+
+
+def process_pdf_to_markdown(pdf_path, output_folder, pdf_name, **kwargs) -> Dict:
+    """
+    Convert through the supervised child, or in-process when
+    CONVERSION_ISOLATION=0
+    """
+    if not ISOLATION_ENABLED:
+        kwargs.update(pdf_path=str(pdf_path), output_folder=str(output_folder), pdf_name=pdf_name)
+        return _convert_measured(kwargs)
+
+    return get_supervisor().process_pdf_to_markdown(pdf_path, output_folder, pdf_name, **kwargs)
+
+
+def get_supervisor_stats() -> Dict:
+    """Supervisor stats, or an empty report if nothing has been converted yet"""
+    if _supervisor is None:
+        return {'isolation': ISOLATION_ENABLED, 'children_started': 0, 'documents': 0}
+    return {'isolation': ISOLATION_ENABLED, **_supervisor.get_stats()}
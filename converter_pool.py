@@ -0,0 +1,129 @@
+"""
+Process-wide pool of warm Docling converters
+Shared by main.py, document_processor.py, the api/ helpers and the Streamlit app.
+Docling itself is imported on the first get_converter() call, so importing
+this module (e.g. for get_pool_stats) stays cheap
+"""
+
+import os
+import threading
+import time
+from typing import Dict
+
+# Pipeline settings used by every ingestion entry point unless overridden
+DEFAULT_PIPELINE_OPTIONS = {
+    'do_ocr': False,
+    # OCR the whole page image instead of only bitmap regions (scanned pages)
+    'force_full_page_ocr': False,
+    'ocr_lang': os.getenv('OCR_LANGS', 'en,ja'),
+    'do_table_structure': True,
+    # TableFormer 'accurate' or 'fast'
+    'table_mode': 'accurate',
+    'images_scale': float(os.getenv('IMAGES_SCALE', '2.0')),
+    'generate_page_images': False,
+    'generate_picture_images': True
+}
+
+_converters = {}
+_warmup_seconds = {}
+_lock = threading.Lock()
+
+
+def _options_key(options: Dict) -> tuple:
+    """Hashable registry key for a set of pipeline options"""
+    # Settings of a disabled stage don't change the converter
+    ignored = set()
+    if not options.get('do_ocr'):
+        ignored.update(('ocr_lang', 'force_full_page_ocr'))
+    if not options.get('do_table_structure'):
+        ignored.add('table_mode')
+    return tuple(sorted((name, value) for name, value in options.items() if name not in ignored))
+
+
+def resolve_options(**overrides) -> Dict:
+    """Merge overrides onto DEFAULT_PIPELINE_OPTIONS"""
+    return {**DEFAULT_PIPELINE_OPTIONS, **overrides}
+
+
+def build_pipeline_options(**overrides):
+    """Build PdfPipelineOptions from the defaults plus any overrides"""
+    from docling.datamodel.pipeline_options import PdfPipelineOptions, TableFormerMode
+
+    options = resolve_options(**overrides)
+
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.do_ocr = options['do_ocr']
+    if options['do_ocr']:
+        pipeline_options.ocr_options.lang = [lang.strip() for lang in options['ocr_lang'].split(',') if lang.strip()]
+        pipeline_options.ocr_options.force_full_page_ocr = options['force_full_page_ocr']
+    pipeline_options.do_table_structure = options['do_table_structure']
+    if options['do_table_structure']:
+        pipeline_options.table_structure_options.mode = (
+            TableFormerMode.FAST if options['table_mode'] == 'fast' else TableFormerMode.ACCURATE
+        )
+    pipeline_options.images_scale = options['images_scale']
+    pipeline_options.generate_page_images = options['generate_page_images']
+    pipeline_options.generate_picture_images = options['generate_picture_images']
+
+    return pipeline_options
+
+
+def get_converter(**overrides):
+    """
+    Get the shared converter for a set of pipeline options
+
+    The first call for a given set of options builds the converter and loads
+    the layout/table models; every later call returns the same warm instance.
+
+    Args:
+        **overrides: Pipeline options that differ from DEFAULT_PIPELINE_OPTIONS
+
+    Returns:
+        Initialized DocumentConverter
+    """
+    options = resolve_options(**overrides)
+    key = _options_key(options)
+
+    converter = _converters.get(key)
+    if converter is not None:
+        return converter
+
+    with _lock:
+        # Another thread may have finished warming up while we waited
+        if key in _converters:
+            return _converters[key]
+
+        print("🔥 Warming up Docling converter...")
+        start = time.perf_counter()
+
+        from docling.datamodel.base_models import InputFormat
+        from docling.document_converter import DocumentConverter, PdfFormatOption
+
+        converter = DocumentConverter(
+            format_options={
+                InputFormat.PDF: PdfFormatOption(
+                    pipeline_options=build_pipeline_options(**options)
+                )
+            }
+        )
+        # Load the models now instead of on the first convert() call
+        converter.initialize_pipeline(InputFormat.PDF)
+
+        elapsed = time.perf_counter() - start
+        _warmup_seconds[key] = elapsed
+        _converters[key] = converter
+
+        print(f"✅ Converter ready in {elapsed:.2f}s")
+
+    return converter
+
+
+def get_pool_stats() -> Dict:
+    """Report which converters are warm and how long each took to initialize"""
+    return {
+        'converters': len(_converters),
+        'warmups': [
+            {'options': dict(key), 'seconds': round(seconds, 3)}
+            for key, seconds in _warmup_seconds.items()
+        ]
+    }
@@ -0,0 +1,234 @@
+"""
+Document identity and near-duplicate detection
+A document is identified by the SHA-256 of its file bytes. Near duplicates
+(re-saved copies, revisions, translations) are found with MinHash signatures
+over the PDF's text layer, read with pypdfium2 in milliseconds per page,
+so they are caught at upload before any Docling or embedding work
+
+Two signatures are kept per document: word shingles catch re-uploads and
+revisions, and shingles of the figures in the text catch translated copies,
+which share their numbers but not their words. LSH band keys stored on the
+documents table find candidates without comparing against every document
+
+Usage:
+    python document_identity.py report.pdf     # check a PDF against the library
+    python document_identity.py --backfill     # fingerprint documents stored earlier
+"""
+
+import hashlib
+import os
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set
+
+from conversion_cache import file_sha256
+
+# Signature slots; LSH splits them into bands of MINHASH_SLOTS / LSH_BANDS rows
+MINHASH_SLOTS = 128
+LSH_BANDS = 32
+WORD_SHINGLE = 5
+NUMBER_SHINGLE = 3
+# Fewer distinct shingles than this gives no signature (too little text to judge)
+MIN_SHINGLES = int(os.getenv('NEAR_DUPLICATE_MIN_SHINGLES', '64'))
+
+# Estimated Jaccard similarity of word shingles for a revision, and above
+# which a document counts as the same text re-uploaded
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', '0.5'))
+SAME_TEXT_THRESHOLD = 0.95
+# Similarity of number shingles for a translated copy
+TRANSLATION_THRESHOLD = float(os.getenv('TRANSLATION_THRESHOLD', '0.5'))
+
+# CJK characters are one token each (no spaces between words); other scripts split into words
+_WORD = re.compile('[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]|[^\\W\\d_]+')
+# Digit runs; '1,234.5' and '1.234,5' both give 1 / 234 / 5 whatever the locale
+_DIGITS = re.compile(r'\d+')
+_IMAGE_MARKER = re.compile(r'<!-- image \d* ?-->')
+
+_MAX_HASH = (1 << 64) - 1
+
+
+def extract_text(pdf_path: str, max_pages: Optional[int] = None) -> str:
+    """Text layer of a PDF, without running Docling (scanned pages give nothing)"""
+    import pypdfium2 as pdfium
+
+    texts = []
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        for page_idx in range(min(len(pdf), max_pages or len(pdf))):
+            page = pdf[page_idx]
+            try:
+                textpage = page.get_textpage()
+                try:
+                    texts.append(textpage.get_text_range())
+                finally:
+                    textpage.close()
+            finally:
+                page.close()
+    finally:
+        pdf.close()
+    return '\n'.join(texts)
+
+
+def _hash(value: str) -> int:
+    # Stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def _shingles(tokens: List[str], size: int) -> Set[int]:
+    if len(tokens) < size:
+        return set()
+    return {_hash(' '.join(tokens[i:i + size])) for i in range(len(tokens) - size + 1)}
+
+
+def shingle_text(text: str) -> Dict[str, Set[int]]:
+    """
+    Hashed word and number shingles of a text
+
+    Works the same on a PDF's text layer and on the stored markdown, so
+    documents stored from either can be compared.
+    """
+    text = unicodedata.normalize('NFKC', _IMAGE_MARKER.sub(' ', text)).casefold()
+    words = _WORD.findall(text)
+    # Single digits are mostly list markers and footnotes
+    numbers = [number.lstrip('0') or '0' for number in _DIGITS.findall(text) if len(number) > 1]
+    return {
+        'text': _shingles(words, WORD_SHINGLE),
+        'numbers': _shingles(numbers, NUMBER_SHINGLE)
+    }
+
+
+def minhash(shingles: Iterable[int], slots: int = MINHASH_SLOTS) -> Optional[List[int]]:
+    """
+    One-permutation MinHash signature of a set of hashed shingles
+
+    Each shingle hash is assigned to a slot by its low bits and each slot
+    keeps its smallest value, which costs one pass instead of one hash per
+    slot. Empty slots borrow from the next filled one (densification), so
+    equal slots still estimate Jaccard similarity.
+
+    Returns:
+        List of `slots` integers, or None for fewer than MIN_SHINGLES shingles
+    """
+    shingles = set(shingles)
+    if len(shingles) < MIN_SHINGLES:
+        return None
+
+    empty = _MAX_HASH
+    signature = [empty] * slots
+    for value in shingles:
+        slot = value % slots
+        value //= slots
+        if value < signature[slot]:
+            signature[slot] = value
+
+    filled = [slot for slot in range(slots) if signature[slot] != empty]
+    for slot in range(slots):
+        if signature[slot] == empty:
+            source = next((s for s in filled if s > slot), filled[0])
+            # Offset by distance so borrowed values don't collide by accident
+            signature[slot] = signature[source] + (source - slot) % slots * (_MAX_HASH // slots // slots)
+    return signature
+
+
+def fingerprint_text(text: str) -> Dict[str, Optional[List[int]]]:
+    """MinHash signatures ('text_minhash', 'number_minhash') of a document's text"""
+    shingles = shingle_text(text or '')
+    return {
+        'text_minhash': minhash(shingles['text']),
+        'number_minhash': minhash(shingles['numbers'])
+    }
+
+
+def fingerprint_pdf(pdf_path: str) -> Dict[str, Optional[List[int]]]:
+    """Signatures of a PDF from its text layer"""
+    return fingerprint_text(extract_text(pdf_path))
+
+
+def lsh_bands(fingerprint: Dict[str, Optional[List[int]]]) -> List[str]:
+    """
+    LSH band keys of a fingerprint
+
+    Two documents share at least one key with high probability once their
+    similarity passes about 0.5 (32 bands of 4 rows).
+    """
+    rows = MINHASH_SLOTS // LSH_BANDS
+    keys = []
+    for prefix, name in (('t', 'text_minhash'), ('n', 'number_minhash')):
+        signature = fingerprint.get(name)
+        if not signature:
+            continue
+        for band in range(LSH_BANDS):
+            values = ','.join(str(value) for value in signature[band * rows:(band + 1) * rows])
+            keys.append(f"{prefix}{band}:{_hash(values):016x}")
+    return keys
+
+
+def similarity(signature_a: Optional[List[int]], signature_b: Optional[List[int]]) -> float:
+    """Estimated Jaccard similarity of two signatures (0.0 if either is missing)"""
+    if not signature_a or not signature_b or len(signature_a) != len(signature_b):
+        return 0.0
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / len(signature_a)
+
+
+def classify(fingerprint: Dict, other: Dict) -> Optional[Dict]:
+    """
+    How a document relates to another one, from their signatures
+
+    Returns:
+        {'kind': 'same text' | 'revision' | 'translation', 'similarity': float},
+        or None when they are unrelated
+    """
+    text_similarity = similarity(fingerprint.get('text_minhash'), other.get('text_minhash'))
+    if text_similarity >= SAME_TEXT_THRESHOLD:
+        return {'kind': 'same text', 'similarity': round(text_similarity, 2)}
+    if text_similarity >= NEAR_DUPLICATE_THRESHOLD:
+        return {'kind': 'revision', 'similarity': round(text_similarity, 2)}
+
+    number_similarity = similarity(fingerprint.get('number_minhash'), other.get('number_minhash'))
+    if number_similarity >= TRANSLATION_THRESHOLD:
+        return {'kind': 'translation', 'similarity': round(number_similarity, 2)}
+    return None
+
+
+def check_pdf(pdf_path: str, manager=None) -> Dict:
+    """
+    Identify a PDF and find library documents it duplicates
+
+    Args:
+        pdf_path: Path to the PDF
+        manager: SupabaseManager to query (default: a new one)
+
+    Returns:
+        Dict with doc_hash, fingerprint and matches (see find_similar_documents)
+    """
+    if manager is None:
+        from supabase_utils import SupabaseManager
+        manager = SupabaseManager()
+
+    doc_hash = file_sha256(pdf_path)
+    fingerprint = fingerprint_pdf(pdf_path)
+    return {
+        'doc_hash': doc_hash,
+        'fingerprint': fingerprint,
+        'matches': manager.find_similar_documents(doc_hash, fingerprint)
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Check a PDF for duplicates in the library")
+    parser.add_argument('pdf', nargs='?', help="PDF to check")
+    parser.add_argument('--backfill', action='store_true',
+                        help="Fingerprint stored documents that have none, from their stored text")
+    args = parser.parse_args()
+
+    if args.backfill:
+        from supabase_utils import SupabaseManager
+        print(f"🔏 Fingerprinted {SupabaseManager().backfill_fingerprints()} documents")
+    elif args.pdf:
+        result = check_pdf(args.pdf)
+        print(json.dumps({'doc_hash': result['doc_hash'], 'matches': result['matches']}, indent=2))
+    else:
+        parser.print_help()
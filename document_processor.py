@@ -3,33 +3,30 @@ Document processor for extracting text and images from PDFs
 Prepares content for storage in Supabase
 """
 
-from docling.document_converter import DocumentConverter
-from docling.datamodel.base_models import InputFormat
-from docling.datamodel.pipeline_options import PdfPipelineOptions
-from docling.document_converter import PdfFormatOption
+from pdf_conversion import convert_pdf, export_markdown, iter_pictures, get_picture_image
+from image_pipeline import ImageWriter, image_extension, image_mime_type
+from image_dedup import ImageDeduplicator
+from chunking import chunk_markdown
 from pathlib import Path
 import base64
+import time
 from typing import Dict, List
-import re
 
 
 class DocumentProcessor:
     """Processes PDFs to extract text chunks and images"""
 
-    def __init__(self):
-        """Initialize document converter"""
-        pipeline_options = PdfPipelineOptions()
-        pipeline_options.do_ocr = False
-        pipeline_options.do_table_structure = True
-        pipeline_options.images_scale = 2.0
-        pipeline_options.generate_page_images = False
-        pipeline_options.generate_picture_images = True
-
-        self.converter = DocumentConverter(
-            format_options={
-                InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
-            }
-        )
+    def __init__(self, shard_workers: int = None, profile: str = None):
+        """
+        Configure conversion (converters come from the shared pool)
+
+        Args:
+            shard_workers: Convert page shards in parallel (default: PDF_SHARD_WORKERS)
+            profile: Speed profile 'fast', 'balanced' or 'accurate' (default: PDF_PROFILE)
+        """
+        self.shard_workers = shard_workers
+        self.profile = profile
+        self.last_image_timings = {}
 
     def process_pdf(self, pdf_path: str) -> Dict:
         """
@@ -43,168 +40,142 @@ class DocumentProcessor:
         """
         print(f"📄 Processing PDF: {pdf_path}")
 
-        # Convert PDF
-        result = self.converter.convert(pdf_path)
-        full_text = result.document.export_to_markdown()
+        # Convert PDF (one part, or one part per page shard)
+        timings = {}
+        step_start = time.perf_counter()
+        timings['pages'] = {}
+        parts = convert_pdf(pdf_path, shard_workers=self.shard_workers, profile=self.profile, stats=timings['pages'])
+        full_text = export_markdown(parts, numbered_images=True)
+        timings['convert_seconds'] = round(time.perf_counter() - step_start, 3)
 
         print(f"✅ Extracted {len(full_text)} characters")
 
         # Extract images
-        images = self._extract_images(result)
+        step_start = time.perf_counter()
+        images = self._extract_images(parts)
+        timings['images_seconds'] = round(time.perf_counter() - step_start, 3)
+        timings['image_encode'] = self.last_image_timings
         print(f"🖼️  Extracted {len(images)} images")
 
         # Create text chunks
-        chunks = self._create_chunks(full_text)
-        print(f"📝 Created {len(chunks)} text chunks")
+        step_start = time.perf_counter()
+        timings['chunking'] = {}
+        chunks = chunk_markdown(full_text, stats=timings['chunking'])
+        timings['chunk_seconds'] = round(time.perf_counter() - step_start, 3)
+        print(f"📝 Created {len(chunks)} text chunks (~{timings['chunking']['embedding_tokens']} tokens to embed)")
 
         return {
             'full_text': full_text,
             'chunks': chunks,
-            'images': images
+            'images': images,
+            'timings': timings
         }
 
-    def _extract_images(self, result) -> List[Dict]:
-        """Extract and encode images from document"""
-        images = []
-
-        if hasattr(result.document, 'pictures') and result.document.pictures:
-            for idx, picture in enumerate(result.document.pictures):
-                try:
-                    # Get image
-                    img = None
-                    if hasattr(picture, 'get_image'):
-                        img = picture.get_image(result.document)
-                    elif hasattr(picture, 'image'):
-                        img = picture.image
-
-                    if img:
-                        # Convert to base64
-                        from io import BytesIO
-                        buffer = BytesIO()
-                        img.save(buffer, format='PNG')
-                        img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-
-                        images.append({
-                            'filename': f"image_{idx+1:03d}.png",
-                            'base64_data': img_base64,
-                            'caption': f"Image {idx+1}",
-                            'context': ''  # TODO: Extract surrounding text
-                        })
-
-                except Exception as e:
-                    print(f"⚠️  Could not extract image {idx+1}: {e}")
-
+    def _extract_images(self, parts) -> List[Dict]:
+        """Extract, deduplicate and encode images from document parts"""
+        writer = ImageWriter()
+        dedup = ImageDeduplicator()
+        images, _ = extract_images(parts, writer, dedup)
+        self.last_image_timings = writer.wait()
+        self.last_image_timings['dedup'] = dict(dedup.stats)
         return images
 
-    def _create_chunks(self, text: str, chunk_size: int = 1000) -> List[Dict]:
-        """
-        Split text into chunks with headings
 
-        Args:
-            text: Full markdown text
-            chunk_size: Approximate characters per chunk
+def extract_images(parts, writer: ImageWriter, dedup: ImageDeduplicator, start_index: int = 0):
+    """
+    Deduplicate and encode the pictures of some document parts
 
-        Returns:
-            List of chunks with text and heading
-        """
-        chunks = []
-
-        # Split by headings (## or ###)
-        sections = re.split(r'(^#{2,3}\s+.+$)', text, flags=re.MULTILINE)
-
-        current_heading = ""
-        current_text = ""
-
-        for section in sections:
-            # Check if this is a heading
-            if re.match(r'^#{2,3}\s+', section):
-                # Save previous chunk if it exists
-                if current_text.strip():
-                    chunks.extend(
-                        self._split_large_text(
-                            current_text,
-                            current_heading,
-                            chunk_size
-                        )
-                    )
-
-                # Update heading
-                current_heading = section.replace('#', '').strip()
-                current_text = ""
-            else:
-                current_text += section
-
-        # Add last chunk
-        if current_text.strip():
-            chunks.extend(
-                self._split_large_text(current_text, current_heading, chunk_size)
-            )
-
-        return chunks
-
-    def _split_large_text(
-        self,
-        text: str,
-        heading: str,
-        chunk_size: int
-    ) -> List[Dict]:
-        """Split large text into smaller chunks while preserving context"""
-        chunks = []
-        text = text.strip()
-
-        if not text:
-            return chunks
-
-        # If text is small enough, return as single chunk
-        if len(text) <= chunk_size:
-            chunks.append({
-                'text': text,
-                'heading': heading
-            })
-            return chunks
-
-        # Split by paragraphs first
-        paragraphs = text.split('\n\n')
-        current_chunk = ""
-
-        for para in paragraphs:
-            # If adding this paragraph exceeds chunk size, save current chunk
-            if len(current_chunk) + len(para) > chunk_size and current_chunk:
-                chunks.append({
-                    'text': current_chunk.strip(),
-                    'heading': heading
-                })
-                current_chunk = para
-            else:
-                current_chunk += "\n\n" + para if current_chunk else para
+    The writer and deduplicator can be shared across calls, so a document
+    converted part by part numbers and deduplicates its images as a whole.
 
-        # Add remaining text
-        if current_chunk.strip():
-            chunks.append({
-                'text': current_chunk.strip(),
-                'heading': heading
+    Args:
+        parts: DoclingDocument parts in page order
+        writer: ImageWriter doing the encoding
+        dedup: ImageDeduplicator holding the images seen so far
+        start_index: Pictures already seen in earlier parts
+
+    Returns:
+        (images, pictures seen including these parts)
+    """
+    extension = image_extension()
+    mime_type = image_mime_type()
+    pending = []
+    seen = start_index
+
+    # Materialize in picture order; encoding (full size + thumbnail) runs on the writer's threads.
+    # Repeats are kept as references to the first copy, decorative images are dropped.
+    for idx, (document, picture) in enumerate(iter_pictures(parts), start=start_index):
+        seen = idx + 1
+        try:
+            img = get_picture_image(document, picture)
+            if not img:
+                continue
+
+            filename = f"image_{idx+1:03d}{extension}"
+            status, image_hash, existing = dedup.classify(img)
+            if status == 'dropped':
+                continue
+            if status == 'duplicate':
+                pending.append((idx, filename, image_hash, existing, None))
+            else:
+                dedup.add(image_hash, filename)
+                pending.append((idx, filename, image_hash, None, writer.submit(img, thumbnail=True)))
+        except Exception as e:
+            print(f"⚠️  Could not extract image {idx+1}: {e}")
+
+    images = []
+    failed = set()  # first copies whose encode failed
+    for idx, filename, image_hash, duplicate_of, future in pending:
+        if duplicate_of in failed:
+            # Its first copy was never encoded, so there is nothing to reference
+            print(f"⚠️  Dropping image {idx+1}: its first copy could not be encoded")
+            continue
+        try:
+            img_base64 = None
+            thumb_base64 = None
+            if future is not None:
+                encoded = future.result()
+                img_base64 = base64.b64encode(encoded['data']).decode('utf-8')
+                thumb_base64 = base64.b64encode(encoded['thumbnail']).decode('utf-8')
+
+            images.append({
+                'filename': filename,
+                'base64_data': img_base64,
+                'thumbnail_base64': thumb_base64,
+                'mime_type': mime_type,
+                'phash': image_hash,
+                'duplicate_of': duplicate_of,  # filename of the first copy
+                'picture_index': idx,  # matches '<!-- image N -->' (N = idx + 1) in the chunks
+                'caption': f"Image {idx+1}",
+                'context': ''  # TODO: Extract surrounding text
             })
+        except Exception as e:
+            print(f"⚠️  Could not encode image {idx+1}: {e}")
+            failed.add(filename)
+            dedup.remove(filename)
 
-        return chunks
+    return images, seen
 
 
-def process_and_prepare(pdf_path: str, filename: str) -> Dict:
+def process_and_prepare(pdf_path: str, filename: str, profile: str = None) -> Dict:
     """
     Convenience function to process PDF and prepare for Supabase storage
 
     Args:
         pdf_path: Path to PDF file
         filename: Original filename
+        profile: Speed profile 'fast', 'balanced' or 'accurate' (default: PDF_PROFILE)
 
     Returns:
         Dict ready for SupabaseManager.store_document()
     """
-    processor = DocumentProcessor()
+    processor = DocumentProcessor(profile=profile)
     result = processor.process_pdf(pdf_path)
 
     return {
         'filename': filename,
         'full_text': result['full_text'],
         'chunks': result['chunks'],
-        'images': result['images']
+        'images': result['images'],
+        'timings': result['timings']
     }
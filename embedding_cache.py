@@ -0,0 +1,258 @@
+"""
+Two-tier cache of text embeddings
+An in-memory LRU in front of a SQLite file, keyed by embedding model, task
+type and a hash of the normalized text, so re-ingested documents, repeated
+questions and regenerated chunks cost a local lookup instead of an API call
+
+Usage:
+    python embedding_cache.py --stats
+    python embedding_cache.py --clear
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+CACHE_ENABLED = os.getenv('EMBEDDING_CACHE', '1') not in ('0', 'false', 'False')
+CACHE_DB = os.getenv('EMBEDDING_CACHE_DB', '.cache/embeddings.sqlite3')
+CACHE_MAX_BYTES = int(float(os.getenv('EMBEDDING_CACHE_MAX_MB', '512')) * 1024 * 1024)
+MEMORY_ITEMS = int(os.getenv('EMBEDDING_CACHE_MEMORY_ITEMS', '4096'))
+
+# Check the on-disk size after this many stores rather than on every one
+_EVICT_EVERY = 256
+# Keep SQLite's bound-parameter count well under its limit
+_QUERY_BATCH = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    task_type TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used);
+"""
+
+_memory: 'OrderedDict[str, List[float]]' = OrderedDict()
+_stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+_lock = threading.Lock()
+_stores_since_evict = 0
+
+
+def normalize_text(text: str) -> str:
+    """NFKC-normalize and collapse whitespace; texts equal after this share an embedding"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+def cache_key(model: str, task_type: str, text: str) -> str:
+    """Cache key for a text embedded with a given model and task type"""
+    digest = hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+    return f"{model}:{task_type}:{digest}"
+
+
+@contextmanager
+def _connect():
+    Path(CACHE_DB).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(CACHE_DB, timeout=30, isolation_level=None)
+    try:
+        conn.execute('PRAGMA busy_timeout = 30000')
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.executescript(_SCHEMA)
+        yield conn
+    finally:
+        conn.close()
+
+
+def _remember(key: str, embedding: List[float]) -> None:
+    """Put an embedding in the in-memory LRU (caller holds _lock)"""
+    _memory[key] = embedding
+    _memory.move_to_end(key)
+    while len(_memory) > MEMORY_ITEMS:
+        _memory.popitem(last=False)
+
+
+def get_many(model: str, task_type: str, texts: List[str]) -> List[Optional[List[float]]]:
+    """
+    Look up embeddings, memory first, then disk
+
+    Args:
+        model: Embedding model name
+        task_type: Task type the embeddings were made for
+        texts: Texts to look up
+
+    Returns:
+        One embedding per text, in input order; None on a miss
+    """
+    keys = [cache_key(model, task_type, text) for text in texts]
+    found: Dict[str, List[float]] = {}
+
+    with _lock:
+        for key in keys:
+            if key in _memory:
+                _memory.move_to_end(key)
+                found[key] = _memory[key]
+    memory_hits = sum(1 for key in keys if key in found)
+
+    missing = [key for key in dict.fromkeys(keys) if key not in found]
+    if missing:
+        try:
+            with _connect() as conn:
+                for start in range(0, len(missing), _QUERY_BATCH):
+                    batch = missing[start:start + _QUERY_BATCH]
+                    placeholders = ','.join('?' for _ in batch)
+                    rows = conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                    ).fetchall()
+                    for key, blob in rows:
+                        found[key] = array('f', blob).tolist()
+                    if rows:
+                        conn.execute(
+                            f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})",
+                            [time.time()] + [key for key, _ in rows]
+                        )
+        except sqlite3.Error as e:
+            print(f"⚠️  Embedding cache unavailable: {e}")
+
+    results = [found.get(key) for key in keys]
+    with _lock:
+        for key in missing:
+            if key in found:
+                _remember(key, found[key])
+        hits = sum(1 for embedding in results if embedding is not None)
+        _stats['memory_hits'] += memory_hits
+        _stats['disk_hits'] += hits - memory_hits
+        _stats['misses'] += len(results) - hits
+
+    return results
+
+
+def put_many(model: str, task_type: str, texts: List[str], embeddings: List[Optional[List[float]]]) -> None:
+    """Store embeddings in both tiers; None entries (failed texts) are skipped"""
+    global _stores_since_evict
+
+    now = time.time()
+    rows = []
+    with _lock:
+        for text, embedding in zip(texts, embeddings):
+            if not embedding:
+                continue
+            key = cache_key(model, task_type, text)
+            _remember(key, embedding)
+            rows.append((key, model, task_type, array('f', embedding).tobytes(), now, now))
+        _stats['stores'] += len(rows)
+        _stores_since_evict += len(rows)
+        run_evict = _stores_since_evict >= _EVICT_EVERY
+        if run_evict:
+            _stores_since_evict = 0
+
+    if not rows:
+        return
+
+    try:
+        with _connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, task_type, vector, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+    except sqlite3.Error as e:
+        print(f"⚠️  Could not cache embeddings: {e}")
+        return
+
+    if run_evict:
+        evict()
+
+
+def evict(max_bytes: int = None) -> int:
+    """
+    Remove least recently used embeddings until the stored vectors fit in max_bytes
+
+    Returns:
+        Number of embeddings removed
+    """
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not Path(CACHE_DB).exists():
+        return 0
+
+    with _connect() as conn:
+        total, count = conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0), COUNT(*) FROM embeddings").fetchone()
+        if total <= max_bytes or not count:
+            return 0
+
+        # Vectors are all about the same size: drop enough of the oldest
+        average = total / count
+        remove = int((total - max_bytes) / average) + 1
+        cursor = conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (remove,)
+        )
+        removed = cursor.rowcount
+
+    with _lock:
+        _stats['evictions'] += removed
+    return removed
+
+
+def get_cache_stats() -> Dict:
+    """Hit/miss counters for this process plus current size on disk"""
+    entries = 0
+    size = 0
+    if Path(CACHE_DB).exists():
+        try:
+            with _connect() as conn:
+                entries, size = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+                ).fetchone()
+        except sqlite3.Error:
+            pass
+
+    with _lock:
+        stats = dict(_stats)
+        memory_items = len(_memory)
+
+    hits = stats['memory_hits'] + stats['disk_hits']
+    lookups = hits + stats['misses']
+    return {
+        'enabled': CACHE_ENABLED,
+        **stats,
+        'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+        'memory_items': memory_items,
+        'entries': entries,
+        'size_mb': round(size / (1024 * 1024), 1),
+        'max_mb': round(CACHE_MAX_BYTES / (1024 * 1024), 1)
+    }
+
+
+def clear() -> None:
+    """Delete every cached embedding"""
+    with _lock:
+        _memory.clear()
+    for suffix in ('', '-wal', '-shm'):
+        Path(CACHE_DB + suffix).unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or clear the embedding cache")
+    parser.add_argument('--stats', action='store_true', help="Show cache size and entry count")
+    parser.add_argument('--clear', action='store_true', help="Delete all cached embeddings")
+    args = parser.parse_args()
+
+    if args.clear:
+        clear()
+        print(f"🗑️  Cleared {CACHE_DB}")
+    else:
+        print(json.dumps(get_cache_stats(), indent=2))
@@ -0,0 +1,207 @@
+"""
+Concurrent, rate-limited Gemini embedding client
+Batches run concurrently on asyncio under a semaphore, every request reserves
+capacity from the shared quota scheduler (llm_scheduler), and 429/5xx
+responses are retried with jittered exponential backoff. Texts that still
+fail come back as None (or raise EmbeddingError) instead of as empty vectors
+"""
+
+import asyncio
+import os
+import random
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import llm_scheduler
+from chunking import estimate_tokens
+
+EMBED_CONCURRENCY = int(os.getenv('EMBED_CONCURRENCY', '4'))
+EMBED_MAX_RETRIES = int(os.getenv('EMBED_MAX_RETRIES', '5'))
+EMBED_BACKOFF_BASE = float(os.getenv('EMBED_BACKOFF_BASE', '1.0'))
+EMBED_BACKOFF_MAX = float(os.getenv('EMBED_BACKOFF_MAX', '60'))
+
+# HTTP statuses worth retrying: rate limited, or a transient server error
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Rejections caused by one of the inputs (e.g. a text over the token limit);
+# splitting the batch isolates it. Anything else (auth, bad model) fails every text
+_INPUT_ERROR = re.compile(r'too long|too large|exceed|limit|token', re.IGNORECASE)
+
+
+class EmbeddingError(Exception):
+    """An embedding request failed after all retries"""
+
+    def __init__(self, message: str, retryable: bool = False, per_item: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+        # Caused by some of the texts: a smaller batch can still succeed
+        self.per_item = per_item
+
+
+def is_retryable(error: Exception) -> bool:
+    """True for rate limits, transient server errors and dropped connections"""
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    code = getattr(error, 'code', None)
+    if callable(code):  # grpc errors expose code() instead of an HTTP status
+        code = getattr(error, 'grpc_status_code', None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS
+    name = type(error).__name__
+    return name in ('ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable',
+                    'InternalServerError', 'DeadlineExceeded', 'GatewayTimeout')
+
+
+def is_input_error(error: Exception) -> bool:
+    """True when a request was rejected because of one of its inputs"""
+    code = getattr(error, 'code', None)
+    if callable(code):
+        code = getattr(error, 'grpc_status_code', None)
+    invalid = code == 400 or type(error).__name__ in ('InvalidArgument', 'BadRequest')
+    return invalid and bool(_INPUT_ERROR.search(str(error)))
+
+
+def backoff_seconds(attempt: int, base: float = None, cap: float = None) -> float:
+    """Full-jitter exponential backoff for a 0-based retry attempt"""
+    base = EMBED_BACKOFF_BASE if base is None else base
+    cap = EMBED_BACKOFF_MAX if cap is None else cap
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class EmbeddingClient:
+    """Embeds text batches concurrently within the shared Gemini quota"""
+
+    def __init__(self, model: str, concurrency: int = None, max_retries: int = None):
+        """
+        Args:
+            model: Gemini embedding model
+            concurrency: Requests in flight per call (default: EMBED_CONCURRENCY)
+            max_retries: Retries per request on 429/5xx (default: EMBED_MAX_RETRIES)
+        """
+        self.model = model
+        self.concurrency = max(1, concurrency or EMBED_CONCURRENCY)
+        self.max_retries = EMBED_MAX_RETRIES if max_retries is None else max_retries
+        self.stats = {'requests': 0, 'retries': 0, 'failed_texts': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    async def _call(self, texts: List[str], task_type: str) -> List[List[float]]:
+        import google.generativeai as genai
+
+        # The blocking client on a worker thread: genai.embed_content_async keeps a
+        # process-wide grpc.aio channel bound to the first event loop, and every
+        # embed() call runs its own loop, possibly on another thread
+        result = await asyncio.to_thread(genai.embed_content, model=self.model, content=texts, task_type=task_type)
+        return result['embedding']
+
+    async def _request(self, texts: List[str], task_type: str, priority: int) -> List[Optional[List[float]]]:
+        """One embed request, retried with backoff on retryable errors; None for empty embeddings"""
+        tokens = sum(estimate_tokens(text) for text in texts)
+        attempt = 0
+        while True:
+            await asyncio.to_thread(llm_scheduler.acquire, 'embed', tokens, priority)
+            self._count('requests')
+            try:
+                embeddings = await self._call(texts, task_type)
+                if len(embeddings) != len(texts):
+                    raise EmbeddingError(f"expected {len(texts)} embeddings, got {len(embeddings)}", per_item=True)
+                empty = sum(1 for embedding in embeddings if not embedding)
+                if empty:
+                    print(f"❌ {empty} empty embedding(s) in response")
+                    self._count('failed_texts', empty)
+                return [embedding or None for embedding in embeddings]
+            except EmbeddingError:
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    raise EmbeddingError(str(e), per_item=is_input_error(e)) from e
+                if attempt >= self.max_retries:
+                    raise EmbeddingError(f"gave up after {attempt + 1} attempts: {e}", retryable=True) from e
+                delay = backoff_seconds(attempt)
+                self._count('retries')
+                print(f"⏳ Embedding request throttled or failed ({e}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _embed_batch(
+        self,
+        texts: List[str],
+        task_type: str,
+        priority: int,
+        semaphore: asyncio.Semaphore
+    ) -> List[Optional[List[float]]]:
+        """Embed a batch, bisecting when some of its texts were rejected"""
+        try:
+            # Every request, including the halves of a split batch, holds a slot
+            async with semaphore:
+                return await self._request(texts, task_type, priority)
+        except EmbeddingError as e:
+            # Rate limits and auth/model errors affect every text alike; splitting would not help
+            if len(texts) == 1 or not e.per_item:
+                print(f"❌ Could not embed {len(texts)} text(s): {e}")
+                self._count('failed_texts', len(texts))
+                return [None] * len(texts)
+            middle = len(texts) // 2
+            first, second = await asyncio.gather(
+                self._embed_batch(texts[:middle], task_type, priority, semaphore),
+                self._embed_batch(texts[middle:], task_type, priority, semaphore)
+            )
+            return first + second
+
+    async def embed_async(
+        self,
+        texts: List[str],
+        task_type: str = "retrieval_document",
+        batch_size: int = 100,
+        priority: int = llm_scheduler.BATCH
+    ) -> List[Optional[List[float]]]:
+        """
+        Embed texts in concurrent batches
+
+        Args:
+            priority: llm_scheduler.INTERACTIVE for user-facing queries
+
+        Returns:
+            One embedding per text, in input order; None where a text failed
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        batch_size = max(1, batch_size)
+
+        batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+        results = await asyncio.gather(*(self._embed_batch(batch, task_type, priority, semaphore) for batch in batches))
+        return [embedding for batch in results for embedding in batch]
+
+    def embed(
+        self,
+        texts: List[str],
+        task_type: str = "retrieval_document",
+        batch_size: int = 100,
+        priority: int = llm_scheduler.BATCH
+    ) -> List[Optional[List[float]]]:
+        """Blocking embed_async() for synchronous callers (threads, Streamlit)"""
+        if not texts:
+            return []
+        coro = self.embed_async(texts, task_type, batch_size, priority)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coro)
+        # Called from inside an event loop: run on a separate thread's loop
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coro).result()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(model: str) -> EmbeddingClient:
+    """Process-wide client per model"""
+    with _clients_lock:
+        if model not in _clients:
+            _clients[model] = EmbeddingClient(model)
+        return _clients[model]
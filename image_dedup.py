@@ -0,0 +1,187 @@
+"""
+Perceptual-hash image deduplication
+Repeated logos, banners and icons are stored once and referenced afterwards;
+tiny or blank decorative images are dropped
+"""
+
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single writer assumed
+    fcntl = None
+
+# Hamming distance (out of 64 bits) at which two images count as the same
+DEDUP_MAX_DISTANCE = int(os.getenv('IMAGE_DEDUP_DISTANCE', '4'))
+# Images smaller than this (pixels, either side) are treated as decoration
+MIN_IMAGE_SIDE = int(os.getenv('IMAGE_MIN_SIDE', '40'))
+# Images whose grayscale range is narrower than this are blank fills/rules
+MIN_IMAGE_CONTRAST = int(os.getenv('IMAGE_MIN_CONTRAST', '8'))
+
+
+def dhash(img, hash_size: int = 8) -> str:
+    """
+    Difference hash of an image
+
+    Args:
+        img: PIL image
+        hash_size: Hash is hash_size x hash_size bits
+
+    Returns:
+        Hex string (16 chars for the default 64-bit hash)
+    """
+    small = img.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def hamming(hash_a: str, hash_b: str) -> int:
+    """Number of differing bits between two hex hashes"""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+
+def is_decorative(img, min_side: int = None, min_contrast: int = None) -> bool:
+    """True for images too small or too flat to carry content"""
+    min_side = MIN_IMAGE_SIDE if min_side is None else min_side
+    min_contrast = MIN_IMAGE_CONTRAST if min_contrast is None else min_contrast
+
+    width, height = img.size
+    if width < min_side or height < min_side:
+        return True
+
+    low, high = img.convert('L').getextrema()
+    return (high - low) < min_contrast
+
+
+class ImageDeduplicator:
+    """Tracks perceptual hashes seen so far and classifies each new image"""
+
+    def __init__(self, max_distance: int = None, index: Dict[str, str] = None):
+        """
+        Args:
+            max_distance: Hamming distance threshold (default: IMAGE_DEDUP_DISTANCE)
+            index: Existing hash -> reference map (e.g. from other documents)
+        """
+        self.max_distance = DEDUP_MAX_DISTANCE if max_distance is None else max_distance
+        self.index: Dict[str, str] = dict(index or {})
+        self.stats = {'unique': 0, 'duplicates': 0, 'dropped': 0}
+
+    def find(self, image_hash: str) -> Optional[str]:
+        """Reference of a previously seen image within max_distance, if any"""
+        if image_hash in self.index:
+            return self.index[image_hash]
+
+        if self.max_distance > 0:
+            for seen_hash, ref in self.index.items():
+                if hamming(image_hash, seen_hash) <= self.max_distance:
+                    return ref
+
+        return None
+
+    def classify(self, img) -> Tuple[str, Optional[str], Optional[str]]:
+        """
+        Classify an image against everything seen so far
+
+        Returns:
+            (status, hash, existing_ref) where status is 'dropped',
+            'duplicate' or 'unique'. Call add() after storing a unique image.
+        """
+        if is_decorative(img):
+            self.stats['dropped'] += 1
+            return 'dropped', None, None
+
+        image_hash = dhash(img)
+        existing = self.find(image_hash)
+        if existing is not None:
+            self.stats['duplicates'] += 1
+            return 'duplicate', image_hash, existing
+
+        self.stats['unique'] += 1
+        return 'unique', image_hash, None
+
+    def add(self, image_hash: str, ref: str) -> None:
+        """Record where a unique image was stored"""
+        self.index[image_hash] = ref
+
+    def remove(self, ref: str) -> None:
+        """Forget an image that could not be stored, so its next copy is stored instead"""
+        self.index = {image_hash: seen for image_hash, seen in self.index.items() if seen != ref}
+
+
+def load_index(index_file: str, base_folder: str, exclude_prefix: str = '') -> Dict[str, str]:
+    """
+    Load a shared hash -> relative path index, keeping only files that still exist
+
+    Args:
+        index_file: JSON index path
+        base_folder: Folder the stored paths are relative to
+        exclude_prefix: Drop entries under this prefix (a document being re-processed)
+    """
+    if not os.path.exists(index_file):
+        return {}
+
+    try:
+        with open(index_file, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    return {
+        image_hash: rel_path
+        for image_hash, rel_path in index.items()
+        if not (exclude_prefix and rel_path.startswith(exclude_prefix))
+        and (Path(base_folder) / rel_path).exists()
+    }
+
+
+@contextmanager
+def _locked(index_file: str):
+    """Hold an exclusive lock on the index while it is read, merged and replaced"""
+    if fcntl is None:
+        yield
+        return
+    # A separate lock file: the index itself is replaced, which would drop the lock
+    with open(f"{index_file}.lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def update_index(index_file: str, entries: Dict[str, str]) -> None:
+    """
+    Merge new entries into the shared index and write it atomically
+
+    Batch workers update the same index; the read-modify-write happens under
+    a file lock so concurrent documents don't drop each other's entries.
+    """
+    with _locked(index_file):
+        index = {}
+        if os.path.exists(index_file):
+            try:
+                with open(index_file, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = {}
+
+        index.update(entries)
+
+        tmp_file = f"{index_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_file, index_file)
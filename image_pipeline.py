@@ -0,0 +1,167 @@
+"""
+Image renditions and concurrent encoding for extracted pictures
+Each picture becomes a compressed full-size rendition plus a small thumbnail.
+Encoding runs on a bounded thread pool (Pillow releases the GIL while
+encoding) so it overlaps with markdown assembly on the main thread
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', str(min(8, os.cpu_count() or 1))))
+
+# Rendition settings
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'webp').lower()
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '80'))
+IMAGE_MAX_DIM = int(os.getenv('IMAGE_MAX_DIM', '1600'))
+THUMBNAIL_MAX_DIM = int(os.getenv('THUMBNAIL_MAX_DIM', '320'))
+
+# format name -> (Pillow format, MIME type, file extension)
+FORMATS = {
+    'png': ('PNG', 'image/png', '.png'),
+    'webp': ('WEBP', 'image/webp', '.webp'),
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg'),
+    'jpg': ('JPEG', 'image/jpeg', '.jpg')
+}
+
+
+def image_extension(image_format: str = None) -> str:
+    """File extension for a rendition format (e.g. '.webp')"""
+    return FORMATS[(image_format or IMAGE_FORMAT).lower()][2]
+
+
+def image_mime_type(image_format: str = None) -> str:
+    """MIME type for a rendition format"""
+    return FORMATS[(image_format or IMAGE_FORMAT).lower()][1]
+
+
+def encode_image(img, image_format: str = None, quality: int = None, max_dim: int = None) -> bytes:
+    """
+    Encode one rendition of an image
+
+    Args:
+        img: PIL image
+        image_format: 'webp', 'jpeg' or 'png' (default: IMAGE_FORMAT)
+        quality: Lossy quality 1-100 (default: IMAGE_QUALITY)
+        max_dim: Downscale so neither side exceeds this; 0 keeps the size
+
+    Returns:
+        Encoded image bytes
+    """
+    pil_format = FORMATS[(image_format or IMAGE_FORMAT).lower()][0]
+    quality = IMAGE_QUALITY if quality is None else quality
+    max_dim = IMAGE_MAX_DIM if max_dim is None else max_dim
+
+    if max_dim and max(img.size) > max_dim:
+        img = img.copy()
+        img.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS)
+
+    save_args = {}
+    if pil_format == 'JPEG':
+        # JPEG has no alpha channel: flatten onto white
+        if img.mode in ('RGBA', 'LA', 'P'):
+            rgba = img.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.split()[-1])
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        save_args = {'quality': quality, 'optimize': True}
+    elif pil_format == 'WEBP':
+        save_args = {'quality': quality, 'method': 4}
+    else:
+        save_args = {'optimize': False}
+
+    buffer = BytesIO()
+    img.save(buffer, format=pil_format, **save_args)
+    return buffer.getvalue()
+
+
+class ImageWriter:
+    """Encodes image renditions on a bounded thread pool and records stage timings"""
+
+    def __init__(self, max_workers: int = None, max_pending: int = None, image_format: str = None):
+        """
+        Args:
+            max_workers: Encoder threads (default: IMAGE_WORKERS)
+            max_pending: Images allowed in flight before submit() blocks
+                         (default: 2x workers), bounding decoded-image memory
+            image_format: Rendition format (default: IMAGE_FORMAT)
+        """
+        self.max_workers = max_workers or IMAGE_WORKERS
+        self.image_format = (image_format or IMAGE_FORMAT).lower()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='image-writer')
+        self._slots = threading.BoundedSemaphore(max_pending or self.max_workers * 2)
+        self._futures: List[Future] = []
+        self._lock = threading.Lock()
+        self._encode_seconds = 0.0
+        self._bytes_written = 0
+        self._started = time.perf_counter()
+
+    def _encode(self, img, path: Optional[str], thumbnail_path: Optional[str], thumbnail: bool) -> Dict:
+        try:
+            start = time.perf_counter()
+            data = encode_image(img, self.image_format)
+            thumb = None
+            if thumbnail or thumbnail_path:
+                thumb = encode_image(img, self.image_format, max_dim=THUMBNAIL_MAX_DIM)
+
+            for target, payload in ((path, data), (thumbnail_path, thumb)):
+                if target:
+                    with open(target, 'wb') as f:
+                        f.write(payload)
+
+            with self._lock:
+                self._encode_seconds += time.perf_counter() - start
+                self._bytes_written += len(data) + len(thumb or b'')
+
+            return {'data': data, 'thumbnail': thumb}
+        finally:
+            self._slots.release()
+
+    def submit(self, img, path: str = None, thumbnail_path: str = None, thumbnail: bool = False) -> Future:
+        """
+        Queue an image for encoding
+
+        Args:
+            img: PIL image
+            path: Write the full-size rendition here as well (optional)
+            thumbnail_path: Write the thumbnail here as well (optional)
+            thumbnail: Produce a thumbnail even when not writing it to disk
+
+        Returns:
+            Future resolving to {'data': bytes, 'thumbnail': bytes or None}
+        """
+        self._slots.acquire()
+        future = self._pool.submit(self._encode, img, path, thumbnail_path, thumbnail)
+        self._futures.append(future)
+        return future
+
+    def wait(self) -> Dict:
+        """
+        Wait for all queued images and shut the pool down
+
+        Returns:
+            Timing breakdown for the encode stage
+        """
+        failed = 0
+        for future in self._futures:
+            if future.exception() is not None:
+                failed += 1
+        self._pool.shutdown(wait=True)
+
+        return {
+            'images': len(self._futures),
+            'format': self.image_format,
+            'failed': failed,
+            'workers': self.max_workers,
+            'encode_seconds': round(self._encode_seconds, 3),
+            'wall_seconds': round(time.perf_counter() - self._started, 3),
+            'bytes': self._bytes_written
+        }
@@ -0,0 +1,279 @@
+"""
+Streaming ingestion pipeline: convert → chunk → embed → store
+The PDF is converted a page range at a time; each part's chunks are embedded
+and written to Supabase while later pages still convert. Stages are joined by
+bounded queues, so a large report never has to be held in memory at once
+and the first chunks are stored within seconds. They become searchable
+together, when the document is published at the end
+
+Usage:
+    python ingest_pipeline.py report.pdf
+"""
+
+import os
+import queue
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+# Embedding threads (Gemini calls are network-bound)
+EMBED_WORKERS = int(os.getenv('PIPELINE_EMBED_WORKERS', '4'))
+# Batches allowed to wait between stages before the producer blocks
+QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '8'))
+# Pages converted per part; smaller parts reach the database sooner
+STREAM_PAGES = int(os.getenv('PIPELINE_STREAM_PAGES', '10'))
+
+_DONE = object()
+
+
+class PipelineStopped(Exception):
+    """Raised inside a stage when another stage has failed"""
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> None:
+    """Blocking put that gives up once the pipeline is stopping"""
+    while True:
+        if stop.is_set():
+            raise PipelineStopped()
+        try:
+            q.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    """Blocking get that gives up once the pipeline is stopping"""
+    while True:
+        if stop.is_set():
+            raise PipelineStopped()
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+
+
+def ingest_pdf(
+    pdf_path: str,
+    filename: Optional[str] = None,
+    profile: Optional[str] = None,
+    manager=None,
+    embed_workers: Optional[int] = None,
+    queue_size: Optional[int] = None,
+    stream_pages: Optional[int] = None,
+    progress: Optional[Callable[[float, str], None]] = None,
+    replaces: Optional[int] = None
+) -> Dict:
+    """
+    Convert a PDF and store it in Supabase, streaming part by part
+
+    Stages:
+        convert + chunk (calling thread) → embed (embed_workers threads) → store (one thread)
+    Images are encoded per part and go straight to the store stage.
+
+    Args:
+        pdf_path: Path to PDF file
+        filename: Original filename (default: the file's name)
+        profile: Speed profile 'fast', 'balanced' or 'accurate' (default: PDF_PROFILE)
+        manager: SupabaseManager to use (default: a new one)
+        embed_workers: Embedding threads (default: PIPELINE_EMBED_WORKERS)
+        queue_size: Batches buffered between stages (default: PIPELINE_QUEUE_SIZE)
+        stream_pages: Pages per converted part (default: PIPELINE_STREAM_PAGES)
+        progress: Optional callback(fraction, message)
+        replaces: Id of a stored document this PDF is a new version of
+
+    Returns:
+        Dict with document_id and stats, like SupabaseManager.store_document(),
+        plus a 'timings' entry
+    """
+    from chunking import StreamingChunker, number_images
+    from conversion_cache import file_sha256
+    from conversion_supervisor import PeakMemory
+    from document_identity import fingerprint_pdf
+    from document_processor import extract_images
+    from image_dedup import ImageDeduplicator
+    from image_pipeline import ImageWriter
+    from pdf_conversion import iter_convert_pdf
+
+    if manager is None:
+        from supabase_utils import SupabaseManager
+        manager = SupabaseManager()
+
+    filename = filename or Path(pdf_path).name
+    embed_workers = max(1, embed_workers or EMBED_WORKERS)
+    queue_size = max(1, queue_size or QUEUE_SIZE)
+    stream_pages = stream_pages or STREAM_PAGES
+    report = progress or (lambda fraction, message: None)
+
+    print(f"📄 Streaming ingestion: {pdf_path}")
+    started = time.perf_counter()
+    timings = {'pages': {}, 'first_chunk_seconds': None}
+
+    embed_queue = queue.Queue(maxsize=queue_size)
+    store_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    # match_chunks (producer) and the inserts (store stage) share the session
+    db_lock = threading.Lock()
+    counters = {'embedded': 0, 'embed_seconds': 0.0, 'store_seconds': 0.0}
+    counters_lock = threading.Lock()
+
+    def fail(error: BaseException) -> None:
+        if not isinstance(error, PipelineStopped):
+            errors.append(error)
+        stop.set()
+
+    def embed_stage() -> None:
+        try:
+            while True:
+                rows = _get(embed_queue, stop)
+                if rows is _DONE:
+                    return
+                step_start = time.perf_counter()
+                embedded = manager.embed_rows(rows)
+                with counters_lock:
+                    counters['embedded'] += embedded
+                    counters['embed_seconds'] += time.perf_counter() - step_start
+                _put(store_queue, ('chunks', rows), stop)
+        except BaseException as e:
+            fail(e)
+
+    def store_stage() -> None:
+        try:
+            while True:
+                item = _get(store_queue, stop)
+                if item is _DONE:
+                    return
+                kind, batch = item
+                step_start = time.perf_counter()
+                with db_lock:
+                    if kind == 'chunks':
+                        manager.insert_chunks(session, batch)
+                    else:
+                        manager.store_images(session, batch)
+                with counters_lock:
+                    counters['store_seconds'] += time.perf_counter() - step_start
+                if kind == 'chunks' and timings['first_chunk_seconds'] is None:
+                    timings['first_chunk_seconds'] = round(time.perf_counter() - started, 3)
+                    print(f"⚡ First chunks stored after {timings['first_chunk_seconds']:.1f}s")
+        except BaseException as e:
+            fail(e)
+
+    with PeakMemory() as memory:
+        # Identity from the file's bytes and text layer, before any conversion
+        session = manager.begin_document(filename, doc_hash=file_sha256(pdf_path),
+                                         fingerprint=fingerprint_pdf(pdf_path), replaces=replaces)
+
+        embedders = [
+            threading.Thread(target=embed_stage, name=f'pipeline-embed-{i}', daemon=True)
+            for i in range(embed_workers)
+        ]
+        storer = threading.Thread(target=store_stage, name='pipeline-store', daemon=True)
+        for thread in embedders + [storer]:
+            thread.start()
+
+        chunker = StreamingChunker()
+        writer = ImageWriter()
+        dedup = ImageDeduplicator()
+        # The document's text is only needed once, by finish_document; keep it on disk
+        text_spool = tempfile.TemporaryFile('w+', encoding='utf-8')
+        chunk_index = 0
+        pictures_seen = 0
+        pages_done = 0
+
+        def send_chunks(chunks: List[Dict]) -> None:
+            nonlocal chunk_index
+            if not chunks:
+                return
+            indexed = list(enumerate(chunks, start=chunk_index))
+            chunk_index += len(chunks)
+            with db_lock:
+                rows = manager.match_chunks(session, indexed)
+            if rows:
+                _put(embed_queue, rows, stop)
+
+        try:
+            report(0.02, "Converting")
+            for part in iter_convert_pdf(pdf_path, profile=profile, stats=timings['pages'], stream_pages=stream_pages):
+                if stop.is_set():
+                    raise PipelineStopped()
+
+                # Number placeholders so chunks know which pictures they contain
+                text = number_images(part.export_to_markdown(), pictures_seen)
+                if text:
+                    if text_spool.tell():
+                        text_spool.write('\n\n')
+                    text_spool.write(text)
+                    send_chunks(chunker.feed(text))
+
+                images, pictures_seen = extract_images([part], writer, dedup, start_index=pictures_seen)
+                if images:
+                    _put(store_queue, ('images', images), stop)
+
+                pages_done += len(getattr(part, 'pages', None) or {})
+                page_count = timings['pages'].get('page_count') or 0
+                if page_count:
+                    report(0.05 + 0.85 * min(1.0, pages_done / page_count),
+                           f"Converted {pages_done}/{page_count} pages, {chunk_index} chunks queued")
+                del part
+
+            send_chunks(chunker.finish())
+
+            for _ in embedders:
+                _put(embed_queue, _DONE, stop)
+            for thread in embedders:
+                thread.join()
+            _put(store_queue, _DONE, stop)
+            storer.join()
+        except BaseException as e:
+            fail(e)
+        finally:
+            for thread in embedders + [storer]:
+                thread.join()
+            timings['image_encode'] = writer.wait()
+            timings['image_encode']['dedup'] = dict(dedup.stats)
+
+        if errors:
+            text_spool.close()
+            with db_lock:
+                manager.abort_document(session)
+            raise errors[0]
+
+        report(0.95, "Finalizing")
+        with text_spool:
+            text_spool.seek(0)
+            full_text = text_spool.read()
+        try:
+            result = manager.finish_document(session, full_text)
+        except Exception:
+            manager.abort_document(session)
+            raise
+        del full_text
+
+    timings['chunking'] = chunker.stats
+    timings['chunks_embedded'] = counters['embedded']
+    timings['embed_seconds'] = round(counters['embed_seconds'], 3)
+    timings['store_seconds'] = round(counters['store_seconds'], 3)
+    timings['total_seconds'] = round(time.perf_counter() - started, 3)
+    timings['peak_rss_mb'] = round(memory.peak_mb, 1)
+    result['timings'] = timings
+
+    print(f"✅ Stored {result['chunks_stored'] + result['chunks_deduplicated'] + result['chunks_unchanged']} chunks "
+          f"and {result['images_stored']} images in {timings['total_seconds']:.1f}s "
+          f"(peak RSS {timings['peak_rss_mb']:.0f} MB)")
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stream a PDF into Supabase")
+    parser.add_argument('pdf', help="PDF to ingest")
+    parser.add_argument('--profile', default=None, help="Speed profile: fast, balanced or accurate")
+    parser.add_argument('--stream-pages', type=int, default=None, help="Pages per converted part")
+    args = parser.parse_args()
+
+    ingest_pdf(args.pdf, profile=args.profile, stream_pages=args.stream_pages,
+               progress=lambda fraction, message: print(f"   [{fraction:>4.0%}] {message}"))
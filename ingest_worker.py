@@ -0,0 +1,168 @@
+"""
+Ingestion worker daemon
+Drains the SQLite job queue: converts PDFs and stores them in Supabase
+(or writes markdown) while keeping its lease alive with heartbeats
+
+Usage:
+    python ingest_worker.py
+    python ingest_worker.py --once --lease 600
+"""
+
+import argparse
+import threading
+import time
+import traceback
+from typing import Dict
+
+import job_queue
+
+
+class LeaseLost(Exception):
+    """Another worker has taken the job over; this one must stop"""
+
+
+class LeaseKeeper:
+    """
+    Background heartbeat that extends a job lease and publishes progress
+
+    Once a heartbeat finds the lease gone, update() raises LeaseLost, so a
+    handler stops at its next progress report instead of ingesting the same
+    document alongside the worker that reclaimed the job.
+    """
+
+    def __init__(self, job_id: int, owner: str, lease_seconds: int):
+        self.job_id = job_id
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._progress = None
+        self._message = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def update(self, progress: float, message: str) -> None:
+        """Record and publish progress; raises LeaseLost if the job was taken over"""
+        self.check()
+        self._progress = progress
+        self._message = message
+        print(f"   [{progress:>4.0%}] {message}")
+        self._beat()
+        self.check()
+
+    def check(self) -> None:
+        """Raise LeaseLost if the lease has been lost"""
+        if self.lost:
+            raise LeaseLost(f"Lease on job {self.job_id} was lost")
+
+    def _beat(self) -> None:
+        if not self.lost and not job_queue.heartbeat(
+            self.job_id, self.owner, self.lease_seconds, self._progress, self._message
+        ):
+            self.lost = True
+
+    def _run(self) -> None:
+        # Renew well before expiry so a slow heartbeat never loses the lease
+        while not self.lost and not self._stop.wait(max(1, self.lease_seconds / 3)):
+            self._beat()
+
+
+def run_ingest(payload: Dict, lease: LeaseKeeper) -> Dict:
+    """Convert a PDF and store it in Supabase, streaming chunks as pages convert"""
+    from ingest_pipeline import ingest_pdf
+
+    return ingest_pdf(payload['pdf_path'], payload['filename'], progress=lease.update,
+                      replaces=payload.get('replaces'))
+
+
+def run_markdown(payload: Dict, lease: LeaseKeeper) -> Dict:
+    """Run process_pdf_to_markdown for a queued PDF"""
+    from main import process_pdf_to_markdown
+
+    lease.update(0.05, "Converting to markdown")
+    result = process_pdf_to_markdown(
+        payload['pdf_path'],
+        payload['output_folder'],
+        payload['pdf_name'],
+        enable_leap=payload.get('enable_leap', False)
+    )
+    return {
+        'markdown_file': result['markdown_file'],
+        'images_folder': result['images_folder'],
+        'image_count': result['image_count'],
+        'leap_files': result['leap_files'],
+        'timings': result['timings']
+    }
+
+
+HANDLERS = {
+    'ingest': run_ingest,
+    'markdown': run_markdown
+}
+
+
+def run_worker(lease_seconds: int = None, poll_seconds: float = 5, once: bool = False) -> None:
+    """
+    Claim and run jobs until interrupted
+
+    Args:
+        lease_seconds: Lease length per claim (default: JOB_LEASE_SECONDS)
+        poll_seconds: Sleep between polls when the queue is empty
+        once: Exit when the queue is empty instead of polling
+    """
+    lease_seconds = lease_seconds or job_queue.DEFAULT_LEASE_SECONDS
+    owner = job_queue.worker_id()
+
+    print(f"👷 Worker {owner} polling {job_queue.QUEUE_DB}")
+
+    while True:
+        job = job_queue.claim(owner, lease_seconds, kinds=list(HANDLERS))
+        if job is None:
+            if once:
+                print("✅ Queue empty")
+                return
+            time.sleep(poll_seconds)
+            continue
+
+        print(f"\n🔄 Job {job['id']} ({job['kind']}) attempt {job['attempts']}/{job['max_attempts']}")
+
+        try:
+            with LeaseKeeper(job['id'], owner, lease_seconds) as lease:
+                result = HANDLERS[job['kind']](job['payload'], lease)
+
+            if lease.lost or not job_queue.complete(job['id'], owner, result):
+                print(f"⚠️  Lease on job {job['id']} was lost; result discarded")
+            else:
+                print(f"✅ Job {job['id']} done")
+
+        except LeaseLost:
+            # The worker that reclaimed the job owns it now; nothing to record
+            print(f"⚠️  Lease on job {job['id']} was lost; stopped")
+        except Exception as e:
+            traceback.print_exc()
+            job_queue.fail(job['id'], owner, str(e))
+            print(f"❌ Job {job['id']} failed: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an ingestion worker")
+    parser.add_argument('--lease', type=int, default=None, help="Lease seconds (default: JOB_LEASE_SECONDS)")
+    parser.add_argument('--poll', type=float, default=5, help="Seconds between polls when idle")
+    parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+    args = parser.parse_args()
+
+    try:
+        run_worker(lease_seconds=args.lease, poll_seconds=args.poll, once=args.once)
+    except KeyboardInterrupt:
+        print("\n🛑 Worker stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+Durable ingestion job queue backed by SQLite
+Workers claim jobs under time-limited leases; a job whose worker stops
+heartbeating is handed to another worker once its lease expires
+
+Usage:
+    python job_queue.py --list
+    python job_queue.py --enqueue temp/uploads/report.pdf
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Put this on a shared filesystem for several worker hosts to drain one queue
+QUEUE_DB = os.getenv('JOB_QUEUE_DB', 'temp/jobs.sqlite3')
+DEFAULT_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '300'))
+DEFAULT_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    job_key TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs(kind, job_key);
+"""
+
+
+def worker_id() -> str:
+    """Identifier for this worker process (host:pid)"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+@contextmanager
+def _connect(db_path: str = None):
+    db_path = db_path or QUEUE_DB
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+
+    # Rollback journal rather than WAL: WAL needs shared memory, which
+    # network filesystems do not provide
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute('PRAGMA busy_timeout = 30000')
+        conn.executescript(_SCHEMA)
+        yield conn
+    finally:
+        conn.close()
+
+
+def _row_to_job(row) -> Optional[Dict]:
+    if row is None:
+        return None
+    job = dict(row)
+    job['payload'] = json.loads(job['payload']) if job['payload'] else {}
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+def enqueue(kind: str, payload: Dict, job_key: str = None, max_attempts: int = None) -> int:
+    """
+    Add a job to the queue
+
+    Args:
+        kind: Job type handled by the worker (e.g. 'ingest')
+        payload: JSON-serializable job arguments
+        job_key: Deduplication key; an active job with the same kind and key
+                 is returned instead of queueing a second one
+        max_attempts: Attempts before the job is marked failed
+
+    Returns:
+        Job id
+    """
+    now = time.time()
+    with _connect() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if job_key:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE kind = ? AND job_key = ? AND status IN ('queued', 'running')",
+                    (kind, job_key)
+                ).fetchone()
+                if row:
+                    conn.execute('COMMIT')
+                    return row['id']
+
+            cursor = conn.execute(
+                """INSERT INTO jobs (kind, job_key, payload, max_attempts, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (kind, job_key, json.dumps(payload), max_attempts or DEFAULT_MAX_ATTEMPTS, now, now)
+            )
+            conn.execute('COMMIT')
+            return cursor.lastrowid
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+def claim(owner: str, lease_seconds: int = None, kinds: List[str] = None) -> Optional[Dict]:
+    """
+    Claim the oldest runnable job under a lease
+
+    Runnable means queued, or running with an expired lease (its worker died).
+    Jobs that have used up their attempts are marked failed instead.
+
+    Args:
+        owner: Worker id taking the lease
+        lease_seconds: Lease length (default: JOB_LEASE_SECONDS)
+        kinds: Only claim these job kinds
+
+    Returns:
+        The claimed job, or None if nothing is runnable
+    """
+    lease_seconds = lease_seconds or DEFAULT_LEASE_SECONDS
+    kind_filter = ''
+    params = []
+    if kinds:
+        kind_filter = f" AND kind IN ({','.join('?' for _ in kinds)})"
+        params = list(kinds)
+
+    with _connect() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+
+            # Expired leases that are out of attempts fail permanently
+            conn.execute(
+                """UPDATE jobs SET status = 'failed', lease_owner = NULL, updated_at = ?,
+                          error = COALESCE(error, 'Lease expired too many times')
+                   WHERE status = 'running' AND lease_expires < ? AND attempts >= max_attempts""",
+                (now, now)
+            )
+
+            row = conn.execute(
+                f"""SELECT id FROM jobs
+                    WHERE (status = 'queued' OR (status = 'running' AND lease_expires < ?)){kind_filter}
+                    ORDER BY id LIMIT 1""",
+                [now] + params
+            ).fetchone()
+
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+
+            conn.execute(
+                """UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires = ?,
+                          attempts = attempts + 1, updated_at = ?
+                   WHERE id = ?""",
+                (owner, now + lease_seconds, now, row['id'])
+            )
+            job = conn.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone()
+            conn.execute('COMMIT')
+            return _row_to_job(job)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+def heartbeat(
+    job_id: int,
+    owner: str,
+    lease_seconds: int = None,
+    progress: float = None,
+    message: str = None
+) -> bool:
+    """
+    Extend a lease and optionally report progress
+
+    Returns:
+        False if the lease was lost (another worker may now own the job)
+    """
+    lease_seconds = lease_seconds or DEFAULT_LEASE_SECONDS
+    now = time.time()
+    with _connect() as conn:
+        cursor = conn.execute(
+            """UPDATE jobs SET lease_expires = ?, updated_at = ?,
+                      progress = COALESCE(?, progress), message = COALESCE(?, message)
+               WHERE id = ? AND lease_owner = ? AND status = 'running'""",
+            (now + lease_seconds, now, progress, message, job_id, owner)
+        )
+        return cursor.rowcount == 1
+
+
+def complete(job_id: int, owner: str, result: Dict = None) -> bool:
+    """Mark a job done; ignored if the lease was lost"""
+    now = time.time()
+    with _connect() as conn:
+        cursor = conn.execute(
+            """UPDATE jobs SET status = 'done', progress = 1, message = 'Done', result = ?,
+                      lease_owner = NULL, lease_expires = NULL, updated_at = ?
+               WHERE id = ? AND lease_owner = ? AND status = 'running'""",
+            (json.dumps(result or {}), now, job_id, owner)
+        )
+        return cursor.rowcount == 1
+
+
+def fail(job_id: int, owner: str, error: str) -> bool:
+    """Record a failure; the job is re-queued until it runs out of attempts"""
+    now = time.time()
+    with _connect() as conn:
+        cursor = conn.execute(
+            """UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                      error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ?
+               WHERE id = ? AND lease_owner = ? AND status = 'running'""",
+            (error, now, job_id, owner)
+        )
+        return cursor.rowcount == 1
+
+
+def get_job(job_id: int) -> Optional[Dict]:
+    """Fetch one job by id"""
+    with _connect() as conn:
+        return _row_to_job(conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+
+def list_jobs(status: str = None, kind: str = None, limit: int = 50) -> List[Dict]:
+    """Most recent jobs, optionally filtered by status and kind"""
+    query = 'SELECT * FROM jobs WHERE 1 = 1'
+    params = []
+    if status:
+        query += ' AND status = ?'
+        params.append(status)
+    if kind:
+        query += ' AND kind = ?'
+        params.append(kind)
+    query += ' ORDER BY id DESC LIMIT ?'
+    params.append(limit)
+
+    with _connect() as conn:
+        return [_row_to_job(row) for row in conn.execute(query, params).fetchall()]
+
+
+def latest_jobs_by_key(kind: str) -> Dict[str, Dict]:
+    """Most recent job per job_key, for status columns in the UI"""
+    with _connect() as conn:
+        rows = conn.execute(
+            """SELECT * FROM jobs WHERE id IN (
+                   SELECT MAX(id) FROM jobs WHERE kind = ? AND job_key IS NOT NULL GROUP BY job_key
+               )""",
+            (kind,)
+        ).fetchall()
+    return {row['job_key']: _row_to_job(row) for row in rows}
+
+
+def enqueue_ingest(pdf_path: str, filename: str = None, replaces: int = None, job_key: str = None) -> int:
+    """
+    Queue a PDF for conversion and storage in Supabase (optionally as a new version of a document)
+
+    Jobs are deduplicated by job_key (default: the filename, as the Library lists them)
+    """
+    filename = filename or Path(pdf_path).name
+    return enqueue('ingest', {
+        'pdf_path': str(Path(pdf_path).resolve()),
+        'filename': filename,
+        'replaces': replaces
+    }, job_key=job_key or filename)
+
+
+def enqueue_markdown(pdf_path: str, output_folder: str, pdf_name: str = None, enable_leap: bool = False) -> int:
+    """Queue a PDF for process_pdf_to_markdown"""
+    pdf_name = pdf_name or Path(pdf_path).stem
+    return enqueue('markdown', {
+        'pdf_path': str(Path(pdf_path).resolve()),
+        'output_folder': str(Path(output_folder).resolve()),
+        'pdf_name': pdf_name,
+        'enable_leap': enable_leap
+    }, job_key=str(pdf_path))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or add to the ingestion job queue")
+    parser.add_argument('--list', action='store_true', help="List recent jobs")
+    parser.add_argument('--status', help="Filter --list by status")
+    parser.add_argument('--enqueue', metavar='PDF', help="Queue a PDF for Supabase ingestion")
+    args = parser.parse_args()
+
+    if args.enqueue:
+        print(f"📥 Queued job {enqueue_ingest(args.enqueue)}")
+    else:
+        for job in list_jobs(status=args.status):
+            print(f"{job['id']:>5}  {job['kind']:<9} {job['status']:<8} {job['progress']:>4.0%}  "
+                  f"{job['job_key'] or ''}  {job['message'] or job['error'] or ''}")
@@ -0,0 +1,234 @@
+"""
+Process-wide Gemini quota scheduler
+Chat answers, LEAP categorization and embeddings draw on the same Gemini
+quota. Every request reserves capacity here first: requests and tokens per
+minute are tracked in a SQLite file shared by all processes on the host, and
+waiting interactive requests always go ahead of waiting batch work
+
+Usage:
+    python llm_scheduler.py --stats
+"""
+
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+SCHEDULER_ENABLED = os.getenv('LLM_SCHEDULER', '1') not in ('0', 'false', 'False')
+# Processes that should share a quota must point at the same file
+SCHEDULER_DB = os.getenv('LLM_SCHEDULER_DB', 'temp/llm_quota.sqlite3')
+
+# Per-minute limits for each quota bucket; 0 disables a limit
+QUOTAS = {
+    'generate': {
+        'rpm': int(os.getenv('GEMINI_RPM', '60')),
+        'tpm': int(os.getenv('GEMINI_TPM', '1000000'))
+    },
+    'embed': {
+        'rpm': int(os.getenv('EMBED_RPM', '1500')),
+        'tpm': int(os.getenv('EMBED_TPM', '0'))
+    }
+}
+
+# Lower runs first
+INTERACTIVE = 0
+BATCH = 1
+
+# Output tokens assumed for a generation before the real count is known
+DEFAULT_OUTPUT_TOKENS = int(os.getenv('GEMINI_OUTPUT_TOKENS_ESTIMATE', '1024'))
+
+_WINDOW_SECONDS = 60.0
+_POLL_SECONDS = 0.25
+# A waiter that stops polling for this long (its process died) is dropped
+_WAITER_TIMEOUT = 30.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bucket TEXT NOT NULL,
+    ts REAL NOT NULL,
+    tokens INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_usage_bucket_ts ON usage(bucket, ts);
+CREATE TABLE IF NOT EXISTS waiters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bucket TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    heartbeat REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_waiters_bucket ON waiters(bucket, priority, id);
+"""
+
+
+@contextmanager
+def _connect():
+    Path(SCHEDULER_DB).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(SCHEDULER_DB, timeout=30, isolation_level=None)
+    try:
+        conn.execute('PRAGMA busy_timeout = 30000')
+        conn.executescript(_SCHEMA)
+        yield conn
+    finally:
+        conn.close()
+
+
+def _try_reserve(
+    conn,
+    waiter_id: int,
+    bucket: str,
+    tokens: int,
+    priority: int
+) -> Tuple[Optional[int], Optional[float]]:
+    """
+    One scheduling attempt inside a write transaction
+
+    Returns:
+        (usage_id, None) when reserved, otherwise (None, seconds to wait)
+    """
+    now = time.time()
+    conn.execute('DELETE FROM usage WHERE ts < ?', (now - _WINDOW_SECONDS,))
+    conn.execute('DELETE FROM waiters WHERE heartbeat < ?', (now - _WAITER_TIMEOUT,))
+    conn.execute('UPDATE waiters SET heartbeat = ? WHERE id = ?', (now, waiter_id))
+
+    # Higher priority first, then first come first served
+    ahead = conn.execute(
+        """SELECT 1 FROM waiters WHERE bucket = ? AND id != ?
+              AND (priority < ? OR (priority = ? AND id < ?)) LIMIT 1""",
+        (bucket, waiter_id, priority, priority, waiter_id)
+    ).fetchone()
+    if ahead:
+        return None, _POLL_SECONDS
+
+    quota = QUOTAS.get(bucket, {})
+    rpm = quota.get('rpm', 0)
+    tpm = quota.get('tpm', 0)
+    requests, used_tokens, oldest = conn.execute(
+        'SELECT COUNT(*), COALESCE(SUM(tokens), 0), MIN(ts) FROM usage WHERE bucket = ?',
+        (bucket,)
+    ).fetchone()
+
+    over_rpm = rpm > 0 and requests + 1 > rpm
+    # A request larger than the whole TPM budget runs alone once the window is empty
+    over_tpm = tpm > 0 and used_tokens + tokens > tpm and used_tokens > 0
+    if over_rpm or over_tpm:
+        wait = (oldest + _WINDOW_SECONDS - now) if oldest else _POLL_SECONDS
+        return None, max(0.01, min(wait, _POLL_SECONDS * 4))
+
+    cursor = conn.execute('INSERT INTO usage (bucket, ts, tokens) VALUES (?, ?, ?)', (bucket, now, tokens))
+    conn.execute('DELETE FROM waiters WHERE id = ?', (waiter_id,))
+    return cursor.lastrowid, None
+
+
+def acquire(bucket: str, tokens: int = 0, priority: int = BATCH, timeout: Optional[float] = None) -> Optional[int]:
+    """
+    Block until the bucket has room for one request of `tokens` tokens
+
+    Args:
+        bucket: Quota bucket ('generate' or 'embed')
+        tokens: Estimated tokens for the request
+        priority: INTERACTIVE or BATCH
+        timeout: Give up after this many seconds
+
+    Returns:
+        Usage id to correct with record_tokens(), or None when disabled
+
+    Raises:
+        TimeoutError: No capacity within timeout
+    """
+    if not SCHEDULER_ENABLED:
+        return None
+
+    deadline = time.time() + timeout if timeout else None
+    with _connect() as conn:
+        waiter_id = conn.execute(
+            'INSERT INTO waiters (bucket, priority, heartbeat) VALUES (?, ?, ?)',
+            (bucket, priority, time.time())
+        ).lastrowid
+        try:
+            while True:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    usage_id, wait = _try_reserve(conn, waiter_id, bucket, int(tokens), priority)
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+
+                if usage_id is not None:
+                    return usage_id
+                if deadline and time.time() + wait > deadline:
+                    raise TimeoutError(f"No {bucket} quota available within {timeout}s")
+                time.sleep(wait)
+        finally:
+            conn.execute('DELETE FROM waiters WHERE id = ?', (waiter_id,))
+
+
+def record_tokens(usage_id: Optional[int], tokens: int) -> None:
+    """Replace a reservation's estimated tokens with the actual count"""
+    if usage_id is None or not tokens:
+        return
+    with _connect() as conn:
+        conn.execute('UPDATE usage SET tokens = ? WHERE id = ?', (int(tokens), usage_id))
+
+
+def generate_content(model, prompt: str, priority: int = BATCH, **kwargs):
+    """
+    model.generate_content() within the shared 'generate' quota
+
+    Args:
+        model: genai.GenerativeModel
+        prompt: Prompt text
+        priority: INTERACTIVE for chat, BATCH for background work
+        **kwargs: Passed to generate_content()
+
+    Returns:
+        The Gemini response
+    """
+    from chunking import estimate_tokens
+
+    usage_id = acquire('generate', estimate_tokens(prompt) + DEFAULT_OUTPUT_TOKENS, priority)
+    response = model.generate_content(prompt, **kwargs)
+
+    usage = getattr(response, 'usage_metadata', None)
+    record_tokens(usage_id, getattr(usage, 'total_token_count', 0) if usage else 0)
+    return response
+
+
+def get_scheduler_stats() -> Dict:
+    """Current per-minute usage and waiting requests per bucket"""
+    if not SCHEDULER_ENABLED:
+        return {'enabled': False}
+
+    now = time.time()
+    stats = {'enabled': True, 'db': SCHEDULER_DB, 'buckets': {}}
+    with _connect() as conn:
+        for bucket, quota in QUOTAS.items():
+            requests, tokens = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM usage WHERE bucket = ? AND ts >= ?',
+                (bucket, now - _WINDOW_SECONDS)
+            ).fetchone()
+            waiting = dict(conn.execute(
+                'SELECT priority, COUNT(*) FROM waiters WHERE bucket = ? AND heartbeat >= ? GROUP BY priority',
+                (bucket, now - _WAITER_TIMEOUT)
+            ).fetchall())
+            stats['buckets'][bucket] = {
+                **quota,
+                'requests_last_minute': requests,
+                'tokens_last_minute': tokens,
+                'waiting_interactive': waiting.get(INTERACTIVE, 0),
+                'waiting_batch': waiting.get(BATCH, 0)
+            }
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Inspect the shared Gemini quota")
+    parser.add_argument('--stats', action='store_true', help="Show usage in the last minute")
+    parser.parse_args()
+
+    print(json.dumps(get_scheduler_stats(), indent=2))
@@ -3,21 +3,114 @@ TNFD LEAP Analysis - Core Processing Module
 Supports both local (dev) and API (prod) modes
 """
 
-from docling.document_converter import DocumentConverter
-from docling.datamodel.base_models import InputFormat
-from docling.datamodel.pipeline_options import PdfPipelineOptions
-from docling.document_converter import PdfFormatOption
 import os
 from dotenv import load_dotenv
 from pathlib import Path
-import google.generativeai as genai
 import json
-import requests
+import re
+import shutil
+import time
+# Light modules only: Docling, Pillow, Gemini and requests are imported on
+# first use so the file server and LEAP-only jobs start quickly
+# (check with: python startup_timing.py)
+from converter_pool import get_pool_stats
+from conversion_cache import get_cache_stats
+from llm_scheduler import get_scheduler_stats
+from pdf_conversion import PROFILES, convert_pdf, iter_markdown, iter_pictures, count_pictures, get_picture_image
+
+# Shared perceptual-hash index of images written to an output folder
+IMAGE_INDEX_FILE = '.image_index.json'
+# Pages per converted part; the markdown is written one part at a time, so
+# this bounds the text held in memory (0 = the whole document as one part)
+MARKDOWN_STREAM_PAGES = int(os.getenv('MARKDOWN_STREAM_PAGES', '10'))
 
 # Load environment variables
 load_dotenv()
 
-def process_pdf_to_markdown(pdf_path, output_folder, pdf_name, enable_leap=True):
+IMAGE_PLACEHOLDER = '<!-- image -->'
+_NO_MORE_IMAGES = object()
+_IMAGE_TAG = re.compile(r'^!\[Image \d+\]\((.+)\)$')
+
+
+def _write_with_image_tags(f, text, refs):
+    """
+    Write markdown, replacing image placeholders in a single pass
+
+    Args:
+        f: Open output file
+        text: Markdown block from Docling
+        refs: Shared iterator of image paths (None = no image for that placeholder)
+    """
+    pos = 0
+    while True:
+        idx = text.find(IMAGE_PLACEHOLDER, pos)
+        if idx == -1:
+            break
+
+        image_path = next(refs, _NO_MORE_IMAGES)
+        if image_path is _NO_MORE_IMAGES:
+            # More placeholders than pictures: leave the rest untouched
+            break
+
+        f.write(text[pos:idx])
+        if image_path:
+            image_number = int(Path(image_path).stem.split('_')[-1])
+            f.write(f'\n\n![Image {image_number}]({image_path})\n\n')
+        pos = idx + len(IMAGE_PLACEHOLDER)
+
+    f.write(text[pos:])
+
+
+def _link_image(output_folder, rel_path, images_folder, stem):
+    """
+    Hardlink (or copy) another document's image and its thumbnail into images_folder
+
+    Returns:
+        True when the full-size image is in place as <stem><suffix>
+    """
+    source = Path(output_folder) / rel_path
+    targets = [(source, Path(images_folder) / f"{stem}{source.suffix}")]
+    thumb = source.parent / 'thumbs' / source.name
+    if thumb.exists():
+        targets.append((thumb, Path(images_folder) / 'thumbs' / f"{stem}{source.suffix}"))
+
+    try:
+        for src, dst in targets:
+            dst.unlink(missing_ok=True)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+        return True
+    except OSError as e:
+        print(f"⚠️  Could not reuse {rel_path}, encoding it again: {e}")
+        return False
+
+
+def _remove_image_tags(markdown_file, image_paths):
+    """Drop the image tags of images that were never written from a generated markdown file"""
+    tmp_file = f"{markdown_file}.{os.getpid()}.tmp"
+    with open(markdown_file, 'r', encoding='utf-8') as src, open(tmp_file, 'w', encoding='utf-8') as dst:
+        for line in src:
+            match = _IMAGE_TAG.match(line.strip())
+            if match and match.group(1) in image_paths:
+                continue
+            dst.write(line)
+    os.replace(tmp_file, markdown_file)
+
+
+def _read_body(markdown_file):
+    """Read a generated _full_text.md back without its title header"""
+    with open(markdown_file, 'r', encoding='utf-8') as f:
+        f.readline()  # "# name"
+        f.readline()  # blank
+        f.readline()  # "---"
+        f.readline()  # blank
+        return f.read()
+
+
+def process_pdf_to_markdown(pdf_path, output_folder, pdf_name, enable_leap=True, shard_workers=None, return_text=False,
+                            profile=None):
     """
     Core function to process PDF and generate markdown with images
 
@@ -26,10 +119,17 @@ def process_pdf_to_markdown(pdf_path, output_folder, pdf_name, enable_leap=True)
         output_folder: Directory to save output
         pdf_name: Name of the PDF (without extension)
         enable_leap: Whether to generate LEAP categorized files (default: True)
+        shard_workers: Convert page shards in parallel (default: PDF_SHARD_WORKERS)
+        return_text: Include the markdown body as 'full_text' in the result
+                     (always loaded when enable_leap is set)
+        profile: Speed profile 'fast', 'balanced' or 'accurate' (default: PDF_PROFILE)
 
     Returns:
         dict with paths to generated files
     """
+    from image_pipeline import ImageWriter, image_extension
+    from image_dedup import ImageDeduplicator, load_index, update_index
+
     # Create output folder structure
     os.makedirs(output_folder, exist_ok=True)
     images_folder = os.path.join(output_folder, f"{pdf_name}_images")
@@ -40,69 +140,110 @@ def process_pdf_to_markdown(pdf_path, output_folder, pdf_name, enable_leap=True)
     # Step 1: Extract with Docling
     print("⚙️  Extracting text and images with Docling...")
 
-    pipeline_options = PdfPipelineOptions()
-    pipeline_options.do_ocr = False
-    pipeline_options.do_table_structure = True
-    pipeline_options.images_scale = 2.0
-    pipeline_options.generate_page_images = False
-    pipeline_options.generate_picture_images = True
-
-    converter = DocumentConverter(
-        format_options={
-            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
-        }
-    )
-
-    result = converter.convert(pdf_path)
-    full_text = result.document.export_to_markdown()
-    print(f"✅ Extracted {len(full_text)} characters")
-
-    # Step 2: Extract and save images
+    timings = {}
+    step_start = time.perf_counter()
+    timings['pages'] = {}
+    parts = convert_pdf(pdf_path, shard_workers=shard_workers, profile=profile, stats=timings['pages'],
+                        stream_pages=MARKDOWN_STREAM_PAGES or None)
+    timings['convert_seconds'] = round(time.perf_counter() - step_start, 3)
+    print(f"✅ Converted {len(parts)} part(s)")
+
+    # Step 2: Extract images and queue them for encoding
+    # Numbering is assigned here, in picture order, so it stays deterministic
+    # no matter which encoder thread finishes first. Repeated images (also
+    # across documents in the same output folder) reuse the first copy and
+    # decorative ones are dropped.
     image_counter = 0
-    if hasattr(result.document, 'pictures') and result.document.pictures:
-        print(f"🖼️  Extracting {len(result.document.pictures)} images...")
-        for idx, picture in enumerate(result.document.pictures):
+    picture_refs = []
+    writer = ImageWriter()
+    extension = image_extension()
+    thumbs_folder = os.path.join(images_folder, 'thumbs')
+    os.makedirs(thumbs_folder, exist_ok=True)
+    index_file = os.path.join(output_folder, IMAGE_INDEX_FILE)
+    own_prefix = f"{pdf_name}_images/"
+    dedup = ImageDeduplicator(index=load_index(index_file, output_folder, exclude_prefix=own_prefix))
+    new_index_entries = {}
+    encodes = {}  # rel_path -> encode future, to find images that were never written
+    step_start = time.perf_counter()
+    picture_count = count_pictures(parts)
+    if picture_count:
+        print(f"🖼️  Extracting {picture_count} images...")
+        for document, picture in iter_pictures(parts):
             try:
-                image_counter += 1
-                image_filename = f"image_{image_counter:03d}.png"
-                image_path = os.path.join(images_folder, image_filename)
-
-                if hasattr(picture, 'get_image'):
-                    img = picture.get_image(result.document)
-                    if img:
-                        img.save(image_path)
-                elif hasattr(picture, 'image'):
-                    picture.image.save(image_path)
+                img = get_picture_image(document, picture)
+                if not img:
+                    picture_refs.append(None)
+                    continue
+
+                status, image_hash, existing = dedup.classify(img)
+                if status == 'dropped':
+                    picture_refs.append(None)
+                elif status == 'duplicate' and existing.startswith(own_prefix):
+                    picture_refs.append(existing)
+                elif status == 'duplicate' and _link_image(output_folder, existing, images_folder,
+                                                           f"image_{image_counter + 1:03d}"):
+                    # First copy belongs to another document: link it into our own folder,
+                    # so reprocessing or deleting that document doesn't break our links
+                    image_counter += 1
+                    picture_refs.append(f"{own_prefix}image_{image_counter:03d}{Path(existing).suffix}")
+                else:
+                    image_counter += 1
+                    image_filename = f"image_{image_counter:03d}{extension}"
+                    rel_path = f"{pdf_name}_images/{image_filename}"
+                    encodes[rel_path] = writer.submit(
+                        img,
+                        os.path.join(images_folder, image_filename),
+                        thumbnail_path=os.path.join(thumbs_folder, image_filename)
+                    )
+                    dedup.add(image_hash, rel_path)
+                    new_index_entries[image_hash] = rel_path
+                    picture_refs.append(rel_path)
             except Exception as e:
-                print(f"⚠️  Warning: Could not extract image {image_counter}: {e}")
-                image_counter -= 1
+                print(f"⚠️  Warning: Could not extract image {len(picture_refs) + 1}: {e}")
+                picture_refs.append(None)
 
-        print(f"✅ Saved {image_counter} images to {images_folder}")
+        print(f"♻️  {dedup.stats['duplicates']} duplicate and {dedup.stats['dropped']} decorative images skipped")
     else:
         print("ℹ️  No images found in PDF")
+    timings['image_extract_seconds'] = round(time.perf_counter() - step_start, 3)
+    timings['image_dedup'] = dict(dedup.stats)
 
-    # Step 3: Process full text and replace image placeholders
-    print("📝 Processing full text with images...")
-
-    full_text_with_images = full_text
-    global_image_counter = 0
-
-    # Replace image placeholders with markdown image syntax
-    while '<!-- image -->' in full_text_with_images and global_image_counter < image_counter:
-        global_image_counter += 1
-        image_filename = f"image_{global_image_counter:03d}.png"
-        # Reference images in the images folder
-        image_path = f"{pdf_name}_images/{image_filename}"
-        img_tag = f'\n\n![Image {global_image_counter}]({image_path})\n\n'
-        full_text_with_images = full_text_with_images.replace('<!-- image -->', img_tag, 1)
+    # Step 3 + 4: Stream the markdown to disk with image tags inserted inline
+    # (runs while the encoder threads are still writing PNGs). Each part is
+    # exported, written and released in turn; no full-document copies are built.
+    print("📝 Writing full text with images...")
+    step_start = time.perf_counter()
 
-    # Step 4: Save full text markdown
     output_file = os.path.join(output_folder, f"{pdf_name}_full_text.md")
+    char_count = 0
+    refs = iter(picture_refs)
 
     with open(output_file, 'w', encoding='utf-8') as f:
         f.write(f"# {pdf_name}\n\n")
         f.write("---\n\n")
-        f.write(full_text_with_images)
+
+        for part_idx, text in enumerate(iter_markdown(parts)):
+            if part_idx:
+                f.write('\n\n')
+            char_count += len(text)
+            _write_with_image_tags(f, text, refs)
+
+    timings['markdown_seconds'] = round(time.perf_counter() - step_start, 3)
+    print(f"✅ Extracted {char_count} characters")
+
+    # Wait for the remaining image encodes, then publish the ones that were
+    # written to the shared index; tags for the others are taken out again
+    timings['image_encode'] = writer.wait()
+    failed_paths = {rel_path for rel_path, future in encodes.items() if future.exception() is not None}
+    if failed_paths:
+        print(f"⚠️  Warning: {len(failed_paths)} images could not be saved")
+        _remove_image_tags(output_file, failed_paths)
+        image_counter -= len(failed_paths)
+    new_index_entries = {
+        image_hash: rel_path for image_hash, rel_path in new_index_entries.items() if rel_path not in failed_paths
+    }
+    if new_index_entries:
+        update_index(index_file, new_index_entries)
 
     print(f"💾 Saved full text markdown: {output_file}")
     print(f"📁 Images saved to: {images_folder}")
@@ -110,6 +251,9 @@ def process_pdf_to_markdown(pdf_path, output_folder, pdf_name, enable_leap=True)
 
     # Step 5: Generate LEAP categorized files (optional)
     leap_files = {}
+    full_text_with_images = None
+    if enable_leap or return_text:
+        full_text_with_images = _read_body(output_file)
     if enable_leap:
         print("📊 Categorizing content into LEAP framework...")
         leap_files = categorize_leap_content(full_text_with_images, output_folder, pdf_name, image_counter)
@@ -121,7 +265,8 @@ def process_pdf_to_markdown(pdf_path, output_folder, pdf_name, enable_leap=True)
         'images_folder': images_folder,
         'image_count': image_counter,
         'leap_files': leap_files,
-        'full_text': full_text_with_images
+        'full_text': full_text_with_images,
+        'timings': timings
     }
 
 
@@ -194,6 +339,8 @@ def categorize_with_gemini(full_text):
     Use Gemini AI to categorize content into LEAP phases
     Reads prompt from prompt/GEMINI.md for easy customization
     """
+    import google.generativeai as genai
+
     # Configure Gemini
     api_key = os.getenv('GEMINI_API_KEY')
     if not api_key:
@@ -244,8 +391,9 @@ Return ONLY the JSON object, no other text."""
     # Replace {full_text} placeholder with actual content
     prompt = prompt_template.replace('{full_text}', full_text)
 
-    # Call Gemini API
-    response = model.generate_content(prompt)
+    # Call Gemini API (batch priority: waits behind chat answers in the shared quota)
+    import llm_scheduler
+    response = llm_scheduler.generate_content(model, prompt, priority=llm_scheduler.BATCH)
     response_text = response.text.strip()
 
     # Extract JSON from response (handle markdown code blocks)
@@ -273,6 +421,8 @@ def categorize_with_perplexity(full_text):
     Use Perplexity AI to categorize content into LEAP phases
     Reads prompt from prompt/PERPLEXITY.md for easy customization
     """
+    import requests
+
     # Get API key
     api_key = os.getenv('PERPLEXITY_API_KEY')
     if not api_key:
@@ -434,6 +584,7 @@ def start_web_server():
     from flask import Flask, send_file, request, jsonify
     from flask_cors import CORS
     import traceback
+    from conversion_supervisor import process_pdf_to_markdown as supervised_convert, get_supervisor_stats
 
     app = Flask(__name__)
     CORS(app)
@@ -492,6 +643,51 @@ def start_web_server():
 
         return jsonify({'files': files})
 
+    @app.route('/api/status')
+    def api_status():
+        """Report converter pool, cache, conversion child and Gemini quota state"""
+        return jsonify({
+            'converter_pool': get_pool_stats(),
+            'conversion_cache': get_cache_stats(),
+            'conversion_supervisor': get_supervisor_stats(),
+            'llm_scheduler': get_scheduler_stats()
+        })
+
+    @app.route('/api/jobs', methods=['GET', 'POST'])
+    def api_jobs():
+        """Queue a PDF for background conversion, or list recent jobs"""
+        import job_queue
+
+        if request.method == 'GET':
+            return jsonify({'jobs': job_queue.list_jobs(status=request.args.get('status'))})
+
+        data = request.json or {}
+        pdf_path = data.get('pdf_path', '')
+        full_pdf_path = PROJECT_ROOT / pdf_path
+        if not pdf_path or not full_pdf_path.exists():
+            return jsonify({'error': f'PDF not found: {pdf_path}'}), 404
+
+        if data.get('kind') == 'ingest':
+            job_id = job_queue.enqueue_ingest(str(full_pdf_path))
+        else:
+            job_id = job_queue.enqueue_markdown(
+                str(full_pdf_path),
+                str(PROJECT_ROOT / 'output'),
+                enable_leap=data.get('enable_leap', False)
+            )
+
+        return jsonify({'success': True, 'job_id': job_id}), 202
+
+    @app.route('/api/jobs/<int:job_id>')
+    def api_job_status(job_id):
+        """Poll a queued job's status and progress"""
+        import job_queue
+
+        job = job_queue.get_job(job_id)
+        if job is None:
+            return jsonify({'error': f'Job not found: {job_id}'}), 404
+        return jsonify(job)
+
     @app.route('/api/analyze', methods=['POST'])
     def api_analyze():
         """Analyze PDF - Convert to text/markdown only"""
@@ -506,17 +702,22 @@ def start_web_server():
             if not full_pdf_path.exists():
                 return jsonify({'error': f'PDF not found: {pdf_path}'}), 404
 
+            profile = data.get('profile')
+            if profile and profile not in PROFILES:
+                return jsonify({'error': f"Unknown profile: {profile} (choose from: {', '.join(PROFILES)})"}), 400
+
             pdf_name = full_pdf_path.stem
             output_folder = PROJECT_ROOT / 'output'
 
             print(f"🔬 Analyzing: {pdf_name}.pdf")
 
-            # Process without LEAP categorization
-            result = process_pdf_to_markdown(
+            # Process without LEAP categorization, in the supervised child
+            result = supervised_convert(
                 str(full_pdf_path),
                 str(output_folder),
                 pdf_name,
-                enable_leap=False
+                enable_leap=False,
+                profile=profile
             )
 
             markdown_rel = Path(result['markdown_file']).relative_to(PROJECT_ROOT)
@@ -528,7 +729,9 @@ def start_web_server():
                 'markdown_path': str(markdown_rel),
                 'markdown_name': Path(result['markdown_file']).name,
                 'image_count': result['image_count'],
-                'images_folder': str(images_rel)
+                'images_folder': str(images_rel),
+                'pages': result['timings']['pages'],
+                'memory': result['memory']
             })
 
         except Exception as e:
@@ -595,6 +798,9 @@ def start_web_server():
     print(f"📡 API endpoints:")
     print(f"   • POST /api/analyze - PDF to text conversion")
     print(f"   • POST /api/leap    - LEAP categorization")
+    print(f"   • GET  /api/status  - Converter pool and cache status")
+    print(f"   • POST /api/jobs    - Queue a PDF for background processing")
+    print(f"   • GET  /api/jobs/ID - Poll a queued job")
     print(f"🛑 Stop server: Press Ctrl+C")
     print("=" * 60)
 
@@ -13,6 +13,8 @@ for (let i = 0; i < items.length; i++) {
   // Get the base64 image data from the current item
   const imageBase64 = item.json.data;
   const imageFileName = item.json.fileName;
+  const imageMimeType = item.json.mimeType || 'image/png';
+  const imageExtension = imageFileName.split('.').pop();
 
   // Check if data exists
   if (!imageBase64) {
@@ -31,9 +33,9 @@ for (let i = 0; i < items.length; i++) {
     binary: {
       data: {
         data: binaryData.toString('base64'),
-        mimeType: 'image/png',
+        mimeType: imageMimeType,
         fileName: imageFileName,
-        fileExtension: 'png'
+        fileExtension: imageExtension
       }
     }
   });
@@ -0,0 +1,621 @@
+"""
+PDF conversion entry point - serial or page-range sharded
+Large reports are split into page shards that convert in parallel processes
+and come back as an ordered list of Docling documents. A cheap pypdfium2
+pre-pass routes scanned pages to OCR and runs the table model only on pages
+that look like they hold tables
+"""
+
+import multiprocessing
+import os
+import re
+import threading
+import time
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import conversion_cache
+from chunking import number_images
+from converter_pool import get_converter, resolve_options
+
+# Sharding is off unless more than one worker is configured
+SHARD_WORKERS = int(os.getenv('PDF_SHARD_WORKERS', '1'))
+SHARD_PAGES = int(os.getenv('PDF_SHARD_PAGES', '25'))
+# Runs of pages with different settings shorter than this are merged into a
+# neighbour, so a stray scanned or table page doesn't cost a converter switch
+MIN_SEGMENT_PAGES = int(os.getenv('PDF_MIN_SEGMENT_PAGES', '3'))
+
+# 'auto' OCRs only pages without a text layer, 'on' every page, 'off' none
+OCR_MODE = os.getenv('OCR_MODE', 'auto').lower()
+# Pages with fewer extractable characters than this count as scanned
+OCR_MIN_CHARS = int(os.getenv('OCR_MIN_CHARS', '20'))
+
+# Table pre-pass: a page is a table candidate with this many vector path
+# objects (cell borders, rules) or this many rows of aligned numbers
+TABLE_MIN_PATHS = int(os.getenv('TABLE_MIN_PATHS', '12'))
+TABLE_MIN_NUMERIC_ROWS = int(os.getenv('TABLE_MIN_NUMERIC_ROWS', '3'))
+
+# Speed profiles: which pages get the table model, which TableFormer mode,
+# and how scanned pages are handled
+PROFILES = {
+    'fast': {'tables': 'auto', 'table_mode': 'fast', 'ocr_mode': 'off'},
+    'balanced': {'tables': 'auto', 'table_mode': 'accurate', 'ocr_mode': 'auto'},
+    'accurate': {'tables': 'on', 'table_mode': 'accurate', 'ocr_mode': 'auto'}
+}
+PDF_PROFILE = os.getenv('PDF_PROFILE', 'balanced').lower()
+
+_NUMBER = re.compile(r'^[(\-+]?[\d.,]*\d[\d.,]*%?\)?$')
+
+_shard_pool = None
+_shard_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def get_page_count(pdf_path: str) -> int:
+    """Count pages without running the Docling pipeline"""
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def plan_shards(page_count: int, shard_pages: int = SHARD_PAGES) -> List[Tuple[int, int]]:
+    """
+    Split a page count into contiguous 1-based, inclusive page ranges
+
+    Args:
+        page_count: Total pages in the PDF
+        shard_pages: Pages per shard
+
+    Returns:
+        List of (first_page, last_page) tuples in page order
+    """
+    shard_pages = max(1, shard_pages)
+    return [
+        (start, min(start + shard_pages - 1, page_count))
+        for start in range(1, page_count + 1, shard_pages)
+    ]
+
+
+def resolve_profile(profile: Optional[str] = None) -> Dict:
+    """
+    Settings for a named speed profile
+
+    Args:
+        profile: 'fast', 'balanced' or 'accurate' (default: PDF_PROFILE)
+
+    Raises:
+        ValueError: If the profile name is unknown
+    """
+    name = (profile or PDF_PROFILE).lower()
+    if name not in PROFILES:
+        raise ValueError(f"Unknown profile '{profile}' (choose from: {', '.join(PROFILES)})")
+    return {'profile': name, **PROFILES[name]}
+
+
+def _looks_like_table(page, text: str) -> bool:
+    """Cheap table test: many ruling lines, or several rows of numbers"""
+    import pypdfium2.raw as pdfium_c
+
+    paths = page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_PATH], max_depth=2)
+    if sum(1 for _ in islice(paths, TABLE_MIN_PATHS)) >= TABLE_MIN_PATHS:
+        return True
+
+    numeric_rows = 0
+    for line in text.splitlines():
+        tokens = line.split()
+        if len(tokens) >= 3 and sum(1 for t in tokens if _NUMBER.match(t)) >= 2:
+            numeric_rows += 1
+            if numeric_rows >= TABLE_MIN_NUMERIC_ROWS:
+                return True
+    return False
+
+
+def analyze_pages(pdf_path: str, min_chars: int = None, detect_tables: bool = True) -> Dict:
+    """
+    Classify pages from the PDF's own objects, without running Docling
+
+    A page counts as scanned when it holds fewer than min_chars
+    non-whitespace characters and contains at least one image (blank pages
+    are left alone). Scanned pages are also table candidates, since their
+    content cannot be inspected. Costs milliseconds per page.
+
+    Args:
+        pdf_path: Path to the PDF file
+        min_chars: Character threshold for scanned pages (default: OCR_MIN_CHARS)
+        detect_tables: Also look for table candidates
+
+    Returns:
+        Dict with page_count and 1-based scanned_pages / table_pages lists
+    """
+    import pypdfium2 as pdfium
+    import pypdfium2.raw as pdfium_c
+
+    min_chars = OCR_MIN_CHARS if min_chars is None else min_chars
+    scanned = []
+    tables = []
+
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        page_count = len(pdf)
+        for page_idx in range(page_count):
+            page = pdf[page_idx]
+            try:
+                textpage = page.get_textpage()
+                try:
+                    text = textpage.get_text_range()
+                finally:
+                    textpage.close()
+
+                if len(''.join(text.split())) < min_chars:
+                    has_image = next(
+                        iter(page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_IMAGE])),
+                        None
+                    ) is not None
+                    if has_image:
+                        scanned.append(page_idx + 1)
+                        tables.append(page_idx + 1)
+                    continue
+
+                if detect_tables and _looks_like_table(page, text):
+                    tables.append(page_idx + 1)
+            finally:
+                page.close()
+    finally:
+        pdf.close()
+
+    return {'page_count': page_count, 'scanned_pages': scanned, 'table_pages': tables}
+
+
+def plan_segments(page_settings: List[Tuple], shard_pages: int) -> List[Tuple[Tuple[int, int], Tuple]]:
+    """
+    Split a document into page ranges that share the same pipeline settings
+
+    Contiguous runs of pages with equal settings become separate ranges, and
+    each run is further split into shards of at most shard_pages.
+
+    Args:
+        page_settings: One hashable settings value per page, in page order
+        shard_pages: Maximum pages per range
+
+    Returns:
+        List of ((first_page, last_page), settings) in page order
+    """
+    segments = []
+    start = 1
+    for page in range(2, len(page_settings) + 2):
+        if page > len(page_settings) or page_settings[page - 1] != page_settings[start - 1]:
+            for shard_first, shard_last in plan_shards(page - start, shard_pages):
+                segments.append(((start + shard_first - 1, start + shard_last - 1), page_settings[start - 1]))
+            start = page
+    return segments
+
+
+def merge_short_runs(page_settings: List[Tuple], min_pages: int = MIN_SEGMENT_PAGES) -> List[Tuple]:
+    """
+    Merge runs of pages shorter than min_pages into a neighbouring run
+
+    Settings are tuples of flags (do_ocr, do_tables); a merged run keeps every
+    flag either side had, so no page loses OCR or the table model. A merge is
+    only made when fewer than min_pages pages gain a flag, so a short scanned
+    run never turns OCR on for a long run of text pages.
+
+    Returns:
+        One settings value per page, in page order
+    """
+    runs = []  # [settings, length]
+    for settings in page_settings:
+        if runs and runs[-1][0] == settings:
+            runs[-1][1] += 1
+        else:
+            runs.append([settings, 1])
+
+    while len(runs) > 1:
+        candidates = []  # (pages that gain a flag, run length, run, neighbour, merged settings)
+        for i, (settings, length) in enumerate(runs):
+            if length >= min_pages:
+                continue
+            for j in (i - 1, i + 1):
+                if 0 <= j < len(runs):
+                    merged = tuple(a or b for a, b in zip(settings, runs[j][0]))
+                    cost = sum(runs[k][1] for k in (i, j) if runs[k][0] != merged)
+                    if cost < min_pages:
+                        candidates.append((cost, length, i, j, merged))
+        if not candidates:
+            break
+
+        _, _, i, j, merged = min(candidates)
+        first, second = sorted((i, j))
+        runs[first:second + 1] = [[merged, runs[first][1] + runs[second][1]]]
+        # Merging can make a run equal to its neighbours
+        for k in (first + 1, first):
+            if 0 < k < len(runs) and runs[k - 1][0] == runs[k][0]:
+                runs[k - 1:k + 1] = [[runs[k][0], runs[k - 1][1] + runs[k][1]]]
+
+    return [settings for settings, length in runs for _ in range(length)]
+
+
+def _fill_table_gaps(table_pages: List[int], page_count: int, max_gap: int = 1) -> List[int]:
+    """Bridge short runs of non-table pages so the plan doesn't fragment"""
+    pages = sorted(set(table_pages))
+    filled = set(pages)
+    for prev, nxt in zip(pages, pages[1:]):
+        if 1 < nxt - prev <= max_gap + 1:
+            filled.update(range(prev + 1, nxt))
+    return sorted(p for p in filled if 1 <= p <= page_count)
+
+
+def _plan(profile: Optional[str] = None) -> Dict:
+    """resolve_profile() plus the server-wide OCR_MODE when no profile was chosen"""
+    plan = resolve_profile(profile)
+    if profile is None and os.getenv('OCR_MODE'):
+        plan['ocr_mode'] = OCR_MODE
+    return plan
+
+
+def _warm_option_sets(plan: Dict) -> List[Dict]:
+    """Converter options of the text pages of a profile (with and without the table model)"""
+    do_ocr = plan['ocr_mode'] == 'on'
+    option_sets = []
+    if plan['tables'] != 'on':
+        option_sets.append({'do_ocr': do_ocr, 'do_table_structure': False})
+    if plan['tables'] != 'off':
+        option_sets.append({'do_ocr': do_ocr, 'do_table_structure': True, 'table_mode': plan['table_mode']})
+    return option_sets
+
+
+def warm_converters(profile: Optional[str] = None) -> None:
+    """Build the converters documents of a profile will use (e.g. in a worker initializer)"""
+    _init_shard_worker(_warm_option_sets(_plan(profile)))
+
+
+def _init_shard_worker(option_sets: List[Dict]):
+    """Warm the converters the shards will use in each shard worker"""
+    for options in option_sets:
+        get_converter(**options)
+
+
+def _convert_shard(pdf_path: str, page_range: Tuple[int, int], options: Dict):
+    """Convert one page range inside a shard worker; returns (document, seconds)"""
+    start = time.perf_counter()
+    result = get_converter(**options).convert(pdf_path, page_range=page_range)
+    return result.document, time.perf_counter() - start
+
+
+def _get_shard_pool(workers: int, warm_options: List[Dict]) -> ProcessPoolExecutor:
+    """
+    Reuse one pool of warm shard workers across documents
+
+    The pool is sized by the configured worker count, not by the current
+    document, so a short document just submits fewer tasks. warm_options
+    only apply when the pool is (re)created.
+    """
+    global _shard_pool, _shard_pool_workers
+
+    with _pool_lock:
+        if _shard_pool is None or _shard_pool_workers != workers:
+            if _shard_pool is not None:
+                _shard_pool.shutdown(wait=True)
+
+            _shard_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_shard_worker,
+                initargs=(warm_options,)
+            )
+            _shard_pool_workers = workers
+
+    return _shard_pool
+
+
+def shutdown_shard_pool() -> None:
+    """Stop the warm shard workers (e.g. before a supervised child is retired)"""
+    global _shard_pool, _shard_pool_workers
+
+    with _pool_lock:
+        if _shard_pool is not None:
+            _shard_pool.shutdown(wait=True, cancel_futures=True)
+            _shard_pool = None
+            _shard_pool_workers = 0
+
+
+def convert_pdf(
+    pdf_path: str,
+    shard_workers: Optional[int] = None,
+    shard_pages: Optional[int] = None,
+    use_cache: bool = True,
+    ocr_mode: Optional[str] = None,
+    profile: Optional[str] = None,
+    stats: Optional[Dict] = None,
+    stream_pages: Optional[int] = None,
+    **options
+) -> List:
+    """
+    Convert a PDF into an ordered list of Docling documents
+
+    A cached conversion of the same file and pipeline options is returned
+    without running Docling at all. Otherwise a small PDF (or
+    shard_workers <= 1) converts in-process and yields a single document,
+    while larger PDFs are split into page ranges that convert in parallel;
+    the parts are returned in page order so that concatenating them
+    reproduces the serial output.
+
+    The speed profile decides which pages get the table model and OCR:
+    table structure runs only on candidate pages unless the profile says
+    'on', and in 'auto' OCR mode only scanned pages are OCR'd (full page).
+    Passing do_ocr or do_table_structure explicitly overrides the profile.
+
+    Args:
+        pdf_path: Path to the PDF file
+        shard_workers: Parallel shard processes (default: PDF_SHARD_WORKERS)
+        shard_pages: Pages per shard (default: PDF_SHARD_PAGES)
+        use_cache: Read and write the conversion cache (default: True)
+        ocr_mode: 'auto', 'on' or 'off' (default: from the profile, else OCR_MODE)
+        profile: 'fast', 'balanced' or 'accurate' (default: PDF_PROFILE)
+        stats: Optional dict filled with per-document page stats
+        stream_pages: Pages per part when converting serially (default: whole document)
+        **options: Pipeline option overrides passed to get_converter()
+
+    Returns:
+        List of DoclingDocument parts in page order
+    """
+    return list(iter_convert_pdf(
+        pdf_path,
+        shard_workers=shard_workers,
+        shard_pages=shard_pages,
+        use_cache=use_cache,
+        ocr_mode=ocr_mode,
+        profile=profile,
+        stats=stats,
+        stream_pages=stream_pages,
+        **options
+    ))
+
+
+def iter_convert_pdf(
+    pdf_path: str,
+    shard_workers: Optional[int] = None,
+    shard_pages: Optional[int] = None,
+    use_cache: bool = True,
+    ocr_mode: Optional[str] = None,
+    profile: Optional[str] = None,
+    stats: Optional[Dict] = None,
+    stream_pages: Optional[int] = None,
+    **options
+) -> Iterator:
+    """
+    Convert a PDF and yield its parts in page order as soon as each is ready
+
+    Same arguments and parts as convert_pdf(). With stream_pages set, a
+    serial conversion is also split into page ranges of that size, so the
+    first pages can be processed downstream while later ones still convert.
+    Parts are written to the conversion cache as they are yielded; the entry
+    is only published once the whole document has been converted.
+
+    Args:
+        stream_pages: Pages per part when converting serially (default: whole
+                      document, or only where pipeline settings change)
+
+    Yields:
+        DoclingDocument parts in page order
+    """
+    # The server-wide OCR_MODE only applies when the caller chose no profile
+    plan = _plan(profile)
+    if ocr_mode:
+        plan['ocr_mode'] = ocr_mode.lower()
+    if 'do_ocr' in options:
+        plan['ocr_mode'] = 'on' if options.pop('do_ocr') else 'off'
+    if 'do_table_structure' in options:
+        plan['tables'] = 'on' if options.pop('do_table_structure') else 'off'
+    options.setdefault('table_mode', plan['table_mode'])
+    stats = {} if stats is None else stats
+
+    writer = None
+    if use_cache and conversion_cache.CACHE_ENABLED:
+        key_options = {**resolve_options(**options), 'ocr_mode': plan['ocr_mode'], 'tables': plan['tables']}
+        if stream_pages:
+            # Part size is part of the result: a cached whole-document entry
+            # would undo the streaming the caller asked for
+            key_options['stream_pages'] = stream_pages
+        key = conversion_cache.cache_key(conversion_cache.file_sha256(pdf_path), key_options)
+        parts = conversion_cache.iter_load(key)
+        if parts is not None:
+            print("⚡ Conversion cache hit - skipping Docling")
+            stats.update(conversion_cache.load_stats(key), cached=True)
+            yield from parts
+            return
+
+        try:
+            writer = conversion_cache.CacheWriter(key, source_name=os.path.basename(pdf_path))
+        except Exception as e:
+            print(f"⚠️  Could not cache conversion: {e}")
+
+    committed = False
+    try:
+        for part in _iter_convert_uncached(pdf_path, shard_workers, shard_pages, stream_pages, options, plan, stats):
+            if writer is not None:
+                try:
+                    writer.add(part)
+                except Exception as e:
+                    print(f"⚠️  Could not cache conversion: {e}")
+                    writer.abort()
+                    writer = None
+            yield part
+
+        if writer is not None:
+            try:
+                writer.commit(stats)
+                committed = True
+            except Exception as e:
+                print(f"⚠️  Could not cache conversion: {e}")
+    finally:
+        # Consumer stopped early or conversion failed: drop the partial entry
+        if writer is not None and not committed:
+            writer.abort()
+
+
+def _iter_convert_uncached(
+    pdf_path: str,
+    shard_workers: Optional[int],
+    shard_pages: Optional[int],
+    stream_pages: Optional[int],
+    options: Dict,
+    plan: Dict,
+    stats: Dict
+) -> Iterator:
+    """Run Docling serially or across page shards, with OCR and tables only where needed"""
+    shard_workers = SHARD_WORKERS if shard_workers is None else shard_workers
+    shard_pages = shard_pages or SHARD_PAGES
+    ocr_mode = plan['ocr_mode']
+    tables = plan['tables']
+
+    stats.update(
+        profile=plan['profile'], ocr_mode=ocr_mode, tables=tables,
+        ocr_pages=0, ocr_page_ranges=[], table_pages=0, ocr_seconds=0.0, text_seconds=0.0
+    )
+
+    page_count = None
+    ocr_pages = []
+    table_pages = []
+    if ocr_mode == 'auto' or tables == 'auto':
+        step_start = time.perf_counter()
+        try:
+            analysis = analyze_pages(pdf_path, detect_tables=tables == 'auto')
+            page_count = analysis['page_count']
+            if ocr_mode == 'auto':
+                ocr_pages = analysis['scanned_pages']
+            table_pages = _fill_table_gaps(analysis['table_pages'], page_count)
+        except Exception as e:
+            # Without the pre-pass, fall back to the old behaviour: no OCR, tables everywhere
+            print(f"⚠️  Page pre-pass failed, running tables on every page: {e}")
+            tables = 'on'
+        stats['analyze_seconds'] = round(time.perf_counter() - step_start, 3)
+
+    if page_count is None:
+        page_count = get_page_count(pdf_path)
+    if ocr_mode == 'on':
+        ocr_pages = list(range(1, page_count + 1))
+    if tables == 'on':
+        table_pages = list(range(1, page_count + 1))
+    elif tables == 'off':
+        table_pages = []
+
+    ocr_set = set(ocr_pages)
+    table_set = set(table_pages)
+    page_settings = merge_short_runs([(page in ocr_set, page in table_set) for page in range(1, page_count + 1)])
+    ocr_pages = [page for page, settings in enumerate(page_settings, 1) if settings[0]]
+    ocr_set = set(ocr_pages)
+    table_set = {page for page, settings in enumerate(page_settings, 1) if settings[1]}
+    stats['page_count'] = page_count
+    stats['ocr_pages'] = len(ocr_set)
+    stats['table_pages'] = len(table_set)
+
+    if ocr_pages:
+        print(f"🔎 OCR on {len(ocr_pages)} of {page_count} pages")
+    print(f"📊 Table model on {len(table_set)} of {page_count} pages ({plan['profile']} profile)")
+
+    def options_for(settings: Tuple) -> Dict:
+        do_ocr, do_tables = settings
+        segment_options = {**options, 'do_ocr': do_ocr, 'do_table_structure': do_tables}
+        if do_ocr and ocr_mode == 'auto':
+            # Scanned page: OCR the whole page image
+            segment_options['force_full_page_ocr'] = True
+        return segment_options
+
+    # Without sharding (or streaming), only split where the settings change
+    if shard_workers > 1:
+        segment_pages = shard_pages
+    else:
+        segment_pages = stream_pages or page_count
+    segments = plan_segments(page_settings, segment_pages)
+    stats['segments'] = len(segments)
+    stats['ocr_page_ranges'] = [list(page_range) for page_range, settings in segments if settings[0]]
+
+    def record(settings: Tuple, seconds: float) -> None:
+        field = 'ocr_seconds' if settings[0] else 'text_seconds'
+        stats[field] = round(stats[field] + seconds, 3)
+
+    if len(segments) == 1:
+        settings = segments[0][1]
+        step_start = time.perf_counter()
+        result = get_converter(**options_for(settings)).convert(pdf_path)
+        record(settings, time.perf_counter() - step_start)
+        yield result.document
+        return
+
+    if shard_workers > 1:
+        workers = min(shard_workers, len(segments))
+        print(f"🧩 Converting {len(segments)} segments of up to {shard_pages} pages on {workers} workers...")
+        pool = _get_shard_pool(shard_workers, _warm_option_sets(plan))
+        futures = [
+            pool.submit(_convert_shard, pdf_path, page_range, options_for(settings))
+            for page_range, settings in segments
+        ]
+        try:
+            # Yield in submission order, which is page order
+            for (page_range, settings), future in zip(segments, futures):
+                document, seconds = future.result()
+                record(settings, seconds)
+                yield document
+        finally:
+            for future in futures:
+                future.cancel()
+    else:
+        print(f"🧩 Converting {len(segments)} segments...")
+        for page_range, settings in segments:
+            document, seconds = _convert_shard(pdf_path, page_range, options_for(settings))
+            record(settings, seconds)
+            yield document
+
+    if ocr_pages:
+        print(f"🔎 OCR took {stats['ocr_seconds']:.1f}s for {len(ocr_pages)} pages")
+
+
+def iter_markdown(parts: List, numbered_images: bool = False) -> Iterator[str]:
+    """
+    Yield each part's markdown in page order, one part at a time
+
+    Joining the yielded blocks with a blank line (as Docling does between
+    top-level items) reproduces export_markdown(); only one block is held
+    in memory at a time. With numbered_images, picture placeholders become
+    '<!-- image N -->' in iter_pictures() order (see chunking.number_images).
+    """
+    pictures_before = 0
+    for part in parts:
+        text = part.export_to_markdown()
+        if numbered_images:
+            text = number_images(text, pictures_before)
+            pictures_before += len(getattr(part, 'pictures', None) or [])
+        if text:
+            yield text
+
+
+def export_markdown(parts: List, numbered_images: bool = False) -> str:
+    """Export ordered document parts as one markdown string"""
+    return '\n\n'.join(iter_markdown(parts, numbered_images))
+
+
+def iter_pictures(parts: List) -> Iterator[Tuple[object, object]]:
+    """Yield (document, picture) pairs in global picture order"""
+    for part in parts:
+        if hasattr(part, 'pictures') and part.pictures:
+            for picture in part.pictures:
+                yield part, picture
+
+
+def count_pictures(parts: List) -> int:
+    """Total pictures across all parts"""
+    return sum(len(part.pictures) for part in parts if getattr(part, 'pictures', None))
+
+
+def get_picture_image(document, picture):
+    """Materialize a picture as a PIL image (None if it has no image data)"""
+    if hasattr(picture, 'get_image'):
+        return picture.get_image(document)
+    if hasattr(picture, 'image'):
+        return picture.image
+    return None
@@ -8,6 +8,7 @@ from typing import List, Dict
 import os
 import json
 from supabase_utils import SupabaseManager
+import llm_scheduler
 
 def get_secret(key: str, default: str = None) -> str:
     """Get secret from Streamlit secrets or environment variable"""
@@ -109,7 +110,8 @@ Context:
 Provide your answer as a JSON object."""
 
         try:
-            response = self.model.generate_content(prompt)
+            # Chat answers go ahead of batch work in the shared Gemini quota
+            response = llm_scheduler.generate_content(self.model, prompt, priority=llm_scheduler.INTERACTIVE)
             response_text = response.text.strip()
 
             # Extract JSON from response
@@ -125,8 +127,10 @@ Provide your answer as a JSON object."""
             print(f"⚠️ Error parsing response: {e}")
             # Fallback to plain text response
             try:
-                response = self.model.generate_content(
-                    f"Answer this question based on the context:\n\nQuestion: {question}\n\nContext:\n{context}"
+                response = llm_scheduler.generate_content(
+                    self.model,
+                    f"Answer this question based on the context:\n\nQuestion: {question}\n\nContext:\n{context}",
+                    priority=llm_scheduler.INTERACTIVE
                 )
                 result_data = {
                     'answer': response.text,
@@ -0,0 +1,140 @@
+"""
+Import-time report for the project's entry points
+Imports each module in a fresh interpreter with -X importtime, lists the
+slowest dependencies it pulled in and fails if any exceeds the budget
+
+Usage:
+    python startup_timing.py
+    python startup_timing.py main api.leap --budget-ms 500
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+PROJECT_ROOT = Path(__file__).parent
+
+# Entry points that should start without loading the conversion stack
+ENTRY_POINTS = [
+    'main',
+    'api.leap',
+    'api.analyze',
+    'job_queue',
+    'ingest_worker',
+    'batch_ingest',
+    'conversion_supervisor',
+    'pdf_conversion'
+]
+
+# Packages that must only load on first use
+HEAVY_PACKAGES = ('docling', 'torch', 'google.generativeai', 'requests', 'PIL')
+
+STARTUP_BUDGET_MS = float(os.getenv('STARTUP_BUDGET_MS', '300'))
+
+
+def measure_import(module: str) -> Dict:
+    """
+    Import a module in a fresh interpreter and parse -X importtime output
+
+    Args:
+        module: Dotted module name, importable from the project root
+
+    Returns:
+        Dict with total_ms, the slowest top-level packages, the heavy
+        packages that were loaded, and an error message if the import failed
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True
+    )
+
+    # Lines look like: "import time:   self [us] |  cumulative | <indent>name"
+    # and each module is printed after everything it imported
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        try:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            entries.append(((len(name) - len(name.lstrip())) // 2, name.strip(), int(cumulative)))
+        except ValueError:
+            continue
+
+    # The module's subtree: entries after the previous top-level import
+    # (interpreter startup such as site) up to the module itself
+    total_us = 0
+    subtree = []
+    for depth, name, cumulative in reversed(entries):
+        if depth == 0 and total_us:
+            break
+        if depth == 0 and name == module:
+            total_us = cumulative
+        elif total_us:
+            subtree.append((depth, name, cumulative))
+
+    packages = {}
+    loaded = set()
+    for depth, name, cumulative in subtree:
+        if depth == 1:
+            top_level = name.split('.')[0]
+            packages[top_level] = packages.get(top_level, 0) + cumulative
+        for heavy in HEAVY_PACKAGES:
+            if name == heavy or name.startswith(heavy + '.'):
+                loaded.add(heavy)
+
+    error = None
+    if proc.returncode != 0:
+        error = (proc.stderr.strip().splitlines() or ['import failed'])[-1]
+
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:5]
+    return {
+        'module': module,
+        'total_ms': round(total_us / 1000, 1),
+        'slowest': [(name, round(us / 1000, 1)) for name, us in slowest],
+        'heavy_loaded': sorted(loaded),
+        'error': error
+    }
+
+
+def report(modules: List[str], budget_ms: float) -> bool:
+    """Print the timing table; returns True if every module is within budget"""
+    ok = True
+    print(f"⏱️  Import times (budget {budget_ms:.0f} ms)\n")
+
+    for module in modules:
+        result = measure_import(module)
+
+        if result['error']:
+            ok = False
+            print(f"❌ {module:<24} import failed: {result['error']}")
+            continue
+
+        within = result['total_ms'] <= budget_ms and not result['heavy_loaded']
+        ok = ok and within
+        icon = '✅' if within else '⚠️ '
+        print(f"{icon} {module:<24} {result['total_ms']:>8.1f} ms")
+        for name, ms in result['slowest']:
+            print(f"      {name:<22} {ms:>8.1f} ms")
+        if result['heavy_loaded']:
+            print(f"      eagerly loads: {', '.join(result['heavy_loaded'])}")
+
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start import time of entry points")
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS, help="Modules to import (default: all entry points)")
+    parser.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS,
+                        help="Per-module budget (default: STARTUP_BUDGET_MS or 300)")
+    args = parser.parse_args()
+
+    raise SystemExit(0 if report(args.modules, args.budget_ms) else 1)
+
+
+if __name__ == "__main__":
+    main()
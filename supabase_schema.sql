@@ -11,10 +11,14 @@ CREATE EXTENSION IF NOT EXISTS vector;
 CREATE TABLE documents (
     id BIGSERIAL PRIMARY KEY,
     filename TEXT NOT NULL,
-    doc_hash TEXT UNIQUE NOT NULL,
+    doc_hash TEXT UNIQUE NOT NULL,  -- SHA-256 of the PDF file bytes
     full_text TEXT,
     chunk_count INTEGER DEFAULT 0,
     image_count INTEGER DEFAULT 0,
+    ingest_status TEXT DEFAULT 'ready',  -- 'staging' (new, not listed) or 'ingesting' (re-ingestion) until published
+    text_minhash BIGINT[],  -- MinHash of word shingles (near-duplicate detection, see document_identity.py)
+    number_minhash BIGINT[],  -- MinHash of number shingles (translated copies)
+    lsh_bands TEXT[],  -- LSH band keys of both signatures, for candidate lookup
     created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW()),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW())
 );
@@ -22,6 +26,7 @@ CREATE TABLE documents (
 -- Index for faster lookups
 CREATE INDEX idx_documents_filename ON documents(filename);
 CREATE INDEX idx_documents_created_at ON documents(created_at DESC);
+CREATE INDEX idx_documents_lsh_bands ON documents USING GIN (lsh_bands);
 
 
 -- ========================================
@@ -34,13 +39,22 @@ CREATE TABLE document_chunks (
     chunk_index INTEGER NOT NULL,
     text TEXT NOT NULL,
     heading TEXT,
-    embedding VECTOR(768),  -- Gemini text-embedding-004 produces 768-dim vectors
+    content_hash TEXT,  -- SHA-256 of heading + text, for incremental re-ingestion
+    norm_hash TEXT,  -- SHA-256 of normalized text, for cross-document boilerplate dedup
+    duplicate_of BIGINT REFERENCES document_chunks(id) ON DELETE SET NULL,  -- Row holding the shared embedding
+    image_indices INTEGER[],  -- image_index of the pictures placed inside this chunk (NULL: not recorded)
+    embedding VECTOR(768),  -- Gemini text-embedding-004 produces 768-dim vectors (NULL when duplicate_of is set)
+    ingest_session TEXT,  -- Ingestion that staged the row; NULL once published (only published rows are searchable)
     created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW())
 );
 
 -- Indexes for faster queries
 CREATE INDEX idx_chunks_document_id ON document_chunks(document_id);
+CREATE INDEX idx_chunks_content_hash ON document_chunks(document_id, content_hash);
+CREATE INDEX idx_chunks_norm_hash ON document_chunks(norm_hash);
+CREATE INDEX idx_chunks_duplicate_of ON document_chunks(duplicate_of);
 CREATE INDEX idx_chunks_embedding ON document_chunks USING ivfflat (embedding vector_cosine_ops);
+CREATE INDEX idx_chunks_ingest_session ON document_chunks(document_id, ingest_session) WHERE ingest_session IS NOT NULL;
 
 
 -- ========================================
@@ -50,16 +64,29 @@ CREATE INDEX idx_chunks_embedding ON document_chunks USING ivfflat (embedding ve
 CREATE TABLE document_images (
     id BIGSERIAL PRIMARY KEY,
     document_id BIGINT REFERENCES documents(id) ON DELETE CASCADE,
-    image_index INTEGER NOT NULL,
+    image_index INTEGER NOT NULL,  -- Picture position in the document, referenced by document_chunks.image_indices
     filename TEXT NOT NULL,
-    image_data TEXT,  -- Base64 encoded image
+    image_key TEXT,  -- Blob store key (SHA-256) of the full-size rendition (NULL when duplicate_of is set)
+    thumbnail_key TEXT,  -- Blob store key of the thumbnail, used by retrieval/UI by default
+    image_size INTEGER,  -- Bytes of the full-size rendition
+    image_data TEXT,  -- Legacy inline base64 rendition; python blob_store.py --migrate moves it out
+    thumbnail_data TEXT,  -- Legacy inline base64 thumbnail
+    mime_type TEXT DEFAULT 'image/png',
+    phash TEXT,  -- Perceptual hash (dHash, 64-bit hex)
+    duplicate_of BIGINT REFERENCES document_images(id),  -- Row holding the shared image data
     caption TEXT,
     context TEXT,  -- Surrounding text for context
+    ingest_session TEXT,  -- Ingestion that staged the row; NULL once published
     created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW())
 );
 
 -- Index for faster lookups
-CREATE INDEX idx_images_document_id ON document_images(document_id);
+CREATE INDEX idx_images_document_id ON document_images(document_id, image_index);
+CREATE INDEX idx_images_phash ON document_images(phash);
+CREATE INDEX idx_images_duplicate_of ON document_images(duplicate_of);
+CREATE INDEX idx_images_image_key ON document_images(image_key);
+CREATE INDEX idx_images_thumbnail_key ON document_images(thumbnail_key);
+CREATE INDEX idx_images_ingest_session ON document_images(document_id, ingest_session) WHERE ingest_session IS NOT NULL;
 
 
 -- ========================================
@@ -95,12 +122,111 @@ BEGIN
     FROM document_chunks dc
     JOIN documents d ON dc.document_id = d.id
     WHERE 1 - (dc.embedding <=> query_embedding) > match_threshold
+      -- Rows staged by an unfinished ingestion stay hidden until it publishes
+      AND dc.ingest_session IS NULL
     ORDER BY dc.embedding <=> query_embedding
     LIMIT match_count;
 END;
 $$;
 
 
+-- ========================================
+-- Function: publish_ingest_session
+-- Ends an ingestion in one transaction (see SupabaseManager.finish_document):
+-- unchanged chunks take their new positions, the previous version's chunks
+-- and images go, staged rows become visible and the document is updated
+-- ========================================
+CREATE OR REPLACE FUNCTION publish_ingest_session(
+    p_document_id BIGINT,
+    p_session TEXT,
+    p_chunk_updates JSONB,  -- [{id, chunk_index, content_hash, image_indices}]
+    p_stale_chunk_ids BIGINT[],
+    p_old_image_ids BIGINT[],
+    p_filename TEXT,
+    p_doc_hash TEXT,
+    p_chunk_count INTEGER,
+    p_image_count INTEGER,
+    p_text_minhash BIGINT[],
+    p_number_minhash BIGINT[],
+    p_lsh_bands TEXT[],
+    p_full_text TEXT DEFAULT NULL  -- NULL keeps the stored text
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE document_chunks dc
+    SET chunk_index = (u->>'chunk_index')::INTEGER,
+        content_hash = u->>'content_hash',
+        image_indices = CASE
+            WHEN jsonb_typeof(u->'image_indices') = 'array'
+            THEN ARRAY(SELECT jsonb_array_elements_text(u->'image_indices')::INTEGER)
+        END
+    FROM jsonb_array_elements(COALESCE(p_chunk_updates, '[]'::JSONB)) AS u
+    WHERE dc.id = (u->>'id')::BIGINT AND dc.document_id = p_document_id;
+
+    DELETE FROM document_chunks WHERE document_id = p_document_id AND id = ANY(p_stale_chunk_ids);
+    DELETE FROM document_images WHERE document_id = p_document_id AND id = ANY(p_old_image_ids);
+
+    UPDATE document_chunks SET ingest_session = NULL
+    WHERE document_id = p_document_id AND ingest_session = p_session;
+    UPDATE document_images SET ingest_session = NULL
+    WHERE document_id = p_document_id AND ingest_session = p_session;
+
+    UPDATE documents
+    SET filename = p_filename,
+        doc_hash = p_doc_hash,
+        chunk_count = p_chunk_count,
+        image_count = p_image_count,
+        text_minhash = p_text_minhash,
+        number_minhash = p_number_minhash,
+        lsh_bands = p_lsh_bands,
+        full_text = COALESCE(p_full_text, full_text),
+        ingest_status = 'ready',
+        updated_at = NOW()
+    WHERE id = p_document_id;
+END;
+$$;
+
+
+-- ========================================
+-- Migrations for existing databases
+-- Safe to re-run; brings older installs up to the schema above
+-- ========================================
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_hash TEXT;
+CREATE INDEX IF NOT EXISTS idx_chunks_content_hash ON document_chunks(document_id, content_hash);
+ALTER TABLE document_images ADD COLUMN IF NOT EXISTS phash TEXT;
+ALTER TABLE document_images ADD COLUMN IF NOT EXISTS duplicate_of BIGINT REFERENCES document_images(id);
+CREATE INDEX IF NOT EXISTS idx_images_phash ON document_images(phash);
+CREATE INDEX IF NOT EXISTS idx_images_duplicate_of ON document_images(duplicate_of);
+ALTER TABLE document_images ADD COLUMN IF NOT EXISTS thumbnail_data TEXT;
+ALTER TABLE document_images ADD COLUMN IF NOT EXISTS mime_type TEXT DEFAULT 'image/png';
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS norm_hash TEXT;
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS duplicate_of BIGINT REFERENCES document_chunks(id) ON DELETE SET NULL;
+CREATE INDEX IF NOT EXISTS idx_chunks_norm_hash ON document_chunks(norm_hash);
+CREATE INDEX IF NOT EXISTS idx_chunks_duplicate_of ON document_chunks(duplicate_of);
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS image_indices INTEGER[];
+CREATE INDEX IF NOT EXISTS idx_images_document_index ON document_images(document_id, image_index);
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS ingest_status TEXT DEFAULT 'ready';
+ALTER TABLE document_images ADD COLUMN IF NOT EXISTS image_key TEXT;
+ALTER TABLE document_images ADD COLUMN IF NOT EXISTS thumbnail_key TEXT;
+ALTER TABLE document_images ADD COLUMN IF NOT EXISTS image_size INTEGER;
+CREATE INDEX IF NOT EXISTS idx_images_image_key ON document_images(image_key);
+CREATE INDEX IF NOT EXISTS idx_images_thumbnail_key ON document_images(thumbnail_key);
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS text_minhash BIGINT[];
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS number_minhash BIGINT[];
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS lsh_bands TEXT[];
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS ingest_session TEXT;
+ALTER TABLE document_images ADD COLUMN IF NOT EXISTS ingest_session TEXT;
+CREATE INDEX IF NOT EXISTS idx_chunks_ingest_session ON document_chunks(document_id, ingest_session) WHERE ingest_session IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_images_ingest_session ON document_images(document_id, ingest_session) WHERE ingest_session IS NOT NULL;
+-- Superseded by ingest_session (search no longer relies on client-side timestamps)
+ALTER TABLE documents DROP COLUMN IF EXISTS ingest_started_at;
+ALTER TABLE documents DROP COLUMN IF EXISTS ingest_heartbeat;
+CREATE INDEX IF NOT EXISTS idx_documents_lsh_bands ON documents USING GIN (lsh_bands);
+-- Older rows keep doc_hash = md5(filename); run python document_identity.py --backfill to fingerprint them
+
+
 -- ========================================
 -- Enable Row Level Security (Optional)
 -- Uncomment if you want to add RLS
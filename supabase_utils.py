@@ -5,11 +5,51 @@ Handles embeddings, text chunks, and images
 
 import os
 from supabase import create_client, Client
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import google.generativeai as genai
 from pathlib import Path
 import base64
 import hashlib
+import json
+import re
+import unicodedata
+import uuid
+
+import blob_store
+import document_identity
+import embedding_cache
+import llm_scheduler
+from embedding_client import EmbeddingError, get_client
+
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'models/text-embedding-004')
+# Texts per embed_content request (the Gemini batch endpoint accepts up to 100)
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '100'))
+
+# Multi-row inserts: rows per request, and a request body ceiling kept well
+# under the REST gateway's limit (embeddings and base64 images make rows large)
+INSERT_BATCH_ROWS = int(os.getenv('SUPABASE_INSERT_BATCH_ROWS', '500'))
+INSERT_BATCH_BYTES = int(float(os.getenv('SUPABASE_INSERT_BATCH_MB', '4')) * 1024 * 1024)
+
+# document_images columns other than the legacy inline (base64) image payloads
+IMAGE_METADATA_COLUMNS = (
+    'id, document_id, image_index, filename, mime_type, image_size, phash, duplicate_of, caption, context'
+)
+
+def chunk_content_hash(chunk: Dict) -> str:
+    """SHA-256 of a chunk's heading and text, used to detect changed chunks"""
+    content = f"{chunk.get('heading') or ''}\n{chunk['text']}"
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def normalized_text_hash(text: str) -> str:
+    """
+    Hash of a chunk's text ignoring case, width, punctuation and whitespace
+
+    Boilerplate repeated across reports (framework descriptions, disclaimers)
+    maps to the same hash even when its formatting differs.
+    """
+    normalized = unicodedata.normalize('NFKC', text).casefold()
+    normalized = re.sub(r'[\W_]+', '', normalized)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
 
 def get_secret(key: str) -> str:
     """Get secret from Streamlit secrets or environment variable"""
@@ -37,26 +77,120 @@ class SupabaseManager:
         if gemini_api_key:
             genai.configure(api_key=gemini_api_key)
 
-    def generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding vector for text using Gemini"""
-        try:
-            # Use Gemini's embedding model
-            result = genai.embed_content(
-                model="models/text-embedding-004",
-                content=text,
-                task_type="retrieval_document"
-            )
-            return result['embedding']
-        except Exception as e:
-            print(f"Error generating embedding: {e}")
-            return []
+    def generate_embedding(
+        self,
+        text: str,
+        task_type: str = "retrieval_document",
+        priority: int = llm_scheduler.BATCH
+    ) -> List[float]:
+        """
+        Generate embedding vector for text using Gemini
+
+        Raises:
+            EmbeddingError: The text could not be embedded after retries
+        """
+        embedding = self.generate_embeddings([text], task_type, priority=priority)[0]
+        if embedding is None:
+            raise EmbeddingError("Could not generate embedding")
+        return embedding
+
+    def generate_embeddings(
+        self,
+        texts: List[str],
+        task_type: str = "retrieval_document",
+        batch_size: Optional[int] = None,
+        priority: int = llm_scheduler.BATCH
+    ) -> List[Optional[List[float]]]:
+        """
+        Embed many texts with one request per batch
+
+        Batches run concurrently within the Gemini rate limit and are retried
+        with backoff when throttled (see embedding_client). A batch that fails
+        otherwise is split in half and retried, down to single texts, so one
+        bad text only costs its own embedding. Cached embeddings are reused
+        and only the misses are sent.
+
+        Args:
+            texts: Texts to embed
+            task_type: Gemini task type
+            batch_size: Texts per request (default: EMBED_BATCH_SIZE)
+            priority: llm_scheduler.INTERACTIVE for queries a user is waiting on
+
+        Returns:
+            One embedding per text, in input order; None where a text failed
+        """
+        batch_size = max(1, batch_size or EMBED_BATCH_SIZE)
+
+        # Texts embedded before (same model, task type and normalized text) come from the cache
+        if embedding_cache.CACHE_ENABLED:
+            embeddings = embedding_cache.get_many(EMBEDDING_MODEL, task_type, texts)
+        else:
+            embeddings = [None] * len(texts)
+
+        missing = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+        if not missing:
+            return embeddings
+
+        missing_texts = [texts[idx] for idx in missing]
+        new_embeddings = get_client(EMBEDDING_MODEL).embed(missing_texts, task_type, batch_size, priority)
+        for idx, embedding in zip(missing, new_embeddings):
+            embeddings[idx] = embedding
+        if embedding_cache.CACHE_ENABLED:
+            embedding_cache.put_many(EMBEDDING_MODEL, task_type, missing_texts, new_embeddings)
+
+        return embeddings
+
+    def embed_rows(self, rows: List[Dict]) -> int:
+        """
+        Fill in 'embedding' for rows from match_chunks() that need one
+
+        Rows whose text could not be embedded keep embedding None and are
+        skipped by insert_chunks(), so the next ingestion retries them.
+
+        Returns:
+            Number of rows embedded
+        """
+        pending = [row for row in rows if row['needs_embedding'] and not row['embedding']]
+        embeddings = self.generate_embeddings([row['text'] for row in pending])
+        for row, embedding in zip(pending, embeddings):
+            row['embedding'] = embedding
+        return sum(1 for embedding in embeddings if embedding is not None)
+
+    def _get_stored_chunks(self, document_id: int) -> List[Dict]:
+        """
+        Existing chunk rows of a document with their content hashes
+
+        Rows stored before content hashes existed get one computed from their
+        text, so they can still be matched instead of re-embedded.
+        """
+        rows = []
+        page_size = 1000
+        start = 0
+        while True:
+            result = self.client.table('document_chunks').select(
+                'id, chunk_index, content_hash, text, heading, image_indices'
+            ).eq('document_id', document_id).is_('ingest_session', 'null').order('id').range(start, start + page_size - 1).execute()
+
+            batch = result.data or []
+            rows.extend(batch)
+            if len(batch) < page_size:
+                break
+            start += page_size
+
+        for row in rows:
+            row['stored_hash'] = row['content_hash']
+            if not row['content_hash']:
+                row['content_hash'] = chunk_content_hash(row)
+
+        return rows
 
     def store_document(
         self,
         filename: str,
         full_text: str,
         chunks: List[Dict[str, str]],
-        images: List[Dict[str, str]]
+        images: List[Dict[str, str]],
+        doc_hash: Optional[str] = None
     ) -> Dict:
         """
         Store document with chunks and images in Supabase
@@ -66,75 +200,476 @@ class SupabaseManager:
             full_text: Complete extracted text
             chunks: List of text chunks with metadata
             images: List of images with base64 data and metadata
+            doc_hash: SHA-256 of the PDF file (default: of full_text, when the file is not at hand)
 
         Returns:
             Dict with document_id and stats
         """
+        session = None
         try:
-            # Generate document hash
-            doc_hash = hashlib.md5(filename.encode()).hexdigest()
+            doc_hash = doc_hash or hashlib.sha256(full_text.encode('utf-8')).hexdigest()
+            session = self.begin_document(filename, full_text, doc_hash=doc_hash,
+                                          fingerprint=document_identity.fingerprint_text(full_text))
+
+            rows = self.match_chunks(session, list(enumerate(chunks)))
+            self.embed_rows(rows)
+            self.insert_chunks(session, rows)
+
+            self.store_images(session, images)
+
+            return self.finish_document(session, full_text)
+
+        except Exception as e:
+            print(f"Error storing document: {e}")
+            if session is not None:
+                self.abort_document(session)
+            raise
+
+    def _insert_batches(self, rows: List[Dict]) -> List[List[Dict]]:
+        """Group rows into multi-row inserts under the row and byte limits"""
+        batches = []
+        batch = []
+        batch_bytes = 0
+        for row in rows:
+            row_bytes = len(json.dumps(row, default=str)) + 1
+            if batch and (len(batch) >= INSERT_BATCH_ROWS or batch_bytes + row_bytes > INSERT_BATCH_BYTES):
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+            # A single row over the byte limit still goes alone
+            batch.append(row)
+            batch_bytes += row_bytes
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _bulk_insert(self, table: str, rows: List[Dict]) -> List[int]:
+        """
+        Insert rows with as few requests as the size limits allow
+
+        Returns:
+            Ids of the new rows, in input order
+        """
+        ids = []
+        for batch in self._insert_batches(rows):
+            result = self.client.table(table).insert(batch).execute()
+            batch_ids = [row['id'] for row in result.data or []]
+            if len(batch_ids) != len(batch):
+                raise Exception(f"Insert into {table} returned {len(batch_ids)} of {len(batch)} rows")
+            ids.extend(batch_ids)
+        return ids
+
+    def begin_document(
+        self,
+        filename: str,
+        full_text: str = '',
+        doc_hash: Optional[str] = None,
+        fingerprint: Optional[Dict] = None,
+        replaces: Optional[int] = None
+    ) -> Dict:
+        """
+        Create or reuse the document record and start an ingestion session
+
+        Chunks and images are then added in any number of batches with
+        match_chunks/insert_chunks and store_images, and the session is closed
+        with finish_document, or undone with abort_document. Rows are staged
+        under the session's id, hidden from search and from other ingestions,
+        and finish_document publishes them and retires the previous version's
+        in one transaction.
 
-            # 1. Store main document record
-            doc_data = {
+        Documents are identified by content. The same file is re-ingested into
+        its own record; a revision (near-duplicate text) under the same
+        filename, or the document given as replaces, is updated in place so
+        its unchanged chunks keep their embeddings. Anything else, including a
+        different report that happens to share a filename, gets a new record.
+
+        Args:
+            filename: Name of the PDF file
+            full_text: Complete extracted text, if already known
+            doc_hash: SHA-256 of the PDF file (see document_identity)
+            fingerprint: MinHash signatures from document_identity
+            replaces: Id of a document this one is a new version of
+
+        Returns:
+            Session dict passed to the other ingestion methods
+        """
+        doc_hash = doc_hash or hashlib.sha256((full_text or filename).encode('utf-8')).hexdigest()
+        fingerprint = fingerprint or {}
+
+        # 1. Reuse the document record, or create it; a previous version stays
+        # intact (text, chunks, images) until finish_document replaces it
+        existing_doc = self.client.table('documents').select('id, ingest_status').eq('doc_hash', doc_hash).execute()
+        doc_id = existing_doc.data[0]['id'] if existing_doc.data else None
+        if doc_id is None and replaces is None and fingerprint:
+            replaces = next((
+                match['id'] for match in self.find_similar_documents(doc_hash, fingerprint)
+                if match['filename'] == filename and match['kind'] in ('same text', 'revision')
+            ), None)
+        if doc_id is None and replaces is not None:
+            doc_id = replaces
+            print(f"♻️  Storing as a new version of document {doc_id}")
+
+        # A document whose first ingestion never finished has no version to keep;
+        # 'staging' keeps it out of list_documents until it is published
+        created = doc_id is None or bool(existing_doc.data and existing_doc.data[0]['ingest_status'] == 'staging')
+        if doc_id is None:
+            doc_result = self.client.table('documents').insert({
                 'filename': filename,
                 'doc_hash': doc_hash,
                 'full_text': full_text,
-                'chunk_count': len(chunks),
-                'image_count': len(images)
-            }
+                'ingest_status': 'staging'
+            }).execute()
+            doc_id = doc_result.data[0]['id'] if doc_result.data else None
+        elif not created:
+            self.client.table('documents').update({'ingest_status': 'ingesting'}).eq('id', doc_id).execute()
 
-            doc_result = self.client.table('documents').upsert(
-                doc_data,
-                on_conflict='doc_hash'
-            ).execute()
+        if not doc_id:
+            raise Exception("Failed to create document record")
 
-            doc_id = doc_result.data[0]['id'] if doc_result.data else None
+        # Rows staged by an ingestion that died before publishing were never visible
+        self._discard_staged(doc_id)
 
-            if not doc_id:
-                raise Exception("Failed to create document record")
+        # 2. Only chunks whose content is new get embedded; unchanged chunks keep
+        # their row (and embedding), chunks that disappeared are deleted at the end
+        existing = self._get_stored_chunks(doc_id)
+        existing_by_hash = {}
+        for row in existing:
+            existing_by_hash.setdefault(row['content_hash'], []).append(row)
 
-            # 2. Store text chunks with embeddings
-            stored_chunks = 0
-            for idx, chunk in enumerate(chunks):
-                # Generate embedding for chunk
-                embedding = self.generate_embedding(chunk['text'])
+        # 3. Images are replaced at the end; remember which rows are the old ones
+        old_images = self.client.table('document_images').select('id').eq(
+            'document_id', doc_id
+        ).is_('ingest_session', 'null').execute()
 
-                chunk_data = {
-                    'document_id': doc_id,
-                    'chunk_index': idx,
-                    'text': chunk['text'],
-                    'heading': chunk.get('heading', ''),
-                    'embedding': embedding
-                }
+        return {
+            'session_id': uuid.uuid4().hex,  # marks the rows staged by this session
+            'document_id': doc_id,
+            'filename': filename,
+            'doc_hash': doc_hash,
+            'fingerprint': fingerprint,
+            'created': created,
+            'reingestion': bool(existing),
+            'existing_by_hash': existing_by_hash,
+            'old_image_ids': [row['id'] for row in old_images.data or []],
+            'chunk_updates': [],  # new positions of unchanged rows, applied on publish
+            'canonical': {},  # norm_hash -> id of the chunk holding the embedding
+            'pending_norms': set(),  # norm hashes being embedded but not inserted yet
+            'deferred': [],  # references waiting for their original to be inserted
+            'stored_image_ids': {},  # image filename -> id of the row holding the data
+            'chunk_count': 0,
+            'image_count': 0,
+            'chunks_stored': 0,
+            'chunks_deduplicated': 0,
+            'chunks_unchanged': 0,
+            'chunks_failed': 0
+        }
 
-                self.client.table('document_chunks').insert(chunk_data).execute()
-                stored_chunks += 1
-
-            # 3. Store images
-            stored_images = 0
-            for idx, image in enumerate(images):
-                image_data = {
-                    'document_id': doc_id,
-                    'image_index': idx,
-                    'filename': image['filename'],
-                    'image_data': image['base64_data'],
-                    'caption': image.get('caption', ''),
-                    'context': image.get('context', '')  # Surrounding text
-                }
+    def match_chunks(self, session: Dict, indexed_chunks: List) -> List[Dict]:
+        """
+        Match chunks against what is already stored
+
+        Unchanged chunks (same content hash as a stored row of this document)
+        keep their row; its new chunk_index and image_indices (pictures are
+        renumbered on every ingestion and are not part of the hash) are
+        applied when the session is published. Boilerplate that already has
+        an embedding, here or in another document, becomes a reference row.
+
+        Args:
+            session: Session from begin_document()
+            indexed_chunks: (chunk_index, chunk) pairs
+
+        Returns:
+            Rows to pass to insert_chunks(); rows with needs_embedding set must
+            get an 'embedding' first
+        """
+        new_chunks = []
+        for idx, chunk in indexed_chunks:
+            session['chunk_count'] += 1
+            content_hash = chunk_content_hash(chunk)
+            matches = session['existing_by_hash'].get(content_hash)
+
+            if matches:
+                row = matches.pop(0)
+                images = chunk.get('images')
+                if row['chunk_index'] != idx or not row['stored_hash'] or row.get('image_indices') != images:
+                    session['chunk_updates'].append({
+                        'id': row['id'],
+                        'chunk_index': idx,
+                        'content_hash': content_hash,
+                        'image_indices': images
+                    })
+                session['chunks_unchanged'] += 1
+            else:
+                new_chunks.append((idx, chunk, content_hash, normalized_text_hash(chunk['text'])))
+
+        lookup = [norm for _, _, _, norm in new_chunks if norm not in session['canonical']]
+        session['canonical'].update(self._find_chunks_by_norm_hash(lookup))
+
+        rows = []
+        for idx, chunk, content_hash, norm_hash in new_chunks:
+            duplicate_of = session['canonical'].get(norm_hash)
+            awaits = duplicate_of is None and norm_hash in session['pending_norms']
+            if duplicate_of is None and not awaits:
+                session['pending_norms'].add(norm_hash)
+
+            rows.append({
+                'document_id': session['document_id'],
+                'chunk_index': idx,
+                'text': chunk['text'],
+                'heading': chunk.get('heading', ''),
+                'content_hash': content_hash,
+                'norm_hash': norm_hash,
+                'duplicate_of': duplicate_of,
+                'image_indices': chunk.get('images'),  # pictures placed inside this chunk
+                'embedding': None,
+                # Generate embedding for chunk (references share the original's)
+                'needs_embedding': duplicate_of is None and not awaits
+            })
+
+        return rows
+
+    def insert_chunks(self, session: Dict, rows: List[Dict]) -> None:
+        """
+        Insert rows from match_chunks() once their embeddings are filled in
+
+        A repeat of a chunk that is still being embedded waits until its
+        original has been inserted, then is stored as a reference.
+        """
+        ready = []
+        for row in rows:
+            if row['needs_embedding'] and not row['embedding']:
+                # Embedding failed: finish_document fails the session, so the
+                # job is retried; later repeats meanwhile embed themselves
+                session['chunks_failed'] += 1
+                session['pending_norms'].discard(row['norm_hash'])
+                continue
+            if not row['needs_embedding'] and row['duplicate_of'] is None:
+                row['duplicate_of'] = session['canonical'].get(row['norm_hash'])
+                if row['duplicate_of'] is None:
+                    session['deferred'].append(row)
+                    continue
+            ready.append(row)
+        self._insert_chunk_rows(session, ready)
+
+        # Originals inserted above may unblock waiting references
+        waiting = session['deferred']
+        session['deferred'] = []
+        unblocked = []
+        for row in waiting:
+            row['duplicate_of'] = session['canonical'].get(row['norm_hash'])
+            if row['duplicate_of'] is None:
+                session['deferred'].append(row)
+            else:
+                unblocked.append(row)
+        self._insert_chunk_rows(session, unblocked)
+
+    def _insert_chunk_rows(self, session: Dict, rows: List[Dict]) -> None:
+        if not rows:
+            return
+        chunk_data = [
+            {**{key: value for key, value in row.items() if key != 'needs_embedding'},
+             'ingest_session': session['session_id']}
+            for row in rows
+        ]
+        ids = self._bulk_insert('document_chunks', chunk_data)
+
+        for row, chunk_id in zip(rows, ids):
+            if row['duplicate_of']:
+                session['chunks_deduplicated'] += 1
+            else:
+                session['chunks_stored'] += 1
+                session['pending_norms'].discard(row['norm_hash'])
+                session['canonical'][row['norm_hash']] = chunk_id
 
-                self.client.table('document_images').insert(image_data).execute()
-                stored_images += 1
+    def store_images(self, session: Dict, images: List[Dict[str, str]]) -> None:
+        """
+        Store a batch of images for the session's document
+
+        Each distinct image is stored once; repeats within this document or
+        already stored by another document only reference the first copy.
+        """
+        doc_id = session['document_id']
+        stored_ids = session['stored_image_ids']
+        shared = self._find_images_by_phash(
+            [image['phash'] for image in images if image.get('phash') and not image.get('duplicate_of')],
+            exclude_document_id=doc_id
+        )
 
-            return {
+        store = blob_store.get_store()
+        originals = []
+        references = []  # (row, filename of the in-document original or None)
+        for image in images:
+            idx = session['image_count']
+            session['image_count'] += 1
+            mime_type = image.get('mime_type', 'image/png')
+            image_data = {
                 'document_id': doc_id,
-                'filename': filename,
-                'chunks_stored': stored_chunks,
-                'images_stored': stored_images
+                'image_index': image.get('picture_index', idx),
+                'filename': image['filename'],
+                'image_key': None,
+                'thumbnail_key': None,
+                'image_size': None,
+                'mime_type': mime_type,
+                'phash': image.get('phash'),
+                'duplicate_of': None,
+                'caption': image.get('caption', ''),
+                'context': image.get('context', ''),  # Surrounding text
+                'ingest_session': session['session_id']
             }
 
+            if image.get('duplicate_of') or image.get('phash') in shared:
+                if image.get('duplicate_of'):
+                    references.append((image_data, image['duplicate_of']))
+                else:
+                    image_data['duplicate_of'] = shared[image['phash']]
+                    references.append((image_data, None))
+                    # Repeats of this image within the document resolve to the same row
+                    stored_ids[image['filename']] = shared[image['phash']]
+            elif image.get('base64_data'):
+                # Bytes go to the blob store before the row that points at them
+                data = base64.b64decode(image['base64_data'])
+                image_data['image_key'] = store.put(data, mime_type)
+                image_data['image_size'] = len(data)
+                if image.get('thumbnail_base64'):
+                    image_data['thumbnail_key'] = store.put(base64.b64decode(image['thumbnail_base64']), mime_type)
+                originals.append(image_data)
+            else:
+                originals.append(image_data)
+
+        # Originals first, so repeats within the document can point at their ids
+        ids = self._bulk_insert('document_images', originals)
+        for image_data, image_id in zip(originals, ids):
+            if image_data['image_key']:
+                stored_ids[image_data['filename']] = image_id
+
+        for image_data, original_filename in references:
+            if original_filename:
+                image_data['duplicate_of'] = stored_ids.get(original_filename)
+        self._bulk_insert('document_images', [row for row, _ in references])
+
+    def finish_document(self, session: Dict, full_text: Optional[str] = None) -> Dict:
+        """
+        Close an ingestion session
+
+        Embeds any repeats whose original never arrived, then publishes the
+        session in one transaction (publish_ingest_session): unchanged rows
+        take their new positions, chunks and images of the previous version
+        are deleted, staged rows become visible and the document record takes
+        the new identity and counts.
+
+        Returns:
+            Dict with document_id and stats
+
+        Raises:
+            EmbeddingError: Some chunks could not be embedded; the document is
+                not marked ready, and the caller should abort_document() and retry
+        """
+        doc_id = session['document_id']
+
+        deferred = session['deferred']
+        session['deferred'] = []
+        for row in deferred:
+            row['needs_embedding'] = True
+        self.embed_rows(deferred)
+        self.insert_chunks(session, deferred)
+
+        # A document missing chunks must not take the new identity: it would be
+        # listed as ready and never be processed again
+        if session['chunks_failed']:
+            raise EmbeddingError(
+                f"{session['chunks_failed']} chunks of {session['filename']} could not be embedded",
+                retryable=True
+            )
+
+        # Other documents referencing rows about to go take over their data
+        # first; harmless if the publish below fails, as the rows still exist
+        stale_ids = [row['id'] for rows in session['existing_by_hash'].values() for row in rows]
+        self._release_shared_chunks(stale_ids)
+        old_image_ids = session['old_image_ids']
+        self._release_shared_images(doc_id, old_image_ids)
+        old_images = list(self._fetch_image_columns(old_image_ids, 'image_key, thumbnail_key').values())
+
+        self.client.rpc('publish_ingest_session', {
+            'p_document_id': doc_id,
+            'p_session': session['session_id'],
+            'p_chunk_updates': session['chunk_updates'],
+            'p_stale_chunk_ids': stale_ids,
+            'p_old_image_ids': old_image_ids,
+            'p_filename': session['filename'],
+            'p_doc_hash': session['doc_hash'],
+            'p_chunk_count': session['chunk_count'],
+            'p_image_count': session['image_count'],
+            'p_text_minhash': session['fingerprint'].get('text_minhash'),
+            'p_number_minhash': session['fingerprint'].get('number_minhash'),
+            'p_lsh_bands': document_identity.lsh_bands(session['fingerprint']),
+            'p_full_text': full_text
+        }).execute()
+
+        self._delete_unreferenced_blobs(old_images)
+
+        if session['reingestion']:
+            print(f"♻️  Re-ingestion: {session['chunks_stored']} embedded, "
+                  f"{session['chunks_unchanged']} unchanged, {len(stale_ids)} removed")
+        if session['chunks_deduplicated']:
+            print(f"♻️  {session['chunks_deduplicated']} boilerplate chunks reuse an existing embedding")
+
+        return {
+            'document_id': doc_id,
+            'filename': session['filename'],
+            'chunks_stored': session['chunks_stored'],
+            'chunks_deduplicated': session['chunks_deduplicated'],
+            'chunks_unchanged': session['chunks_unchanged'],
+            'chunks_deleted': len(stale_ids),
+            'images_stored': session['image_count']
+        }
+
+    def abort_document(self, session: Dict) -> None:
+        """
+        Undo a failed ingestion session
+
+        Removes the rows this session staged; nothing outside the session
+        references them. A new document is deleted entirely; a re-ingested
+        one is left as its previous version.
+        """
+        doc_id = session['document_id']
+        try:
+            chunk_count, image_count = self._discard_staged(doc_id, session['session_id'])
+
+            if session['created']:
+                self.client.table('documents').delete().eq('id', doc_id).execute()
+            else:
+                self.client.table('documents').update({'ingest_status': 'ready'}).eq('id', doc_id).execute()
+
+            print(f"↩️  Rolled back {chunk_count} chunks and {image_count} images of {session['filename']}")
         except Exception as e:
-            print(f"Error storing document: {e}")
-            raise
+            # Staged rows stay hidden; the next ingestion of this document discards them
+            print(f"⚠️  Could not roll back {session['filename']}: {e}")
+
+    def _discard_staged(self, document_id: int, session_id: Optional[str] = None) -> Tuple[int, int]:
+        """
+        Delete rows staged for a document but never published
+
+        Only those of session_id when given, else those of any session.
+
+        Returns:
+            (chunks deleted, images deleted)
+        """
+        counts = []
+        for table in ('document_chunks', 'document_images'):
+            query = self.client.table(table).select('id').eq('document_id', document_id)
+            if session_id:
+                query = query.eq('ingest_session', session_id)
+            else:
+                query = query.not_.is_('ingest_session', 'null')
+            ids = [row['id'] for row in query.execute().data or []]
+
+            if table == 'document_images':
+                if ids:
+                    self._delete_images(ids)
+            else:
+                for start in range(0, len(ids), 100):
+                    self.client.table(table).delete().in_('id', ids[start:start + 100]).execute()
+            counts.append(len(ids))
+        return tuple(counts)
 
     def search_similar_chunks(
         self,
@@ -155,7 +690,7 @@ class SupabaseManager:
         """
         try:
             # Generate query embedding
-            query_embedding = self.generate_embedding(query)
+            query_embedding = self.generate_embedding(query, priority=llm_scheduler.INTERACTIVE)
 
             # Search using pgvector similarity
             # Note: This requires RPC function in Supabase
@@ -168,19 +703,18 @@ class SupabaseManager:
                 }
             ).execute()
 
-            # Enhance results with images
+            # Attach only the images placed inside each matched chunk
+            chunk_images = self.get_chunk_images(result.data)
+
             enhanced_results = []
             for chunk in result.data:
-                # Get associated images for this document
-                images = self.get_document_images(chunk['document_id'])
-
                 enhanced_results.append({
                     'text': chunk['text'],
                     'heading': chunk['heading'],
                     'similarity': chunk['similarity'],
                     'document_id': chunk['document_id'],
                     'filename': chunk['filename'],
-                    'images': images
+                    'images': chunk_images.get(chunk['id'], [])
                 })
 
             return enhanced_results
@@ -189,25 +723,414 @@ class SupabaseManager:
             print(f"Error searching chunks: {e}")
             return []
 
-    def get_document_images(self, document_id: int) -> List[Dict]:
-        """Get all images for a document"""
+    def _find_chunks_by_norm_hash(self, norm_hashes: List[str]) -> Dict[str, int]:
+        """Map normalized-text hashes to ids of stored chunks that hold an embedding"""
+        found = {}
+        unique_hashes = list(dict.fromkeys(norm_hashes))
+
+        for start in range(0, len(unique_hashes), 100):
+            result = self.client.table('document_chunks').select('id, norm_hash').in_(
+                'norm_hash', unique_hashes[start:start + 100]
+            ).is_('duplicate_of', 'null').not_.is_('embedding', 'null').is_(
+                'ingest_session', 'null'
+            ).order('id').execute()
+
+            for row in result.data or []:
+                found.setdefault(row['norm_hash'], row['id'])
+
+        return found
+
+    def _release_shared_chunks(self, chunk_ids: List[int]) -> None:
+        """
+        Hand embeddings of chunks about to be deleted over to their references
+
+        The first surviving chunk that references a deleted original takes a
+        copy of its embedding and the remaining references move to it.
+        """
+        deleting = set(chunk_ids)
+        refs_by_original = {}
+        for start in range(0, len(chunk_ids), 100):
+            result = self.client.table('document_chunks').select('id, duplicate_of').in_(
+                'duplicate_of', chunk_ids[start:start + 100]
+            ).order('id').execute()
+            for row in result.data or []:
+                if row['id'] not in deleting:
+                    refs_by_original.setdefault(row['duplicate_of'], []).append(row['id'])
+
+        for original_id, ref_ids in refs_by_original.items():
+            original = self.client.table('document_chunks').select('embedding').eq(
+                'id', original_id
+            ).execute().data
+
+            new_owner = ref_ids[0]
+            self.client.table('document_chunks').update({
+                'embedding': original[0]['embedding'] if original else None,
+                'duplicate_of': None
+            }).eq('id', new_owner).execute()
+
+            if len(ref_ids) > 1:
+                self.client.table('document_chunks').update({
+                    'duplicate_of': new_owner
+                }).in_('id', ref_ids[1:]).execute()
+
+    def _find_images_by_phash(
+        self,
+        phashes: List[str],
+        exclude_document_id: Optional[int] = None
+    ) -> Dict[str, int]:
+        """Map perceptual hashes to ids of stored images that hold the data"""
+        found = {}
+        unique_hashes = list(dict.fromkeys(phashes))
+
+        # Keep the IN (...) filter well inside URL length limits
+        for start in range(0, len(unique_hashes), 100):
+            query = self.client.table('document_images').select('id, phash').in_(
+                'phash', unique_hashes[start:start + 100]
+            ).is_('duplicate_of', 'null').is_('ingest_session', 'null')
+
+            if exclude_document_id is not None:
+                query = query.neq('document_id', exclude_document_id)
+
+            for row in query.execute().data or []:
+                found.setdefault(row['phash'], row['id'])
+
+        return found
+
+    def _fetch_image_columns(self, ids: List[int], columns: str) -> Dict[int, Dict]:
+        """Fetch some columns for a set of image rows, keyed by id"""
+        values = {}
+        for start in range(0, len(ids), 100):
+            result = self.client.table('document_images').select(f'id, {columns}').in_(
+                'id', ids[start:start + 100]
+            ).execute()
+            for row in result.data or []:
+                values[row['id']] = row
+        return values
+
+    def _load_image_payloads(self, images: List[Dict], full_size: bool) -> List[Dict]:
+        """
+        Attach image references to image metadata rows
+
+        Sets 'blob_key' (fetch the bytes with blob_store when rendering) from
+        the row that owns the data. Thumbnails are used unless full_size is
+        set; rows without a thumbnail fall back to the full image. Rows from
+        before the blob store carry base64 bytes in 'image_data' instead.
+        """
+        owners = {img['id']: img.get('duplicate_of') or img['id'] for img in images}
+        owner_ids = list(set(owners.values()))
+        keys = self._fetch_image_columns(owner_ids, 'image_key, thumbnail_key')
+
+        chosen = {}
+        for owner_id, row in keys.items():
+            if not full_size and row.get('thumbnail_key'):
+                chosen[owner_id] = (row['thumbnail_key'], True)
+            elif row.get('image_key'):
+                chosen[owner_id] = (row['image_key'], False)
+
+        legacy = {}
+        legacy_ids = [owner_id for owner_id in owner_ids if owner_id not in chosen]
+        if legacy_ids:
+            legacy = self._fetch_image_columns(legacy_ids, 'image_data, thumbnail_data')
+
+        for img in images:
+            owner_id = owners[img['id']]
+            if owner_id in chosen:
+                img['blob_key'], img['is_thumbnail'] = chosen[owner_id]
+                img['image_data'] = None
+            else:
+                row = legacy.get(owner_id, {})
+                thumbnail = None if full_size else row.get('thumbnail_data')
+                img['blob_key'] = None
+                img['image_data'] = thumbnail or row.get('image_data')
+                img['is_thumbnail'] = bool(thumbnail)
+
+        return images
+
+    def get_document_images(self, document_id: int, full_size: bool = False) -> List[Dict]:
+        """
+        Get all images for a document
+
+        Args:
+            document_id: Document to fetch images for
+            full_size: Return full renditions instead of thumbnails
+
+        Returns:
+            Image rows with a 'blob_key' to fetch (or legacy base64 'image_data')
+        """
         try:
-            result = self.client.table('document_images').select('*').eq(
+            result = self.client.table('document_images').select(IMAGE_METADATA_COLUMNS).eq(
                 'document_id', document_id
-            ).execute()
+            ).is_('ingest_session', 'null').execute()
 
-            return result.data if result.data else []
+            return self._load_image_payloads(result.data, full_size) if result.data else []
 
         except Exception as e:
             print(f"Error fetching images: {e}")
             return []
 
+    def get_chunk_images(self, chunks: List[Dict], full_size: bool = False) -> Dict[int, List[Dict]]:
+        """
+        Get the images placed inside each of a set of chunks
+
+        Chunks stored before image linkage existed (image_indices is NULL)
+        fall back to all images of their document.
+
+        Args:
+            chunks: Chunk rows with id and document_id (e.g. search matches)
+            full_size: Return full renditions instead of thumbnails
+
+        Returns:
+            Dict mapping chunk id to its image rows, in picture order
+        """
+        try:
+            chunk_ids = [chunk['id'] for chunk in chunks]
+            indices = {}
+            for start in range(0, len(chunk_ids), 100):
+                result = self.client.table('document_chunks').select('id, image_indices').in_(
+                    'id', chunk_ids[start:start + 100]
+                ).execute()
+                for row in result.data or []:
+                    indices[row['id']] = row['image_indices']
+
+            # One query per document for the union of its chunks' pictures
+            wanted = {}
+            legacy = set()
+            for chunk in chunks:
+                chunk_indices = indices.get(chunk['id'])
+                if chunk_indices is None:
+                    legacy.add(chunk['document_id'])
+                elif chunk_indices:
+                    wanted.setdefault(chunk['document_id'], set()).update(chunk_indices)
+
+            rows = []
+            for document_id, image_indices in wanted.items():
+                result = self.client.table('document_images').select(IMAGE_METADATA_COLUMNS).eq(
+                    'document_id', document_id
+                ).in_('image_index', sorted(image_indices)).is_('ingest_session', 'null').order('image_index').execute()
+                rows.extend(result.data or [])
+            if rows:
+                self._load_image_payloads(rows, full_size)
+
+            by_position = {(row['document_id'], row['image_index']): row for row in rows}
+            legacy_images = {document_id: self.get_document_images(document_id, full_size) for document_id in legacy}
+
+            chunk_images = {}
+            for chunk in chunks:
+                chunk_indices = indices.get(chunk['id'])
+                if chunk_indices is None:
+                    chunk_images[chunk['id']] = legacy_images.get(chunk['document_id'], [])
+                else:
+                    chunk_images[chunk['id']] = [
+                        by_position[(chunk['document_id'], idx)]
+                        for idx in chunk_indices
+                        if (chunk['document_id'], idx) in by_position
+                    ]
+            return chunk_images
+
+        except Exception as e:
+            print(f"Error fetching chunk images: {e}")
+            return {}
+
+    def _release_shared_images(self, document_id: int, image_ids: Optional[List[int]] = None) -> None:
+        """
+        Hand this document's shared images over to another document
+
+        Before deleting, the first row elsewhere that references one of our
+        images takes over its blob keys and the other references move to it.
+        With image_ids, only those rows of the document are released.
+        """
+        columns = 'id, image_key, thumbnail_key, image_size, image_data, thumbnail_data'
+        if image_ids is None:
+            own = self.client.table('document_images').select(columns).eq(
+                'document_id', document_id
+            ).is_('duplicate_of', 'null').execute().data or []
+        else:
+            own = []
+            for start in range(0, len(image_ids), 100):
+                own.extend(self.client.table('document_images').select(columns).in_(
+                    'id', image_ids[start:start + 100]
+                ).is_('duplicate_of', 'null').execute().data or [])
+
+        for original in own:
+            refs = self.client.table('document_images').select('id').eq(
+                'duplicate_of', original['id']
+            ).neq('document_id', document_id).order('id').execute().data or []
+
+            if not refs:
+                continue
+
+            new_owner = refs[0]['id']
+            self.client.table('document_images').update({
+                'image_key': original['image_key'],
+                'thumbnail_key': original['thumbnail_key'],
+                'image_size': original['image_size'],
+                'image_data': original['image_data'],
+                'thumbnail_data': original['thumbnail_data'],
+                'duplicate_of': None
+            }).eq('id', new_owner).execute()
+
+            self.client.table('document_images').update({
+                'duplicate_of': new_owner
+            }).eq('duplicate_of', original['id']).neq('document_id', document_id).execute()
+
+    def _delete_images(self, image_ids: Optional[List[int]] = None, document_id: Optional[int] = None) -> None:
+        """
+        Delete image rows (by id, or all of a document) and the blobs only they used
+
+        Call _release_shared_images() first. Blobs are content-addressed, so
+        a blob is kept while any remaining row, in any document, points at it.
+        """
+        if image_ids is None:
+            rows = self.client.table('document_images').select('image_key, thumbnail_key').eq(
+                'document_id', document_id
+            ).execute().data or []
+            self.client.table('document_images').delete().eq('document_id', document_id).execute()
+        else:
+            rows = list(self._fetch_image_columns(image_ids, 'image_key, thumbnail_key').values())
+            for start in range(0, len(image_ids), 100):
+                self.client.table('document_images').delete().in_(
+                    'id', image_ids[start:start + 100]
+                ).execute()
+
+        self._delete_unreferenced_blobs(rows)
+
+    def _delete_unreferenced_blobs(self, rows: List[Dict]) -> int:
+        """
+        Delete the blobs of removed image rows that no remaining row points at
+
+        Staged rows count as references. A blob another ingestion has just
+        put but not referenced yet is protected by blob_store's grace period.
+        """
+        keys = list({key for row in rows for key in (row['image_key'], row['thumbnail_key']) if key})
+        referenced = set()
+        for start in range(0, len(keys), 100):
+            batch = keys[start:start + 100]
+            for column in ('image_key', 'thumbnail_key'):
+                result = self.client.table('document_images').select(column).in_(column, batch).execute()
+                referenced.update(row[column] for row in result.data or [])
+
+        return blob_store.delete_many(key for key in keys if key not in referenced)
+
+    def collect_blob_garbage(self, batch_size: int = 100) -> int:
+        """
+        Delete every blob no image row points at
+
+        Picks up blobs that were still inside the grace period when their
+        rows were deleted, and those of crashed ingestions.
+
+        Returns:
+            Number of blobs deleted
+        """
+        deleted = 0
+        batch = []
+        for key in blob_store.get_store().iter_keys():
+            batch.append(key)
+            if len(batch) >= batch_size:
+                deleted += self._delete_unreferenced_blobs([{'image_key': key, 'thumbnail_key': None} for key in batch])
+                batch = []
+        if batch:
+            deleted += self._delete_unreferenced_blobs([{'image_key': key, 'thumbnail_key': None} for key in batch])
+        return deleted
+
+    def migrate_images_to_blob_store(self, batch_size: int = 50) -> int:
+        """
+        Move base64 image payloads stored in document_images into the blob store
+
+        Safe to interrupt and re-run; each row is switched to blob keys and
+        its inline columns cleared in one update.
+
+        Returns:
+            Number of images moved
+        """
+        store = blob_store.get_store()
+        moved = 0
+        while True:
+            rows = self.client.table('document_images').select(
+                'id, mime_type, image_data, thumbnail_data'
+            ).is_('image_key', 'null').not_.is_('image_data', 'null').order('id').limit(batch_size).execute().data
+            if not rows:
+                return moved
+
+            for row in rows:
+                data = base64.b64decode(row['image_data'])
+                update = {
+                    'image_key': store.put(data, row['mime_type']),
+                    'image_size': len(data),
+                    'thumbnail_key': None,
+                    'image_data': None,
+                    'thumbnail_data': None
+                }
+                if row['thumbnail_data']:
+                    update['thumbnail_key'] = store.put(base64.b64decode(row['thumbnail_data']), row['mime_type'])
+                self.client.table('document_images').update(update).eq('id', row['id']).execute()
+                moved += 1
+            print(f"📦 Moved {moved} images so far")
+
+    def find_similar_documents(self, doc_hash: str, fingerprint: Optional[Dict] = None, limit: int = 5) -> List[Dict]:
+        """
+        Stored documents that a file duplicates
+
+        The same bytes match on doc_hash. Otherwise documents sharing an LSH
+        band with the fingerprint are compared signature by signature.
+
+        Args:
+            doc_hash: SHA-256 of the file
+            fingerprint: MinHash signatures from document_identity
+            limit: Most near duplicates to return
+
+        Returns:
+            List of {'id', 'filename', 'kind', 'similarity'}, where kind is
+            'identical', 'same text', 'revision' or 'translation'; closest first
+        """
+        exact = self.client.table('documents').select('id, filename').eq(
+            'doc_hash', doc_hash
+        ).neq('ingest_status', 'staging').execute()
+        if exact.data:
+            return [{**row, 'kind': 'identical', 'similarity': 1.0} for row in exact.data]
+
+        bands = document_identity.lsh_bands(fingerprint or {})
+        if not bands:
+            return []
+
+        candidates = self.client.table('documents').select(
+            'id, filename, text_minhash, number_minhash'
+        ).overlaps('lsh_bands', bands).execute().data or []
+
+        matches = []
+        for candidate in candidates:
+            relation = document_identity.classify(fingerprint, candidate)
+            if relation:
+                matches.append({'id': candidate['id'], 'filename': candidate['filename'], **relation})
+
+        # Text matches before translations, then by similarity
+        matches.sort(key=lambda match: (match['kind'] == 'translation', -match['similarity']))
+        return matches[:limit]
+
+    def backfill_fingerprints(self) -> int:
+        """
+        Fingerprint documents stored before near-duplicate detection, from their full_text
+
+        Their doc_hash stays as it was; the file bytes are no longer at hand.
+
+        Returns:
+            Number of documents fingerprinted
+        """
+        rows = self.client.table('documents').select('id').is_('lsh_bands', 'null').execute().data or []
+        for row in rows:
+            doc = self.client.table('documents').select('full_text').eq('id', row['id']).execute().data
+            fingerprint = document_identity.fingerprint_text(doc[0]['full_text'] if doc else '')
+            self.client.table('documents').update({
+                **fingerprint,
+                'lsh_bands': document_identity.lsh_bands(fingerprint)
+            }).eq('id', row['id']).execute()
+        return len(rows)
+
     def list_documents(self) -> List[Dict]:
-        """List all stored documents"""
+        """List all stored documents (not those whose first ingestion is unfinished)"""
         try:
             result = self.client.table('documents').select(
-                'id, filename, chunk_count, image_count, created_at'
-            ).order('created_at', desc=True).execute()
+                'id, filename, doc_hash, chunk_count, image_count, ingest_status, created_at'
+            ).neq('ingest_status', 'staging').order('created_at', desc=True).execute()
 
             return result.data if result.data else []
 
@@ -218,15 +1141,16 @@ class SupabaseManager:
     def delete_document(self, document_id: int) -> bool:
         """Delete a document and all associated chunks/images"""
         try:
-            # Delete chunks
+            # Delete chunks (other documents keep the embeddings they share)
+            chunk_ids = [row['id'] for row in self._get_stored_chunks(document_id)]
+            self._release_shared_chunks(chunk_ids)
             self.client.table('document_chunks').delete().eq(
                 'document_id', document_id
             ).execute()
 
-            # Delete images
-            self.client.table('document_images').delete().eq(
-                'document_id', document_id
-            ).execute()
+            # Delete images (other documents keep the ones they share)
+            self._release_shared_images(document_id)
+            self._delete_images(document_id=document_id)
 
             # Delete document
             self.client.table('documents').delete().eq(